@@ -1,12 +1,8 @@
-import os
-import pandas as pd
-import numpy as np
 import streamlit as st
 from src.pipeline.predict_pipeline import CustomDataPrice, CustomDataCarat, PredictPipeline
 from src.analysis import cut_distribution, color_distribution, clarity_distribution, show_clarity, average_price, price_distribution
-
-## Dataset
-dataset = pd.read_csv('data/diamonds.csv')
+from src.dataset import display_dataset
+from src.metrics import start_exporters
 
 text_header = """:wave: Welcome to **Diamond P&C Prediction**:wave:
                 
@@ -31,9 +27,8 @@ def main():
     # Main
     with tab1:
         st.subheader('📋Existing Dataset')
-        dataset.columns = ['Carat', 'Cut', 'Color', 'Clarity', 'Depth', 'Table', 'Price', 'x', 'y', 'z']
         with st.expander("👀 Show Datasets"):
-            st.write(dataset)
+            st.write(display_dataset())
         
         st.subheader(':bar_chart: Analysis')
         with st.expander("👀 Show Information & Analysis"):
@@ -111,19 +106,20 @@ def main():
                 elif not x or not y or not z: 
                     st.warning('Please fill the Measure field !!')
                 else:
-                    # Convert data into dataframe
+                    # Convert data into a stone (dict, encoded without pandas)
                     data = CustomDataPrice(carat, cut, color, clarity, depth, table, x, y, z)
                     
-                    predict_df = data.get_data_price()
+                    predict_df = data.get_stone_price()
                     
                     # get a predict pipeline
                     predict_pipeline = PredictPipeline()
                     
-                    # predict the result
-                    result = predict_pipeline.predict_price(predict_df)
+                    # predict the result, with its range
+                    low, result, high = predict_pipeline.predict_price_interval(predict_df)
                     results = round(result[0], 2)
                     
                     st.success(f'Based on your input, My prediction for your 💎 Price is around **${results:.2f}**', icon="🔎")
+                    st.caption(f'90% of similar 💎 are priced between **${low[0]:.2f}** and **${high[0]:.2f}**')
         
     
     # Carat    
@@ -167,10 +163,10 @@ def main():
                 elif not x or not y or not z: 
                         st.warning('Please fill the Measure field !!')
                 else:
-                    # Convert data into dataframe
+                    # Convert data into a stone (dict, encoded without pandas)
                     data = CustomDataCarat(cut, color, clarity, depth, table, price, x, y, z)
                     
-                    predict_df_carat = data.get_data_carat()
+                    predict_df_carat = data.get_stone_carat()
                     
                     # get a predict pipeline
                     pred_pipeline = PredictPipeline()
@@ -185,6 +181,7 @@ def main():
         
 
 if __name__ == '__main__': 
+    start_exporters() # /metrics and JSON snapshots when DIAMOND_METRICS_PORT / _SNAPSHOT_SECONDS are set
     main() 
     
     
\ No newline at end of file
@@ -1,12 +1,64 @@
+import argparse
+
 from src.components.data_ingestion import DataIngestion
 from src.components.transform_training import ModelDevelopment
+from src.components.incremental_training import IncrementalTraining
+from src.components.out_of_core_training import OutOfCoreTraining, OutOfCoreTrainingConfig
+from src.components.artifact_store import ArtifactStore
+from src.components.distributed_search import DistributedBackend, DistributedSearchConfig, parse_address
+from src.pipeline.drift import build_reference
+from src.pipeline.compiled_model import export_models
+from src.exception import CustomException
 
 
 if __name__ == "__main__":
-    # Apply Data Ingestion
-    obj = DataIngestion()
-    train_data, test_data = obj.initiate_data_ingestion() ## train and test .csv
-    
-    # Applying Transformation process into train and test data (ingestion result)
-    data_transformation = ModelDevelopment()
-    data_transformation.transform_train(train_data, test_data)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true',
+                        help="update the saved models with the rows added since the last run")
+    parser.add_argument('--out-of-core', action='store_true',
+                        help="train from a file larger than RAM, chunk by chunk (no model search)")
+    parser.add_argument('--source', default=OutOfCoreTrainingConfig.source_path,
+                        help="CSV or Parquet file for --out-of-core")
+    parser.add_argument('--chunk-size', type=int, default=OutOfCoreTrainingConfig.chunk_size)
+    parser.add_argument('--in-memory-pages', action='store_true',
+                        help="--out-of-core: keep XGBoost's quantized pages in RAM instead of on disk")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="run the model search on this many worker processes (coordinator / worker mode)")
+    parser.add_argument('--listen', default=None,
+                        help="host:port where workers from other hosts connect to the search coordinator")
+    args = parser.parse_args()
+
+    if args.incremental:
+        # Only the rows added since the last recorded run, the models are swapped if they pass the holdout check
+        print(IncrementalTraining(store=ArtifactStore()).run())
+    elif args.out_of_core:
+        # Two streaming passes over the file: preprocessing statistics, then XGBoost external memory
+        config = OutOfCoreTrainingConfig(source_path=args.source, chunk_size=args.chunk_size,
+                                         in_memory_pages=args.in_memory_pages)
+        print(OutOfCoreTraining(config).run())
+    else:
+        # Stage outputs are kept in data/artifacts, unchanged stages are not run again
+        store = ArtifactStore()
+
+        # Apply Data Ingestion
+        obj = DataIngestion(store=store)
+        train_data, test_data = obj.initiate_data_ingestion() ## train and test .csv
+
+        # Feature profile of the training split, the reference of the drift monitor
+        build_reference(train_data)
+        
+        # Model search on worker processes (local and / or remote), joblib on this machine otherwise
+        search_backend = None
+        if args.workers or args.listen:
+            host, port = parse_address(args.listen) if args.listen else ('127.0.0.1', 0)
+            search_backend = DistributedBackend(DistributedSearchConfig(host=host, port=port, local_workers=args.workers))
+
+        # Applying Transformation process into train and test data (ingestion result)
+        data_transformation = ModelDevelopment(store=store, search_backend=search_backend)
+        data_transformation.transform_train(train_data, test_data)
+
+    # NumPy-only copies of the new models, checked against them (the old ones no longer load)
+    try:
+        export_models()
+    except CustomException as e:
+        print(f"Compiled models not refreshed: {e}")
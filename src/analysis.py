@@ -1,35 +1,38 @@
 import pandas as pd
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
 
+from src.dataset import dataset_cache, dataset_aggregates, CUT_ORDER, COLOR_ORDER, CLARITY_ORDER
+
+
+do_cut = CUT_ORDER
+do_color = COLOR_ORDER
+do_clarity = CLARITY_ORDER
+
+
+# Figures are built once per version of the dataset and shared by every session
+def _cached_figure(name, builder):
+    return dataset_cache.derived(name, lambda _: builder(dataset_aggregates()))
+
+
+def _distribution_figure(counts, label):
+    import plotly.express as px # plotly is only loaded once a figure is built
+
+    df = pd.DataFrame({label: counts.index.astype(str), 'Total': counts.values})
+    return px.bar(df, x=label, y="Total", height=320, width=400)
 
-dataset = pd.read_csv('data/diamonds.csv')
-do_cut = ['Ideal', 'Premium', 'Very Good', 'Good', 'Fair']
-do_color = ['D', 'E', 'F', 'G', 'H', 'I', 'J']
-do_clarity = ['IF', 'VVS1', 'VVS2', 'VS1', 'VS2', 'SI1', 'SI2', 'I1']
 
 def cut_distribution():
-    data_cut = dataset['cut'].value_counts().reindex(do_cut)
-    df = pd.DataFrame({'Cut': data_cut.index, 'Total': data_cut.values})
-    
-    fig = px.bar(df, x="Cut", y="Total", height=320, width=400)
+    fig = _cached_figure('fig_cut', lambda agg: _distribution_figure(agg['cut_counts'], 'Cut'))
     st.plotly_chart(fig)
     
     
 def color_distribution():
-    data_color = dataset['color'].value_counts().reindex(do_color)
-    df = pd.DataFrame({'Color': data_color.index, 'Total': data_color.values})
-    
-    fig = px.bar(df, x="Color", y="Total", height=320, width=400)
+    fig = _cached_figure('fig_color', lambda agg: _distribution_figure(agg['color_counts'], 'Color'))
     st.plotly_chart(fig)
     
     
 def clarity_distribution():
-    data_clarity = dataset['clarity'].value_counts().reindex(do_clarity)
-    df = pd.DataFrame({'Clarity': data_clarity.index, 'Total': data_clarity.values})
-    
-    fig = px.bar(df, x="Clarity", y="Total", height=320, width=400)
+    fig = _cached_figure('fig_clarity', lambda agg: _distribution_figure(agg['clarity_counts'], 'Clarity'))
     st.plotly_chart(fig)
     
  
@@ -85,15 +88,12 @@ def show_clarity(clarity, container):
             st.image("image/IF.png", caption="Internal Flawless", width=280)
 
     
-def average_price():
-    container = st.container()
-    mean_cut = dataset.groupby('cut')['price'].mean().reindex(do_cut)
-    mean_color = dataset.groupby('color')['price'].mean().reindex(do_color)
-    mean_clarity = dataset.groupby('clarity')['price'].mean().reindex(do_clarity)
-    
-    mean_cut = pd.DataFrame({'cut': mean_cut.index, 'price': mean_cut.values})
-    mean_color = pd.DataFrame({'color': mean_color.index, 'price': mean_color.values})
-    mean_clarity = pd.DataFrame({'clarity': mean_clarity.index, 'price': mean_clarity.values})
+def _average_price_figure(agg):
+    import plotly.graph_objects as go
+
+    mean_cut = pd.DataFrame({'cut': agg['mean_cut'].index.astype(str), 'price': agg['mean_cut'].values})
+    mean_color = pd.DataFrame({'color': agg['mean_color'].index.astype(str), 'price': agg['mean_color'].values})
+    mean_clarity = pd.DataFrame({'clarity': agg['mean_clarity'].index.astype(str), 'price': agg['mean_clarity'].values})
 
     # Create the bar charts
     trace1 = go.Bar(
@@ -131,7 +131,12 @@ def average_price():
     )
 
     # Combine traces and create the figure
-    fig = go.Figure(data=[trace1, trace2, trace3], layout=layout)
+    return go.Figure(data=[trace1, trace2, trace3], layout=layout)
+
+
+def average_price():
+    container = st.container()
+    fig = _cached_figure('fig_average_price', _average_price_figure)
     
     container.plotly_chart(fig)
     container.markdown("""
@@ -141,20 +146,31 @@ def average_price():
     """)
 
 
-def price_distribution():
-    container = st.container()
-    trace1 = go.Histogram(
-        x=dataset['price'],
+def _price_distribution_figure(agg):
+    import plotly.graph_objects as go
+
+    # histogram is binned once here instead of shipping every price to the browser
+    edges = agg['price_hist_edges']
+    trace1 = go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=agg['price_hist_counts'],
+        width=edges[1:] - edges[:-1],
         opacity=0.75)
 
     layout = go.Layout(barmode='overlay',
                     title='💲 Diamond Price Distribution',
                     xaxis=dict(title='Diamond Price'),
                     yaxis=dict(title='Count'),
+                    bargap=0,
                     height=480
     )
 
-    fig = go.Figure(data=[trace1], layout=layout)
+    return go.Figure(data=[trace1], layout=layout)
+
+
+def price_distribution():
+    container = st.container()
+    fig = _cached_figure('fig_price_distribution', _price_distribution_figure)
     container.plotly_chart(fig)
     container.markdown('📓 **The higher the price of diamonds, the fewer there are available, and vice versa. Also, people tend to buy at the average price.**')
     
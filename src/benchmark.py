@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+from sklearn.base import clone
+
+from src.exception import CustomException
+from src.logger import logging
+from src.components.data_ingestion import DataIngestion
+from src.components.transform_training import ModelDevelopment
+from src.components.columnar_cache import read_split
+from src.validation import DataValidator
+from src.pipeline.model_registry import model_registry
+from src.pipeline.predict_pipeline import (PredictPipeline, CustomDataPrice, CustomDataCarat, PRICE_FEATURES,
+                                          single_stone, encode_stone, compute_depth)
+
+
+## Reproducible performance measurements of the project, written as JSON
+## python -m src.benchmark --scales 1 10 100
+
+DATASET_PATH = os.path.join('data', 'diamonds.csv')
+BENCHMARK_DIR = 'benchmarks'
+
+
+# Peak resident set size of the process so far (MB)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform != 'darwin' else peak / (1024 * 1024)
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+        'n': int(len(samples)),
+    }
+
+
+# Copy of the dataset enlarged `scale` times, numerics jittered by ±1% so rows are not exact duplicates
+def enlarged_dataset(scale, out_dir, seed=42):
+    file_path = os.path.join(out_dir, f'diamonds_x{scale}.csv')
+    if scale == 1:
+        return DATASET_PATH
+    if os.path.exists(file_path):
+        return file_path
+
+    data = pd.read_csv(DATASET_PATH)
+    rng = np.random.RandomState(seed)
+    with open(file_path, 'w') as file_obj:
+        for i in range(scale):
+            copy = data.copy()
+            for col in ['carat', 'depth', 'table', 'x', 'y', 'z']:
+                copy[col] = (copy[col] * rng.uniform(0.99, 1.01, len(copy))).round(2)
+            copy.to_csv(file_obj, index=False, header=i == 0)
+
+    return file_path
+
+
+def bench_ingestion(source_path, cache_dir):
+    ingestion = DataIngestion()
+    ingestion.ingestion_config.source_data_path = source_path
+    ingestion.cache.config.cache_dir = cache_dir
+
+    start = time.perf_counter()
+    train_path, test_path = ingestion.initiate_data_ingestion()
+    seconds = time.perf_counter() - start
+
+    return {'seconds': seconds, 'peak_rss_mb': peak_rss_mb()}, train_path, test_path
+
+
+# Fit time of every model family (first point of its grid) on the preprocessed training split
+def bench_training(train_path):
+    development = ModelDevelopment()
+    train_df = read_split(train_path)
+    X = train_df.drop(columns=['price'])
+    y = train_df['price']
+
+    start = time.perf_counter()
+    X = development.get_preprocessor().fit_transform(X)
+    results = {'preprocessor': {'seconds': time.perf_counter() - start}}
+
+    for family, model_dict in development.get_models().items():
+        # first point of each grid
+        params = {key.split('__', 1)[-1]: values[0] for key, values in model_dict['params'].items()}
+        model = clone(model_dict['model']).set_params(**params)
+
+        start = time.perf_counter()
+        model.fit(X, y)
+        results[family] = {'seconds': time.perf_counter() - start, 'params': params,
+                           'peak_rss_mb': peak_rss_mb()}
+        logging.info(f"Benchmark fit {family}: {results[family]['seconds']:.2f}s")
+
+    return results
+
+
+def _price_rows(data):
+    return [CustomDataPrice(r.carat, r.cut, r.color, r.clarity, r.depth, r.table, r.x, r.y, r.z)
+            for r in data.itertuples()]
+
+
+def _carat_rows(data):
+    return [CustomDataCarat(r.cut, r.color, r.clarity, r.depth, r.table, r.price, r.x, r.y, r.z)
+            for r in data.itertuples()]
+
+
+# Rows a form submit accepts: depth derived from x, y, z as the forms do, then validated
+# (an invalid stone makes predict_* raise)
+def _valid_stones(data):
+    stones = data.assign(depth=compute_depth(data['x'].to_numpy(), data['y'].to_numpy(), data['z'].to_numpy()))
+    stones, _ = DataValidator().split(stones)
+    return stones
+
+
+# Latency of one form submit: build the one-row frame + predict, every time a model call (no cache)
+def bench_single_row(data, n_requests):
+    predict_pipeline = PredictPipeline(use_cache=False)
+    model_registry.warm_up()
+    sample = _valid_stones(data).sample(n_requests, replace=True, random_state=42)
+
+    results = {}
+    for target, rows, predict in [
+        ('price', _price_rows(sample), lambda row: predict_pipeline.predict_price(row.get_data_price())),
+        ('carat', _carat_rows(sample), lambda row: predict_pipeline.predict_carat(row.get_data_carat())),
+    ]:
+        samples = []
+        for row in rows:
+            start = time.perf_counter()
+            predict(row)
+            samples.append(time.perf_counter() - start)
+        results[target] = percentiles(samples)
+
+    return results
+
+
+# Rows/sec of the batch API for several batch sizes
+def bench_batch(data, batch_sizes, repeats):
+    predict_pipeline = PredictPipeline()
+    results = {}
+
+    for batch_size in batch_sizes:
+        batch = data.sample(batch_size, replace=batch_size > len(data), random_state=42)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predict_pipeline.predict_price_batch(batch, chunk_size=batch_size)
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        results[str(batch_size)] = {
+            'seconds': best,
+            'rows_per_sec': batch_size / best if best > 0 else float('inf'),
+        }
+
+    return results
+
+
+# Price interval: fused pass (one preprocessing, point + multi-quantile model) against
+# the naive way of three separate pipelines (point, lower quantile, upper quantile)
+# Both sides preprocess the same way: a single stone goes through encode_stone (the fast encoder
+# when the pipeline has one), a batch through the sklearn preprocessor; neither validates nor logs,
+# so only the fusion is measured
+def bench_intervals(data, n_requests, batch_size=10000, repeats=3):
+    from sklearn.pipeline import Pipeline
+
+    predict_pipeline = PredictPipeline(use_cache=False)
+    point_pipeline = model_registry.get(model_registry.config.price_model_path)
+    interval_pipeline = model_registry.get(model_registry.config.interval_model_path)
+    preprocessor = point_pipeline.named_steps['preprocessor']
+
+    # one single-quantile pipeline per bound, same trees settings as the fused model
+    X = data.drop(columns=['price'])
+    matrix = preprocessor.transform(X)
+    naive = [point_pipeline]
+    for alpha in interval_pipeline.named_steps['model'].get_params()['quantile_alpha']:
+        model = clone(interval_pipeline.named_steps['model']).set_params(quantile_alpha=float(alpha))
+        naive.append(Pipeline([('preprocessor', preprocessor), ('model', model.fit(matrix, data['price']))]))
+
+    def naive_predict(features):
+        stone = single_stone(features)
+        if stone is None:
+            return [pipeline.predict(features) for pipeline in naive]
+        return [pipeline.named_steps['model'].predict(encode_stone(pipeline, stone, 'benchmark_naive'))
+                for pipeline in naive]
+
+    rows = [row.get_data_price() for row in _price_rows(_valid_stones(data).sample(n_requests, replace=True, random_state=42))]
+    batch = data.sample(batch_size, replace=batch_size > len(data), random_state=42)
+    batch_features = batch[PRICE_FEATURES]
+
+    results = {}
+    for name, predict, predict_batch in [
+        ('fused', lambda features: predict_pipeline._price_interval(None, single_stone(features)),
+         lambda: predict_pipeline._price_interval(batch_features)),
+        ('naive', naive_predict, lambda: naive_predict(batch_features)),
+    ]:
+        predict(rows[0]) # builds the encoders outside the timings
+        samples = []
+        for features in rows:
+            start = time.perf_counter()
+            predict(features)
+            samples.append(time.perf_counter() - start)
+
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predict_batch()
+            timings.append(time.perf_counter() - start)
+
+        results[name] = {
+            'single_row': percentiles(samples),
+            'batch_rows_per_sec': batch_size / min(timings),
+        }
+
+    results['single_row_speedup'] = results['naive']['single_row']['p50_ms'] / results['fused']['single_row']['p50_ms']
+    return results
+
+
+def environment():
+    import sklearn
+    import xgboost
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'xgboost': xgboost.__version__,
+    }
+
+
+def run_benchmarks(scales=(1, 10, 100), train_scales=(1,), batch_sizes=(1, 10, 100, 1000, 10000, 100000),
+                   n_requests=500, repeats=3, work_dir=None, output_path=None):
+    try:
+        work_dir = work_dir or tempfile.mkdtemp(prefix='diamond-bench-')
+        report = {'environment': environment(), 'scales': {}}
+
+        base = pd.read_csv(DATASET_PATH)
+        report['single_row'] = bench_single_row(base, n_requests)
+        report['batch'] = bench_batch(base, batch_sizes, repeats)
+        report['intervals'] = bench_intervals(base, n_requests, repeats=repeats)
+
+        for scale in scales:
+            source_path = enlarged_dataset(scale, work_dir)
+            ingestion, train_path, _ = bench_ingestion(source_path, os.path.join(work_dir, f'cache_x{scale}'))
+            scale_report = {'rows': len(base) * scale, 'ingestion': ingestion}
+            if scale in train_scales:
+                scale_report['training'] = bench_training(train_path)
+            report['scales'][str(scale)] = scale_report
+
+        report['peak_rss_mb'] = peak_rss_mb()
+
+        output_path = output_path or os.path.join(
+            BENCHMARK_DIR, f"{datetime.now().strftime('%m_%d_%Y_%H_%M_%S')}.json"
+        )
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'w') as file_obj:
+            json.dump(report, file_obj, indent=2)
+
+        logging.info(f"Benchmark results written to {output_path}")
+        return report, output_path
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, training and inference")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help="dataset sizes as multiples of data/diamonds.csv")
+    parser.add_argument('--train-scales', type=int, nargs='*', default=[1],
+                        help="scales on which every model family is fitted")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 10000, 100000])
+    parser.add_argument('--requests', type=int, default=500, help="single-row predictions per target")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--work-dir', default=None, help="where the enlarged datasets are kept")
+    parser.add_argument('--output', default=None)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report, output_path = run_benchmarks(args.scales, args.train_scales, args.batch_sizes,
+                                         args.requests, args.repeats, args.work_dir, args.output)
+    print(json.dumps(report, indent=2))
+    print(f"-> {output_path}")
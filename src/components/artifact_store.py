@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import importlib.util
+
+from dataclasses import dataclass
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import save_object, load_object, file_digest
+
+
+## Content-addressed store of the training stage outputs
+## Every output (ingestion split, fitted preprocessor, search result, final pipelines) is saved
+## under a hash of what produced it: data fingerprint, code of the stage, parameters, library
+## versions. A stage whose key is already in the store is not run again.
+## Layout: data/artifacts/<stage>/<key>.pkl (or a directory), data/artifacts/manifest.json (runs)
+
+@dataclass
+class ArtifactStoreConfig:
+    root: str = os.path.join('data', 'artifacts')
+    manifest_file: str = 'manifest.json'
+
+
+# sha256 of any JSON-able description (objects that are not JSON-able go in as str)
+def digest_json(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Version of the code of a stage: hash of the source files of its modules
+def code_version(*modules):
+    sha = hashlib.sha256()
+    for module in sorted(modules):
+        spec = importlib.util.find_spec(module)
+        with open(spec.origin, 'rb') as file_obj:
+            sha.update(module.encode())
+            sha.update(file_obj.read())
+    return sha.hexdigest()
+
+
+def library_versions():
+    import numpy
+    import pandas
+    import sklearn
+    import xgboost
+
+    return {'numpy': numpy.__version__, 'pandas': pandas.__version__,
+            'sklearn': sklearn.__version__, 'xgboost': xgboost.__version__}
+
+
+# Estimator as class + parameters (reprs of some estimators contain memory addresses)
+def describe_estimator(estimator):
+    return {'class': f"{type(estimator).__module__}.{type(estimator).__name__}",
+            'params': estimator.get_params(deep=False)}
+
+
+# Content of an ingestion output: the split index files and the columns next to them, or a CSV
+def split_fingerprint(*file_paths):
+    digests = {}
+    for file_path in file_paths:
+        digests[os.path.basename(file_path)] = file_digest(file_path)
+        if file_path.endswith('.npy'):
+            cache_dir = os.path.dirname(file_path)
+            with open(os.path.join(cache_dir, 'meta.json')) as file_obj:
+                columns = json.load(file_obj)['columns']
+            for col in columns:
+                digests[f'{col}.npy'] = file_digest(os.path.join(cache_dir, f'{col}.npy'))
+    return digest_json(digests)
+
+
+class ArtifactStore:
+    def __init__(self, config=None):
+        self.config = config or ArtifactStoreConfig()
+        self.stages = {} # stage -> key used in this run
+        self.published = {} # file path -> [stage, key] published in this run
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.config.root, self.config.manifest_file)
+
+    def path(self, stage, key, suffix='.pkl'):
+        return os.path.join(self.config.root, stage, f'{key}{suffix}')
+
+    def key(self, stage, inputs):
+        return digest_json({'stage': stage, 'inputs': inputs})
+
+    # object output: loaded from the store, or built and saved
+    def cached(self, stage, inputs, builder):
+        try:
+            key = self.key(stage, inputs)
+            file_path = self.path(stage, key)
+            self.stages[stage] = key
+
+            if os.path.exists(file_path):
+                self.hits += 1
+                logging.info(f"Stage {stage}: reusing {key[:12]}")
+                return load_object(file_path), key
+
+            self.misses += 1
+            start = time.perf_counter()
+            obj = builder()
+            save_object(file_path=file_path, obj=obj)
+            logging.info(f"Stage {stage}: built {key[:12]} in {time.perf_counter() - start:.2f}s")
+            return obj, key
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # directory output: `builder(dir_path)` fills a scratch directory that is renamed into place
+    def cached_dir(self, stage, inputs, builder):
+        try:
+            key = self.key(stage, inputs)
+            dir_path = self.path(stage, key, suffix='')
+            self.stages[stage] = key
+
+            if os.path.isdir(dir_path):
+                self.hits += 1
+                logging.info(f"Stage {stage}: reusing {key[:12]}")
+                return dir_path, key
+
+            self.misses += 1
+            tmp_path = f'{dir_path}.tmp'
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            builder(tmp_path)
+            os.replace(tmp_path, dir_path)
+            logging.info(f"Stage {stage}: built {key[:12]}")
+            return dir_path, key
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # copy a stored output onto the fixed path the app reads (left alone when already identical)
+    def publish(self, stage, key, file_path):
+        try:
+            source = self.path(stage, key)
+            if not os.path.exists(file_path) or file_digest(file_path) != file_digest(source):
+                os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+                shutil.copyfile(source, f'{file_path}.tmp')
+                os.replace(f'{file_path}.tmp', file_path)
+                logging.info(f"Published {stage} {key[:12]} to {file_path}")
+            self.published[file_path] = [stage, key]
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def runs(self):
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path) as file_obj:
+            return json.load(file_obj)['runs']
+
+    def _write_runs(self, runs):
+        os.makedirs(self.config.root, exist_ok=True)
+        with open(f'{self.manifest_path}.tmp', 'w') as file_obj:
+            json.dump({'runs': runs}, file_obj, indent=2)
+        os.replace(f'{self.manifest_path}.tmp', self.manifest_path)
+
+    # append this run (stage keys, published artifacts, metrics) to the manifest
+    def record_run(self, metrics=None, **fields):
+        runs = self.runs()
+        run = {
+            'run': len(runs) + 1,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'stages': dict(self.stages),
+            'published': dict(self.published),
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'metrics': metrics or {},
+            **fields,
+        }
+        self._write_runs(runs + [run])
+        return run
+
+    # publish the artifacts of an earlier run again (default: the run before the last one)
+    def rollback(self, run_id=None):
+        try:
+            runs = self.runs()
+            if run_id is None:
+                if len(runs) < 2:
+                    raise ValueError("No earlier run to roll back to")
+                run_id = runs[-2]['run']
+            run = next((run for run in runs if run['run'] == run_id), None)
+            if run is None:
+                raise ValueError(f"Unknown run {run_id}")
+
+            self.stages = dict(run['stages'])
+            self.published = {}
+            for file_path, (stage, key) in run['published'].items():
+                self.publish(stage, key, file_path)
+
+            return self.record_run(run['metrics'], rollback_of=run_id)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Training runs recorded in the artifact store")
+    parser.add_argument('--rollback', nargs='?', type=int, const=-1, default=None,
+                        help="publish the artifacts of RUN again (default: the run before the last one)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = ArtifactStore()
+    if args.rollback is not None:
+        run = store.rollback(None if args.rollback == -1 else args.rollback)
+        print(f"Rolled back to run {run['rollback_of']}")
+    for run in store.runs():
+        print(f"{run['run']:4d}  {run['timestamp']}  hits {run['cache_hits']} misses {run['cache_misses']}  "
+              f"{json.dumps(run['metrics'])}")
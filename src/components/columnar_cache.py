@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+
+from src.exception import CustomException
+from src.logger import logging
+from src.dataset import CUT_ORDER, COLOR_ORDER, CLARITY_ORDER
+
+
+CATEGORICAL_COLUMNS = {'cut': CUT_ORDER, 'color': COLOR_ORDER, 'clarity': CLARITY_ORDER}
+NUMERIC_DTYPE = np.float32
+CODE_DTYPE = np.int8
+
+
+@dataclass
+class ColumnarCacheConfig:
+    cache_dir: str = os.path.join('data', 'cache')
+    meta_file: str = 'meta.json'
+    train_index_file: str = 'train_idx.npy'
+    test_index_file: str = 'test_idx.npy'
+
+
+## Typed, column-per-file copy of the dataset
+## numerics as float32, grades as int8 codes, splits as row index arrays
+class ColumnarCache:
+    def __init__(self, config=None):
+        self.config = config or ColumnarCacheConfig()
+
+    def _path(self, name):
+        return os.path.join(self.config.cache_dir, name)
+
+    @property
+    def train_index_path(self):
+        return self._path(self.config.train_index_file)
+
+    @property
+    def test_index_path(self):
+        return self._path(self.config.test_index_file)
+
+    def write(self, data, source=None):
+        try:
+            os.makedirs(self.config.cache_dir, exist_ok=True)
+
+            columns = []
+            for col in data.columns:
+                if col in CATEGORICAL_COLUMNS:
+                    codes = pd.Categorical(data[col], categories=CATEGORICAL_COLUMNS[col]).codes.astype(CODE_DTYPE)
+                    np.save(self._path(f'{col}.npy'), codes)
+                else:
+                    np.save(self._path(f'{col}.npy'), data[col].to_numpy(dtype=NUMERIC_DTYPE))
+                columns.append(col)
+
+            meta = {
+                'columns': columns,
+                'categories': {col: cats for col, cats in CATEGORICAL_COLUMNS.items() if col in columns},
+                'n_rows': len(data),
+                'source': source,
+            }
+            with open(self._path(self.config.meta_file), 'w') as file_obj:
+                json.dump(meta, file_obj, indent=2)
+
+            logging.info(f"Wrote columnar cache of {len(data)} rows into {self.config.cache_dir}")
+            return meta
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def write_split(self, train_idx, test_idx):
+        np.save(self.train_index_path, np.asarray(train_idx, dtype=np.int64))
+        np.save(self.test_index_path, np.asarray(test_idx, dtype=np.int64))
+        return self.train_index_path, self.test_index_path
+
+    def meta(self):
+        with open(self._path(self.config.meta_file)) as file_obj:
+            return json.load(file_obj)
+
+    # memory-mapped column arrays, nothing is read before it is used
+    def arrays(self):
+        try:
+            meta = self.meta()
+            return {col: np.load(self._path(f'{col}.npy'), mmap_mode='r') for col in meta['columns']}
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # DataFrame of all rows, or of the rows in `index`: only the columns are memory-mapped, the frame
+    # itself is a copy of the float32 / int8 values (the rows are gathered, the codes become Categoricals
+    # and pandas stacks the columns into blocks)
+    def frame(self, index=None):
+        try:
+            meta = self.meta()
+            columns = {}
+            for col, values in self.arrays().items():
+                if index is not None:
+                    values = values[index]
+                if col in meta['categories']:
+                    values = pd.Categorical.from_codes(values, categories=meta['categories'][col])
+                columns[col] = values
+
+            return pd.DataFrame(columns, copy=False)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+# Train / test frame from an ingestion output: a split index inside a cache dir (one gather copy
+# of the split's rows) or a plain CSV
+def read_split(file_path):
+    if file_path.endswith('.npy'):
+        cache = ColumnarCache(ColumnarCacheConfig(cache_dir=os.path.dirname(file_path)))
+        return cache.frame(np.load(file_path))
+    return pd.read_csv(file_path)
@@ -1,5 +1,6 @@
 import os
 import sys
+import numpy as np
 import pandas as pd
 from src.exception import CustomException
 from src.logger import logging
@@ -7,38 +8,73 @@ from src.logger import logging
 from sklearn.model_selection import train_test_split
 from dataclasses import dataclass
 
-from src.components.transform_training import *
+from src.components.columnar_cache import ColumnarCache, ColumnarCacheConfig
+from src.utils import file_digest
+from src.validation import DataValidator
 
 @dataclass
 class DataIngestionConfig:
-    raw_data_path: str = os.path.join('data', 'data.csv')
-    train_data_path: str = os.path.join('data', 'train.csv')
-    test_data_path: str = os.path.join('data', 'test.csv')
+    source_data_path: str = os.path.join('data', 'diamonds.csv')
+    cache_dir: str = os.path.join('data', 'cache')
+    test_size: float = 0.2
+    random_state: int = 42
+    quarantine_file: str = 'quarantine.csv' # rows that failed validation, next to the cache
     
 
 class DataIngestion:
-    def __init__(self):
+    def __init__(self, store=None):
         self.ingestion_config = DataIngestionConfig()
+        self.cache = ColumnarCache(ColumnarCacheConfig(cache_dir=self.ingestion_config.cache_dir))
+        self.store = store # ArtifactStore: the output is kept per version of the source data
+        self.validator = DataValidator()
+        
+    # the dataset without the rows that fail validation (written to quarantine_dir if given)
+    def read_source(self, quarantine_dir=None):
+        data = pd.read_csv(self.ingestion_config.source_data_path) # read the dataset as dataframe
+        
+        quarantine_path = os.path.join(quarantine_dir, self.ingestion_config.quarantine_file) if quarantine_dir else None
+        data, result = self.validator.split(data, quarantine_path=quarantine_path)
+        if len(data) < len(result):
+            logging.info(f"Quarantined {len(result) - len(data)} of {len(result)} rows: {result.counts()}")
+        
+        return data
+        
+    def _ingest(self, cache):
+        data = self.read_source(cache.config.cache_dir)
+        
+        cache.write(data, source=self.ingestion_config.source_data_path) # typed columnar copy of the dataset
+        
+        # logging.info("Train Test Split initiated")
+        train_idx, test_idx = train_test_split(np.arange(len(data)), test_size=self.ingestion_config.test_size,
+                                               random_state=self.ingestion_config.random_state) # split the row indices
+        
+        return cache.write_split(train_idx, test_idx) # save the split as index arrays
         
     def initiate_data_ingestion(self):        
         logging.info("Entered the data ingestion method or component") 
         try:
-            data = pd.read_csv('data/diamonds.csv') # read the dataset as dataframe
-            
-            os.makedirs(os.path.dirname(self.ingestion_config.train_data_path), exist_ok=True) # make directory for the artifacts
-            data.to_csv(self.ingestion_config.raw_data_path, index=False, header=True) # save the train data
-            
-            # logging.info("Train Test Split initiated")
-            train_set, test_set = train_test_split(data, test_size=0.2, random_state=42) # train and split the data
-            
-            train_set.to_csv(self.ingestion_config.train_data_path, index=False, header=True) # save the train data
-            test_set.to_csv(self.ingestion_config.test_data_path, index=False, header=True) # save the test data
+            if self.store is None:
+                train_path, test_path = self._ingest(self.cache)
+            else:
+                from src.components.artifact_store import code_version
+                
+                inputs = {
+                    'data': file_digest(self.ingestion_config.source_data_path),
+                    'code': code_version(__name__, 'src.components.columnar_cache', 'src.validation'),
+                    'test_size': self.ingestion_config.test_size,
+                    'random_state': self.ingestion_config.random_state,
+                }
+                cache_dir, _ = self.store.cached_dir(
+                    'ingestion', inputs, lambda dir_path: self._ingest(ColumnarCache(ColumnarCacheConfig(cache_dir=dir_path)))
+                )
+                self.cache = ColumnarCache(ColumnarCacheConfig(cache_dir=cache_dir))
+                train_path, test_path = self.cache.train_index_path, self.cache.test_index_path
             
             # logging.info("Ingestion of data is completed")
             
             return (
-                self.ingestion_config.train_data_path,
-                self.ingestion_config.test_data_path
+                train_path,
+                test_path
             )
             
         except Exception as e:
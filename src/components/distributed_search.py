@@ -0,0 +1,303 @@
+import os
+import sys
+import time
+import queue
+import shutil
+import socket
+import secrets
+import argparse
+import threading
+import numpy as np
+import multiprocessing
+
+from dataclasses import dataclass
+from joblib import Parallel, delayed
+from multiprocessing.connection import Listener, Client
+
+from src.exception import CustomException
+from src.logger import logging
+from src.components.model_search import _prepare_fold, _fit_and_score
+
+
+## Coordinator / worker backend for ModelSearch, for searches larger than one machine
+## The coordinator fits the preprocessor per fold and writes the transformed folds as .npy files to a
+## shared directory; workers (processes on this box or on other hosts) memory-map them, so the data is
+## never sent over the wire. Tasks (estimator, params, fold, n_rows) go out one at a time to whichever
+## worker is free and the R2 comes back. A task whose worker dies or times out is handed to another
+## worker; a task that has taken down `max_attempts` workers scores -inf like a failing candidate.
+## Messages are pickled over multiprocessing.connection (TCP, HMAC authentication with the authkey).
+
+AUTHKEY_ENV = 'DIAMOND_SEARCH_AUTHKEY'
+FOLD_ARRAYS = ('X_train', 'y_train', 'X_val', 'y_val')
+
+
+@dataclass
+class DistributedSearchConfig:
+    host: str = '127.0.0.1' # listen on 0.0.0.0 to accept workers from other hosts
+    port: int = 0 # 0: any free port (local workers only)
+    local_workers: int = 0 # worker processes started on this box
+    shared_dir: str = os.path.join('data', 'cache', 'search') # must be mounted on every worker host
+    task_timeout: float = None # seconds before a silent worker is considered dead (None: wait for the connection to drop)
+    max_attempts: int = 3
+    connect_timeout: float = 60.0 # seconds to wait for a worker while tasks are pending
+    authkey: bytes = None # default: $DIAMOND_SEARCH_AUTHKEY, random when only local workers are used
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def _authkey(config):
+    if config.authkey is not None:
+        return config.authkey
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode()
+    if config.host not in ('127.0.0.1', 'localhost'):
+        raise ValueError(f"Set {AUTHKEY_ENV} (the same on every host) to accept remote workers")
+    return secrets.token_hex(16).encode()
+
+
+# transformed folds as plain arrays, written atomically like the other artifacts
+def write_folds(folds, dir_path):
+    os.makedirs(dir_path, exist_ok=True)
+    for fold_idx, fold in enumerate(folds):
+        for name, array in zip(FOLD_ARRAYS, fold):
+            if hasattr(array, 'toarray'):
+                array = array.toarray()
+            file_path = os.path.join(dir_path, f'fold{fold_idx}_{name}.npy')
+            tmp_path = file_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp_path, file_path)
+
+
+def read_fold(dir_path, fold_idx):
+    return tuple(np.load(os.path.join(dir_path, f'fold{fold_idx}_{name}.npy'), mmap_mode='r') for name in FOLD_ARRAYS)
+
+
+## Worker: connect, then score tasks until the coordinator says stop or goes away
+## data_dir replaces the coordinator's shared_dir when the share is mounted elsewhere on this host
+def run_worker(address, authkey, data_dir=None, retry_seconds=30.0):
+    deadline = time.monotonic() + retry_seconds
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+    folds = {} # (run dir, fold) -> memory-mapped arrays
+    with conn:
+        # a coordinator that is gone (finished, killed, network down) ends the worker quietly;
+        # BrokenPipeError / ConnectionResetError are OSErrors
+        try:
+            conn.send(('hello', socket.gethostname(), os.getpid()))
+        except (EOFError, OSError):
+            return
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == 'stop':
+                return
+
+            _, task_id, run_dir, fold_idx, model, params, n_rows = message
+            if data_dir is not None:
+                run_dir = os.path.join(data_dir, os.path.basename(run_dir))
+            if (run_dir, fold_idx) not in folds:
+                folds[(run_dir, fold_idx)] = read_fold(run_dir, fold_idx)
+
+            start = time.perf_counter()
+            score = _fit_and_score(model, params, folds[(run_dir, fold_idx)], n_rows)
+            try:
+                conn.send(('result', task_id, score, time.perf_counter() - start))
+            except (EOFError, OSError):
+                logging.info(f"Coordinator went away before task {task_id} was reported, worker stopping")
+                return
+
+
+def _local_worker(address, authkey):
+    try:
+        run_worker(address, authkey)
+    except KeyboardInterrupt:
+        pass
+
+
+class DistributedBackend:
+    single_threaded = True # one task per worker process at a time
+
+    def __init__(self, config=None, n_jobs=-1):
+        self.config = config or DistributedSearchConfig()
+        self.n_jobs = n_jobs # for fitting the fold preprocessors on the coordinator
+        self.address = None
+        self.workers = {} # worker name -> tasks done
+        self.dead_workers = []
+
+    def __enter__(self):
+        config = self.config
+        self._authkey = _authkey(config)
+        self._listener = Listener((config.host, config.port), authkey=self._authkey)
+        self.address = self._listener.address
+        self._tasks = queue.Queue()
+        self._results = {}
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._closing = False
+        self._live = 0
+        self._last_live = time.monotonic()
+        self._run_dir = os.path.join(config.shared_dir, f'run-{os.getpid()}-{secrets.token_hex(4)}')
+
+        threading.Thread(target=self._accept, name='search-accept', daemon=True).start()
+
+        context = multiprocessing.get_context('spawn')
+        self._processes = [
+            context.Process(target=_local_worker, args=(self.address, self._authkey), daemon=True)
+            for _ in range(config.local_workers)
+        ]
+        for process in self._processes:
+            process.start()
+        logging.info(f"Search coordinator listening on {self.address[0]}:{self.address[1]}, "
+                     f"{config.local_workers} local workers")
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self._closing = True
+        for _ in range(self._live + len(self._processes)):
+            self._tasks.put(None) # wakes every worker thread, which tells its worker to stop
+        self._listener.close()
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        shutil.rmtree(self._run_dir, ignore_errors=True)
+        logging.info(f"Search workers: {self.workers}, lost: {self.dead_workers}")
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                if self._closing:
+                    return
+                continue # failed authentication / handshake
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    # one thread per connected worker: hand it tasks until it stops answering
+    def _serve(self, conn):
+        try:
+            _, host, pid = conn.recv()
+        except (EOFError, OSError, ValueError):
+            conn.close()
+            return
+        name = f'{host}:{pid}'
+        with self._lock:
+            self._live += 1
+            self.workers[name] = 0
+        logging.info(f"Search worker {name} connected")
+
+        task = None
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    conn.send(('stop',))
+                    return
+                task_id, message = task
+                conn.send(('task', task_id, self._run_dir) + message)
+                if self.config.task_timeout is not None and not conn.poll(self.config.task_timeout):
+                    raise TimeoutError(f"no answer in {self.config.task_timeout}s")
+                _, result_id, score, seconds = conn.recv()
+                self._finish(result_id, score)
+                with self._lock:
+                    self.workers[name] += 1
+                task = None
+        except (EOFError, OSError, TimeoutError) as e:
+            logging.info(f"Search worker {name} lost: {e}")
+            with self._lock:
+                self.dead_workers.append(name)
+            if task is not None:
+                self._retry(task)
+        finally:
+            conn.close()
+            with self._lock:
+                self._live -= 1
+                self._last_live = time.monotonic()
+                self._done.notify_all()
+
+    def _finish(self, task_id, score):
+        with self._lock:
+            self._results[task_id] = score
+            self._done.notify_all()
+
+    def _retry(self, task):
+        task_id, message = task
+        with self._lock:
+            self._attempts[task_id] = self._attempts.get(task_id, 1) + 1
+            attempts = self._attempts[task_id]
+        if attempts > self.config.max_attempts:
+            fold, model, params, n_rows = message
+            logging.info(f"Search task {type(model).__name__} {params} (fold {fold}) lost {attempts - 1} workers, "
+                         f"scored -inf")
+            self._finish(task_id, -np.inf)
+        else:
+            self._tasks.put(task)
+
+    def prepare_folds(self, preprocessor, X, y, splits):
+        folds = Parallel(n_jobs=self.n_jobs)(delayed(_prepare_fold)(preprocessor, X, y, train_idx, val_idx)
+                                             for train_idx, val_idx in splits)
+        write_folds(folds, self._run_dir)
+        return len(folds)
+
+    def score(self, tasks):
+        with self._lock:
+            self._results = {}
+            self._attempts = {}
+        for task_id, (model, params, fold, n_rows) in enumerate(tasks):
+            self._tasks.put((task_id, (fold, model, params, n_rows)))
+
+        with self._lock:
+            while len(self._results) < len(tasks):
+                if self._live == 0 and time.monotonic() - self._last_live > self.config.connect_timeout:
+                    raise ConnectionError(f"No search worker for {self.config.connect_timeout}s, "
+                                          f"{len(tasks) - len(self._results)} tasks left")
+                self._done.wait(timeout=1.0)
+            return [self._results[task_id] for task_id in range(len(tasks))]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Worker of a distributed model search")
+    parser.add_argument('--connect', required=True, help="coordinator address, host:port")
+    parser.add_argument('--processes', type=int, default=1, help="worker processes on this host (one per core)")
+    parser.add_argument('--data-dir', default=None,
+                        help="where the coordinator's shared_dir is mounted on this host, if not at the same path")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    try:
+        args = parse_args(argv)
+        authkey = os.environ.get(AUTHKEY_ENV)
+        if not authkey:
+            raise ValueError(f"Set {AUTHKEY_ENV} to the coordinator's key")
+        address = parse_address(args.connect)
+
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=run_worker, args=(address, authkey.encode(), args.data_dir))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    main()
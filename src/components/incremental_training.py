@@ -0,0 +1,242 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import load_object, evaluate_model, file_digest
+from src.components.data_ingestion import DataIngestion
+from src.components.transform_training import ModelDevelopment
+from src.components.columnar_cache import ColumnarCache, ColumnarCacheConfig
+from src.components.artifact_store import ArtifactStore, code_version, split_fingerprint
+
+
+## Incremental retraining: only the rows added to the dataset since the last training run
+## are used to update the models, the full search only runs when there is no run to start from.
+## Everything goes through the ArtifactStore like a full run: the rows the current models were
+## trained / evaluated on (and their side of the split) are the ingestion split of the last recorded
+## run, the updated split is a new `ingestion` stage, the candidate pipelines are stored as
+## `final_pipeline` / `interval_pipeline` stages, and an accepted update is published and recorded as
+## a run, so `artifact_store --rollback` undoes it and the next incremental run starts from it.
+
+@dataclass
+class IncrementalTrainingConfig:
+    n_rounds: int = 50 # boosting rounds added per update
+    learning_rate: float = 0.1
+    replay_ratio: float = 1.0 # old training rows mixed in per new row, keeps the update from forgetting
+    max_mae_increase: float = 0.01 # holdout loss the update may lose (relative, MAE / pinball) and still be swapped in
+    test_modulo: int = 5 # new rows with hash % test_modulo == 0 join the holdout (20%)
+    random_state: int = 42
+
+
+# One uint64 per row, independent of the row position
+def row_hashes(data):
+    return pd.util.hash_pandas_object(data, index=False).to_numpy(dtype=np.uint64)
+
+
+# Mean pinball loss of the quantile bounds, summed over the quantiles
+def pinball_loss(y, bounds, alphas):
+    y = np.asarray(y, dtype=np.float64)
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(len(y), -1)
+    loss = 0.0
+    for i, alpha in enumerate(alphas):
+        error = y - bounds[:, i]
+        loss += float(np.mean(np.maximum(alpha * error, (alpha - 1) * error)))
+    return loss
+
+
+# Keep boosting a fitted XGBoost model on new rows, the preprocessor stays as it was fitted
+def continue_boosting(pipeline, X, y, n_rounds, learning_rate):
+    preprocessor = pipeline.named_steps['preprocessor']
+    model = pipeline.named_steps['model']
+
+    updated = clone(model).set_params(n_estimators=n_rounds, learning_rate=learning_rate)
+    updated.fit(preprocessor.transform(X), y, xgb_model=model.get_booster())
+
+    return Pipeline(steps=[
+        ('preprocessor', preprocessor),
+        ('model', updated)
+    ])
+
+
+class IncrementalTraining:
+    def __init__(self, config=None, store=None):
+        self.config = config or IncrementalTrainingConfig()
+        self.store = store or ArtifactStore()
+        self.ingestion = DataIngestion(store=self.store)
+        self.development = ModelDevelopment(store=self.store)
+
+    # first run: full ingestion + search, recorded in the store
+    def full_run(self):
+        train_path, test_path = self.ingestion.initiate_data_ingestion()
+        self.development.transform_train(train_path, test_path)
+        return {'mode': 'full', 'rows': len(np.load(train_path)) + len(np.load(test_path)), 'accepted': True}
+
+    def _cache(self, cache_dir):
+        return ColumnarCache(ColumnarCacheConfig(cache_dir=cache_dir))
+
+    # rows of a recorded run (hashes of its ingestion split) and their side of the split
+    def _known_rows(self, run):
+        cache = self._cache(self.store.path('ingestion', run['stages']['ingestion'], suffix=''))
+        is_test = np.zeros(cache.meta()['n_rows'], dtype=bool)
+        is_test[np.load(cache.test_index_path)] = True
+        return row_hashes(cache.frame()), is_test
+
+    # split of the current rows: known rows keep their side, new rows are assigned by hash;
+    # a row repeated in the appended batch is only new once (its copies follow it to its side)
+    def _split(self, hashes, known_rows):
+        known_hashes, known_is_test = known_rows
+        is_known = np.isin(hashes, known_hashes)
+        is_test = np.isin(hashes, known_hashes[known_is_test])
+        is_test |= ~is_known & (hashes % np.uint64(self.config.test_modulo) == 0)
+
+        first = np.zeros(len(hashes), dtype=bool)
+        first[np.unique(hashes, return_index=True)[1]] = True
+        return is_known, ~is_known & first, is_test
+
+    # ingestion of the current dataset with the split of the last run carried over
+    # (the new rows are listed in new_idx.npy next to the split)
+    def _ingest(self, dir_path, known_rows):
+        cache = self._cache(dir_path)
+        data = self.ingestion.read_source(dir_path)
+        cache.write(data, source=self.ingestion.ingestion_config.source_data_path)
+
+        hashes = row_hashes(cache.frame())
+        is_known, is_new, is_test = self._split(hashes, known_rows)
+        cache.write_split(np.flatnonzero(~is_test), np.flatnonzero(is_test))
+        np.save(os.path.join(dir_path, 'known_idx.npy'), np.flatnonzero(is_known))
+        np.save(os.path.join(dir_path, 'new_idx.npy'), np.flatnonzero(is_new))
+
+    # XGBoost keeps boosting on the update rows, any other model is refit (same parameters) on all training rows
+    def _candidate(self, pipeline, cache, update_df, train_idx):
+        if type(pipeline.named_steps['model']).__name__ == 'XGBRegressor':
+            return continue_boosting(pipeline, update_df.drop(columns=['price']), update_df['price'],
+                                     self.config.n_rounds, self.config.learning_rate)
+
+        train_df = cache.frame(train_idx)
+        return clone(pipeline).fit(train_df.drop(columns=['price']), train_df['price'])
+
+    # the interval model follows the price model: more rounds on the same preprocessor,
+    # or a refit when the preprocessor was refit with it
+    def _interval_candidate(self, interval, candidate, cache, update_df, train_idx):
+        if type(candidate.named_steps['model']).__name__ == 'XGBRegressor':
+            return continue_boosting(interval, update_df.drop(columns=['price']), update_df['price'],
+                                     self.config.n_rounds, self.config.learning_rate)
+
+        train_df = cache.frame(train_idx)
+        preprocessor = candidate.named_steps['preprocessor']
+        model = clone(interval.named_steps['model'])
+        model.fit(preprocessor.transform(train_df.drop(columns=['price'])), train_df['price'])
+        return Pipeline(steps=[
+            ('preprocessor', preprocessor),
+            ('model', model)
+        ])
+
+    def run(self):
+        try:
+            start = time.perf_counter()
+            config = self.config
+            store = self.store
+            transform_config = self.development.data_transformation_config
+
+            runs = store.runs()
+            last = runs[-1] if runs else None
+            if (last is None or 'ingestion' not in last['stages']
+                    or not os.path.isdir(store.path('ingestion', last['stages']['ingestion'], suffix=''))
+                    or not os.path.exists(transform_config.final_pipeline)):
+                logging.info("No recorded training run to update, running the full training")
+                return self.full_run()
+
+            # this run starts as a copy of the last one: what is not replaced stays published
+            store.stages = dict(last['stages'])
+            store.published = {file_path: list(entry) for file_path, entry in last['published'].items()}
+
+            inputs = {
+                'data': file_digest(self.ingestion.ingestion_config.source_data_path),
+                'base': last['stages']['ingestion'],
+                'test_modulo': config.test_modulo,
+                'code': code_version(__name__, 'src.components.columnar_cache', 'src.validation'),
+            }
+            cache_dir, _ = store.cached_dir('ingestion', inputs,
+                                            lambda dir_path: self._ingest(dir_path, self._known_rows(last)))
+            cache = self._cache(cache_dir)
+            train_idx, test_idx = np.load(cache.train_index_path), np.load(cache.test_index_path)
+            known_idx, new_idx = np.load(os.path.join(cache_dir, 'known_idx.npy')), np.load(os.path.join(cache_dir, 'new_idx.npy'))
+            new_train = np.setdiff1d(new_idx, test_idx)
+
+            report = {'mode': 'incremental', 'rows': len(train_idx) + len(test_idx), 'new_rows': len(new_idx),
+                      'new_train_rows': len(new_train), 'new_test_rows': len(new_idx) - len(new_train)}
+            if not len(new_train):
+                # the new test rows (if any) join the holdout of the current models
+                logging.info(f"No new training rows ({report['new_rows']} new rows in total), models kept")
+                if len(new_idx):
+                    store.record_run(report, mode='incremental')
+                return {**report, 'accepted': False}
+
+            rng = np.random.RandomState(config.random_state)
+            old_train = np.setdiff1d(known_idx, test_idx)
+            n_replay = min(len(old_train), int(round(config.replay_ratio * len(new_train))))
+            update_idx = np.concatenate([new_train, rng.choice(old_train, n_replay, replace=False)])
+
+            update_df = cache.frame(update_idx)
+            test_df = cache.frame(test_idx)
+            X_test, y_test = test_df.drop(columns=['price']), test_df['price']
+
+            update_inputs = {
+                'split': split_fingerprint(cache.train_index_path, cache.test_index_path),
+                'config': vars(config), 'code': code_version(__name__),
+            }
+            current = load_object(transform_config.final_pipeline)
+            candidate, candidate_key = store.cached(
+                'final_pipeline', {**update_inputs, 'base': file_digest(transform_config.final_pipeline)},
+                lambda: self._candidate(current, cache, update_df, train_idx)
+            )
+
+            # holdout check: the old and the new test rows, both models on the same rows
+            current_mae, _, current_r2 = evaluate_model(y_test, current.predict(X_test))
+            candidate_mae, _, candidate_r2 = evaluate_model(y_test, candidate.predict(X_test))
+            accepted = candidate_mae <= current_mae * (1 + config.max_mae_increase)
+            report.update({
+                'current_mae': float(current_mae), 'candidate_mae': float(candidate_mae),
+                'current_r2': float(current_r2), 'candidate_r2': float(candidate_r2),
+            })
+
+            # the interval model passes the same check (pinball loss of its bounds); the two models
+            # are swapped together, serving scores both on the point model's preprocessing
+            interval_key = None
+            if os.path.exists(transform_config.interval_pipeline):
+                interval = load_object(transform_config.interval_pipeline)
+                interval_candidate, interval_key = store.cached(
+                    'interval_pipeline', {**update_inputs, 'base': file_digest(transform_config.interval_pipeline),
+                                          'final_pipeline': candidate_key},
+                    lambda: self._interval_candidate(interval, candidate, cache, update_df, train_idx)
+                )
+                alphas = interval.named_steps['model'].get_params()['quantile_alpha']
+                current_loss = pinball_loss(y_test, interval.predict(X_test), alphas)
+                candidate_loss = pinball_loss(y_test, interval_candidate.predict(X_test), alphas)
+                accepted = accepted and candidate_loss <= current_loss * (1 + config.max_mae_increase)
+                report.update({'current_pinball': current_loss, 'candidate_pinball': candidate_loss})
+            report['accepted'] = bool(accepted)
+
+            if accepted:
+                store.publish('final_pipeline', candidate_key, transform_config.final_pipeline)
+                if interval_key is not None:
+                    store.publish('interval_pipeline', interval_key, transform_config.interval_pipeline)
+                store.record_run({'test_mae': float(candidate_mae), 'test_r2': float(candidate_r2),
+                                  'new_rows': report['new_rows']}, mode='incremental')
+                logging.info(f"Swapped in the updated models (holdout MAE {current_mae:.2f} -> {candidate_mae:.2f})")
+            else:
+                # no run is recorded: these rows are retried with the next batch of new rows
+                logging.info(f"Rejected the updated models: {report}")
+
+            report['seconds'] = time.perf_counter() - start
+            return report
+
+        except Exception as e:
+            raise CustomException(e, sys)
@@ -0,0 +1,175 @@
+import sys
+import math
+import time
+import numpy as np
+
+from dataclasses import dataclass, field
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold, ParameterGrid
+
+from src.exception import CustomException
+from src.logger import logging
+
+
+@dataclass
+class ModelSearchConfig:
+    cv: int = 5
+    n_jobs: int = -1 # one worker pool shared by every model family
+    factor: int = 3 # successive halving: keep 1/factor of the candidates each round
+    min_resources: int = 2000 # training rows per fold in the first round
+    random_state: int = 42
+
+
+@dataclass
+class SearchResult:
+    best_family: str
+    best_params: dict
+    best_score: float
+    families: dict = field(default_factory=dict) # family -> best params / score / round reached
+    rounds: list = field(default_factory=list)
+
+
+# Fit the preprocessor once per fold, candidates only ever see the transformed arrays
+def _prepare_fold(preprocessor, X, y, train_idx, val_idx):
+    fold_preprocessor = clone(preprocessor)
+    X_fold_train = fold_preprocessor.fit_transform(X.iloc[train_idx])
+    X_fold_val = fold_preprocessor.transform(X.iloc[val_idx])
+    return X_fold_train, y[train_idx], X_fold_val, y[val_idx]
+
+
+# Train one (candidate, fold) pair on the first n_rows of the fold, score it on the validation part
+def _fit_and_score(model, params, fold, n_rows):
+    X_fold_train, y_fold_train, X_fold_val, y_fold_val = fold
+    try:
+        model = clone(model).set_params(**params)
+        model.fit(X_fold_train[:n_rows], y_fold_train[:n_rows])
+        return r2_score(y_fold_val, model.predict(X_fold_val))
+    except Exception as e:
+        # the candidate is dropped; the search stops if every candidate fails
+        logging.warning(f"Candidate {type(model).__name__} {params} failed on {n_rows} rows: {e!r}")
+        return -np.inf
+
+
+## Runs the search's work on one machine's joblib pool
+## A backend prepares the folds once (`prepare_folds`) and scores (candidate, fold) tasks
+## round after round (`score`); see distributed_search for the multi-host one.
+class LocalBackend:
+    def __init__(self, n_jobs=-1):
+        self.n_jobs = n_jobs
+        self.single_threaded = n_jobs != 1
+        self.folds = None
+
+    def __enter__(self):
+        self._parallel = Parallel(n_jobs=self.n_jobs).__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._parallel.__exit__(*exc_info)
+
+    def prepare_folds(self, preprocessor, X, y, splits):
+        self.folds = self._parallel(delayed(_prepare_fold)(preprocessor, X, y, train_idx, val_idx)
+                                    for train_idx, val_idx in splits)
+        return len(self.folds)
+
+    # tasks: (model, params, fold index, n_rows) -> one R2 per task, in order
+    def score(self, tasks):
+        return self._parallel(delayed(_fit_and_score)(model, params, self.folds[fold], n_rows)
+                              for model, params, fold, n_rows in tasks)
+
+
+# Keep the estimators single-threaded inside the shared pool
+def _single_threaded(model):
+    params = model.get_params()
+    if 'n_jobs' in params:
+        return clone(model).set_params(n_jobs=1)
+    if 'thread_count' in params:
+        return clone(model).set_params(thread_count=1)
+    return model
+
+
+## Successive-halving search over all model families at once
+## `models` uses the same {"name": {"model": ..., "params": {"model__...": [...]}}} layout as transform_train
+class ModelSearch:
+    def __init__(self, config=None, backend=None):
+        self.config = config or ModelSearchConfig()
+        self.backend = backend # LocalBackend(config.n_jobs) by default
+
+    def _schedule(self, n_candidates, n_max):
+        factor = self.config.factor
+        min_resources = min(self.config.min_resources, n_max)
+
+        n_required = 1 + int(math.floor(math.log(n_candidates, factor))) if n_candidates > 1 else 1
+        n_possible = 1 + int(math.floor(math.log(n_max / min_resources, factor)))
+        n_rounds = max(1, min(n_required, n_possible))
+
+        # the last round always trains on the full fold
+        return [int(n_max // factor ** (n_rounds - 1 - i)) for i in range(n_rounds)]
+
+    def search(self, preprocessor, models, X, y):
+        try:
+            y = np.asarray(y)
+            backend = self.backend or LocalBackend(self.config.n_jobs)
+
+            candidates = []
+            for family, model_dict in models.items():
+                model = _single_threaded(model_dict['model']) if backend.single_threaded else model_dict['model']
+                for params in ParameterGrid(model_dict['params']):
+                    params = {key.split('__', 1)[-1]: value for key, value in params.items()}
+                    candidates.append((family, model, params))
+
+            # rows of each fold are shuffled once so that a round's subsample is just a prefix
+            rng = np.random.RandomState(self.config.random_state)
+            splits = [(rng.permutation(train_idx), val_idx)
+                      for train_idx, val_idx in KFold(n_splits=self.config.cv).split(X)]
+            n_max = min(len(train_idx) for train_idx, _ in splits)
+            schedule = self._schedule(len(candidates), n_max)
+
+            result = SearchResult(best_family=None, best_params=None, best_score=-np.inf)
+            alive = list(range(len(candidates)))
+
+            with backend:
+                start = time.perf_counter()
+                n_folds = backend.prepare_folds(preprocessor, X, y, splits)
+                logging.info(f"Fitted the preprocessor on {n_folds} folds in {time.perf_counter() - start:.2f}s")
+
+                for round_idx, n_rows in enumerate(schedule):
+                    start = time.perf_counter()
+                    scores = backend.score([
+                        (candidates[c][1], candidates[c][2], fold, n_rows)
+                        for c in alive for fold in range(n_folds)
+                    ])
+                    mean_scores = np.asarray(scores).reshape(len(alive), n_folds).mean(axis=1)
+                    if not np.isfinite(mean_scores).any():
+                        raise RuntimeError(f"Every one of the {len(alive)} candidates failed in search round "
+                                           f"{round_idx} (see the warnings in the log)")
+
+                    for c, score in zip(alive, mean_scores):
+                        family, _, params = candidates[c]
+                        best = result.families.get(family)
+                        if best is None or best['round'] < round_idx or (best['round'] == round_idx and score > best['score']):
+                            result.families[family] = {'params': params, 'score': float(score), 'round': round_idx, 'rows': n_rows}
+
+                    result.rounds.append({
+                        'round': round_idx,
+                        'rows': n_rows,
+                        'candidates': len(alive),
+                        'seconds': time.perf_counter() - start,
+                    })
+                    logging.info(f"Search round {round_idx}: {len(alive)} candidates on {n_rows} rows per fold")
+
+                    order = np.argsort(-mean_scores, kind='stable')
+                    if round_idx == len(schedule) - 1:
+                        winner = alive[order[0]]
+                        result.best_family = candidates[winner][0]
+                        result.best_params = candidates[winner][2]
+                        result.best_score = float(mean_scores[order[0]])
+                    else:
+                        keep = max(1, int(math.ceil(len(alive) / self.config.factor)))
+                        alive = [alive[i] for i in order[:keep]]
+
+            return result
+
+        except Exception as e:
+            raise CustomException(e, sys)
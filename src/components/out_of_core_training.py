@@ -0,0 +1,287 @@
+import os
+import sys
+import time
+import shutil
+import resource
+import argparse
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass, field
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import save_object, load_object
+from src.validation import DataValidator
+from src.components.transform_training import ModelDevelopment, DataTransformationConfig
+from src.components.incremental_training import row_hashes
+from src.pipeline.stream_pipeline import read_chunks
+
+
+## Out-of-core training: the dataset is never loaded as a whole
+## pass 1 streams the file once for the preprocessing statistics (category vocabularies,
+##   scaler mean / variance by partial_fit) and fits the ColumnTransformer from them
+## pass 2 streams it again through an xgboost.DataIter: every chunk is validated, preprocessed
+##   and handed to XGBoost, which keeps the quantized pages on disk (external memory)
+## Peak memory is one chunk plus XGBoost's working set, whatever the size of the file.
+## The result is the same Pipeline(preprocessor, XGBRegressor) as transform_train saves, plus
+## the price interval model on the same preprocessor. XGBoost can't page the quantile objective to
+## disk, so that one trains in memory on a bounded sample of the training rows, drawn in pass 1.
+
+@dataclass
+class OutOfCoreTrainingConfig:
+    source_path: str = os.path.join('data', 'diamonds.csv') # .csv or .parquet
+    chunk_size: int = 100000 # rows in memory at once
+    cache_dir: str = os.path.join('data', 'cache', 'external') # XGBoost's pages, removed after the run
+    in_memory_pages: bool = False # QuantileDMatrix: quantized pages in RAM (~1 byte per value), faster
+    test_modulo: int = 5 # rows with hash % test_modulo == 0 are held out (20%), the same rule as incremental training
+    interval_sample_rows: int = 200000 # training rows of the interval model (the ones with the smallest hashes)
+    max_bin: int = 256
+    params: dict = None # XGBoost parameters; default: those of the saved price model (the last search), else n_estimators=100
+    target: str = 'price'
+    categorical_features: list = field(default_factory=lambda: ['cut', 'color', 'clarity'])
+    numerical_features: list = field(default_factory=lambda: ['carat', 'depth', 'table', 'x', 'y', 'z'])
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB on Linux
+
+
+# Valid rows of every chunk with their side of the split (deterministic: a hash of the row)
+def split_chunks(file_path, chunk_size, test_modulo, validator=None):
+    validator = validator or DataValidator()
+    for chunk in read_chunks(file_path, chunk_size):
+        chunk, _ = validator.split(chunk)
+        if len(chunk):
+            yield chunk, row_hashes(chunk) % np.uint64(test_modulo) == 0
+
+
+## XGBoost data iterator over the preprocessed chunks of `batches()` (a fresh generator of frames per pass)
+## xgboost is only imported when a run starts, so the class is built here
+def chunk_iterator(batches, preprocessor, feature_columns, target, cache_prefix=None):
+    import xgboost
+
+    class ChunkIterator(xgboost.DataIter):
+        def __init__(self):
+            super().__init__(cache_prefix=cache_prefix, release_data=True)
+            self._chunks = None
+
+        def reset(self):
+            self._chunks = None
+
+        def next(self, input_data):
+            if self._chunks is None:
+                self._chunks = batches()
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            matrix = np.asarray(preprocessor.transform(chunk[feature_columns]), dtype=np.float32)
+            input_data(data=matrix, label=chunk[target].to_numpy(dtype=np.float32))
+            return 1
+
+    return ChunkIterator()
+
+
+# Error sums over the streamed test rows: MAE, RMSE, R2 and interval coverage without keeping the rows
+class StreamingMetrics:
+    def __init__(self):
+        self.n = 0
+        self.abs_error = 0.0
+        self.sq_error = 0.0
+        self.y_sum = 0.0
+        self.y_sq_sum = 0.0
+        self.covered = 0
+        self.width = 0.0
+
+    def update(self, y, pred, low=None, high=None):
+        y = np.asarray(y, dtype=np.float64)
+        error = y - pred
+        self.n += len(y)
+        self.abs_error += np.abs(error).sum()
+        self.sq_error += (error ** 2).sum()
+        self.y_sum += y.sum()
+        self.y_sq_sum += (y ** 2).sum()
+        if low is not None:
+            self.covered += int(((y >= low) & (y <= high)).sum())
+            self.width += float((high - low).sum())
+
+    def result(self):
+        total = self.y_sq_sum - self.y_sum ** 2 / self.n
+        return {
+            'test_rows': self.n,
+            'mae': self.abs_error / self.n,
+            'rmse': float(np.sqrt(self.sq_error / self.n)),
+            'r2': 1 - self.sq_error / total if total else 0.0,
+            'interval_coverage': self.covered / self.n,
+            'interval_width': self.width / self.n,
+        }
+
+
+class OutOfCoreTraining:
+    def __init__(self, config=None):
+        self.config = config or OutOfCoreTrainingConfig()
+        self.development = ModelDevelopment()
+        self.transformation_config = DataTransformationConfig()
+
+    # pass 1: vocabularies and scaler statistics of the training rows, chunk by chunk, and the sample
+    # of the interval model: the `interval_sample_rows` training rows with the smallest hashes, so it
+    # is deterministic and never holds more than the sample plus one chunk
+    def fit_preprocessor(self):
+        config = self.config
+        vocabularies = {col: set() for col in config.categorical_features}
+        scaler = StandardScaler()
+        feature_columns = None
+        train_rows = test_rows = 0
+        sample, sample_keys = None, np.empty(0, dtype=np.uint64)
+
+        for chunk, is_test in split_chunks(config.source_path, config.chunk_size, config.test_modulo):
+            if feature_columns is None:
+                feature_columns = [col for col in chunk.columns if col != config.target]
+            train = chunk[~is_test]
+            train_rows += len(train)
+            test_rows += int(is_test.sum())
+            if not len(train):
+                continue
+            for col in config.categorical_features:
+                vocabularies[col].update(train[col].astype(str).unique())
+            scaler.partial_fit(train[config.numerical_features])
+
+            # the split used hash % test_modulo, the sample ranks on the rest of the hash
+            keys = np.concatenate([sample_keys, row_hashes(train) // np.uint64(config.test_modulo)])
+            sample = train if sample is None else pd.concat([sample, train], ignore_index=True)
+            if len(sample) > config.interval_sample_rows:
+                keep = np.argpartition(keys, config.interval_sample_rows)[:config.interval_sample_rows]
+                sample = sample.iloc[keep].reset_index(drop=True)
+                keys = keys[keep]
+            sample_keys = keys
+
+        if not train_rows:
+            raise ValueError(f"No valid training rows in {config.source_path}")
+
+        # the ColumnTransformer of transform_train, fitted on one row per category (the vocabularies
+        # are given explicitly, sorted like OneHotEncoder's own) with the streamed scaler swapped in
+        categories = [sorted(vocabularies[col]) for col in config.categorical_features]
+        preprocessor = self.development.get_preprocessor().set_params(OneHotEncoder__categories=categories)
+        n_rows = max(len(values) for values in categories)
+        prototype = pd.DataFrame({col: 0.0 for col in feature_columns}, index=range(n_rows))
+        for col, values in zip(config.categorical_features, categories):
+            prototype[col] = [values[i % len(values)] for i in range(n_rows)]
+        preprocessor.fit(prototype[feature_columns])
+        preprocessor.transformers_ = [
+            (name, scaler if name == 'StandardScaler' else transformer, columns)
+            for name, transformer, columns in preprocessor.transformers_
+        ]
+
+        logging.info(f"Streamed preprocessing statistics over {train_rows} training rows ({test_rows} held out), "
+                     f"{len(sample)} sampled for the interval model")
+        return preprocessor, feature_columns, train_rows, sample
+
+    def _params(self):
+        if self.config.params is not None:
+            return dict(self.config.params)
+        final_pipeline = self.transformation_config.final_pipeline
+        if os.path.exists(final_pipeline):
+            model = load_object(final_pipeline).named_steps['model']
+            if type(model).__name__ == 'XGBRegressor':
+                params = model.get_params()
+                return {key: params[key] for key in ('n_estimators', 'learning_rate', 'max_depth') if params.get(key) is not None}
+        return {'n_estimators': 100}
+
+    # train on the streamed pages and load the booster into an XGBRegressor through its public
+    # load_model (fit only takes in-memory arrays), so the pipeline holds a regular fitted estimator
+    def _train(self, dtrain, params, interval=False):
+        import xgboost
+        from xgboost import XGBRegressor
+
+        params = {**params, 'tree_method': 'hist', 'max_bin': self.config.max_bin}
+        model = self.development.get_interval_model(params) if interval else XGBRegressor(**params)
+        booster_params = {key: value for key, value in model.get_xgb_params().items() if value is not None}
+        if 'quantile_alpha' in booster_params:
+            booster_params['quantile_alpha'] = list(booster_params['quantile_alpha'])
+        booster = xgboost.train(booster_params, dtrain, num_boost_round=model.n_estimators)
+        model.load_model(booster.save_raw(raw_format='ubj'))
+        return model
+
+    def run(self):
+        try:
+            import xgboost
+
+            start = time.perf_counter()
+            config = self.config
+            preprocessor, feature_columns, train_rows, sample = self.fit_preprocessor()
+            params = self._params()
+
+            # pass 2: XGBoost pulls the training chunks through the iterator (twice: sketching, then paging)
+            def train_batches():
+                for chunk, is_test in split_chunks(config.source_path, config.chunk_size, config.test_modulo):
+                    if not is_test.all():
+                        yield chunk[~is_test]
+
+            def train_matrix(in_memory):
+                if in_memory:
+                    return xgboost.QuantileDMatrix(
+                        chunk_iterator(train_batches, preprocessor, feature_columns, config.target), max_bin=config.max_bin)
+                shutil.rmtree(config.cache_dir, ignore_errors=True)
+                os.makedirs(config.cache_dir, exist_ok=True)
+                cache_prefix = os.path.join(config.cache_dir, 'train')
+                return xgboost.DMatrix(chunk_iterator(train_batches, preprocessor, feature_columns, config.target, cache_prefix))
+
+            dtrain = train_matrix(config.in_memory_pages)
+            model = self._train(dtrain, params)
+            del dtrain
+            shutil.rmtree(config.cache_dir, ignore_errors=True)
+
+            # the quantile objective has no external-memory support in XGBoost: the interval model
+            # trains in RAM on the sample of pass 1, which has a fixed size whatever the file
+            dsample = xgboost.QuantileDMatrix(
+                np.asarray(preprocessor.transform(sample[feature_columns]), dtype=np.float32),
+                label=sample[config.target].to_numpy(dtype=np.float32), max_bin=config.max_bin)
+            interval_rows = len(sample)
+            del sample
+            interval_model = self._train(dsample, params, interval=True)
+            del dsample
+
+            final_pipeline = Pipeline(steps=[('preprocessor', preprocessor), ('model', model)])
+            interval_pipeline = Pipeline(steps=[('preprocessor', preprocessor), ('model', interval_model)])
+
+            # holdout metrics, streamed as well
+            scores = StreamingMetrics()
+            for chunk, is_test in split_chunks(config.source_path, config.chunk_size, config.test_modulo):
+                test = chunk[is_test]
+                if not len(test):
+                    continue
+                X_test = test[feature_columns]
+                pred = final_pipeline.predict(X_test)
+                bounds = interval_pipeline.predict(X_test)
+                scores.update(test[config.target], pred, np.minimum(bounds[:, 0], pred), np.maximum(bounds[:, -1], pred))
+
+            save_object(file_path=self.transformation_config.final_pipeline, obj=final_pipeline)
+            save_object(file_path=self.transformation_config.interval_pipeline, obj=interval_pipeline)
+
+            report = {
+                'train_rows': train_rows, 'interval_train_rows': interval_rows, **scores.result(), 'params': params,
+                'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb(),
+            }
+            logging.info(f"Out-of-core training done: {report}")
+            return report
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the price model on a file larger than RAM")
+    parser.add_argument('--source', default=OutOfCoreTrainingConfig.source_path, help="CSV or Parquet file")
+    parser.add_argument('--chunk-size', type=int, default=OutOfCoreTrainingConfig.chunk_size)
+    parser.add_argument('--in-memory-pages', action='store_true',
+                        help="keep XGBoost's quantized pages in RAM instead of on disk (faster, ~1 byte per value)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = OutOfCoreTrainingConfig(source_path=args.source, chunk_size=args.chunk_size,
+                                     in_memory_pages=args.in_memory_pages)
+    print(OutOfCoreTraining(config).run())
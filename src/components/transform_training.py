@@ -1,58 +1,145 @@
 import os
 import sys
-import pandas as pd
 import numpy as np
-import pickle
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.compose import ColumnTransformer
-
-from sklearn.linear_model import LinearRegression, Lasso
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.neighbors import KNeighborsRegressor
-from sklearn.metrics import r2_score
-from catboost import CatBoostRegressor
-from xgboost import XGBRegressor
-from sklearn.model_selection import GridSearchCV
+from sklearn.base import clone
 
 from src.exception import CustomException
 from src.logger import logging
 from src.utils import save_object, evaluate_model
+from src.components.model_search import ModelSearch, ModelSearchConfig
+from src.components.columnar_cache import read_split
 
 
 
 @dataclass
 class DataTransformationConfig:
     final_pipeline = os.path.join('data', 'final_model_pipeline.pkl')
+    interval_pipeline = os.path.join('data', 'final_model_pipeline_interval.pkl')
+    quantiles: tuple = (0.05, 0.95) # lower / upper bound of the price interval
+    search: ModelSearchConfig = field(default_factory=ModelSearchConfig)
     
 
 class ModelDevelopment:
-    def __init__(self):
+    def __init__(self, search_config=None, store=None, search_backend=None):
         self.data_transformation_config = DataTransformationConfig()
+        if search_config is not None:
+            self.data_transformation_config.search = search_config
+        self.store = store # ArtifactStore: stages with unchanged inputs are reused
+        self.search_backend = search_backend # e.g. DistributedBackend, joblib on this machine by default
         
+    # run a training stage, or reuse its output from the artifact store
+    def _stage(self, name, inputs, builder):
+        if self.store is None:
+            return builder(), None
+        return self.store.cached(name, inputs, builder)
+
+    # Fit the model on the already fitted preprocessor
+    def _fit_pipeline(self, preprocessor, model, X_train, y_train):
+        model.fit(preprocessor.transform(X_train), y_train)
+        return Pipeline(steps=[
+            ('preprocessor', preprocessor),
+            ('model', model)
+        ])
+
+
+    # Preprocessor for Encoding and Standardize the data
+    def get_preprocessor(self):
+        numerical_features = ['carat', 'depth', 'table', 'x', 'y', 'z']
+        categorical_features = ['cut', 'color', 'clarity']
+
+        numeric_transformer = StandardScaler()
+        oh_transformer = OneHotEncoder(drop='first')
+
+        return ColumnTransformer(
+            [
+                ("OneHotEncoder", oh_transformer, categorical_features),
+                ("StandardScaler", numeric_transformer, numerical_features),
+            ]
+        )
+
+    # Dictionaries of the Model
+    def get_models(self):
+        # heavy model libraries are only imported when a search actually runs
+        from sklearn.linear_model import LinearRegression, Lasso
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.neighbors import KNeighborsRegressor
+        from catboost import CatBoostRegressor
+        from xgboost import XGBRegressor
+
+        return {
+            "Linear Regression": {
+                "model": LinearRegression(),
+                "params": {
+                    "model__fit_intercept": [True, False]
+                }
+             },
+             "Lasso": {
+                 "model": Lasso(),
+                 "params": {
+                     "model__alpha": [0.1, 1.0, 10.0]
+                 }
+             },
+             "K-Neighbors Regressor": {
+                 "model": KNeighborsRegressor(),
+                 "params": {
+                     "model__n_neighbors": [3, 5, 7]
+                 }
+             },
+             "Random Forest Regressor": {
+                 "model": RandomForestRegressor(),
+                 "params": {
+                     "model__n_estimators": [50, 100],
+                     "model__max_depth": [None, 5, 10],
+                     "model__max_features": [1.0, 5, 7, 8], # 1.0: all features (the removed "auto")
+                 }
+             },
+             "XGBRegressor": {
+                 "model": XGBRegressor(),
+                 "params": {
+                     "model__n_estimators": [50, 100],
+                     "model__learning_rate": [0.01, 0.1, 0.3]
+                 }
+             },
+             "CatBoost": {
+                 "model": CatBoostRegressor(verbose=False),
+                 "params": {
+                     "model__depth": [6, 8],
+                     "model__learning_rate": [0.01, 0.1],
+                     "model__iterations": [100, 200]
+                 }
+            }
+        }
+
+    # One XGBoost model for both bounds of the price interval (multi-quantile objective)
+    def get_interval_model(self, params=None):
+        from xgboost import XGBRegressor
+
+        return XGBRegressor(
+            objective='reg:quantileerror',
+            quantile_alpha=np.array(self.data_transformation_config.quantiles),
+            **(params or {})
+        )
+
+    # Fit the quantile model on the already fitted preprocessor of the final pipeline,
+    # so serving can transform a stone once and score both models on the same matrix
+    def fit_interval_pipeline(self, final_pipeline, X_train, y_train, params=None):
+        preprocessor = final_pipeline.named_steps['preprocessor']
+        return self._fit_pipeline(preprocessor, self.get_interval_model(params), X_train, y_train)
 
     def transform_train(self, train_path, test_path):
         try:
-            train_df = pd.read_csv(train_path)
-            test_df = pd.read_csv(test_path)
+            train_df = read_split(train_path)
+            test_df = read_split(test_path)
             logging.info("Read train and test data completed")
             
             # Preprocessor for Encoding and Standardize the data
-            numerical_features = ['carat', 'depth', 'table', 'x', 'y', 'z']
-            categorical_features = ['cut', 'color', 'clarity']
+            preprocessor = self.get_preprocessor()
             target_column = 'price'
-            
-            numeric_transformer = StandardScaler()
-            oh_transformer = OneHotEncoder(drop='first')
-
-            preprocessor = ColumnTransformer(
-                [
-                    ("OneHotEncoder", oh_transformer, categorical_features),
-                    ("StandardScaler", numeric_transformer, numerical_features),
-                ]
-            )
 
             
             ## Input and Target for data train
@@ -68,49 +155,7 @@ class ModelDevelopment:
             
             
             # Dictionaries of the Model
-            models = {
-                "Linear Regression": {
-                    "model": LinearRegression(),
-                    "params": {
-                        "model__fit_intercept": [True, False]
-                    }
-                 },
-                 "Lasso": {
-                     "model": Lasso(),
-                     "params": {
-                         "model__alpha": [0.1, 1.0, 10.0]
-                     }
-                 },
-                 "K-Neighbors Regressor": {
-                     "model": KNeighborsRegressor(),
-                     "params": {
-                         "model__n_neighbors": [3, 5, 7]
-                     }
-                 },
-                 "Random Forest Regressor": {
-                     "model": RandomForestRegressor(),
-                     "params": {
-                         "model__n_estimators": [50, 100],
-                         "model__max_depth": [None, 5, 10],
-                         "model__max_features": ["auto", 5, 7, 8],
-                     }
-                 },
-                 "XGBRegressor": {
-                     "model": XGBRegressor(),
-                     "params": {
-                         "model__n_estimators": [50, 100],
-                         "model__learning_rate": [0.01, 0.1, 0.3]
-                     }
-                 },
-                 "CatBoost": {
-                     "model": CatBoostRegressor(verbose=False),
-                     "params": {
-                         "model__depth": [6, 8],
-                         "model__learning_rate": [0.01, 0.1],
-                         "model__iterations": [100, 200]
-                     }
-                }
-            }
+            models = self.get_models()
             
             X_train, y_train, X_test, y_test = (
                 train_input_feature,
@@ -119,52 +164,105 @@ class ModelDevelopment:
                 test_target_feature
             )            
             
-            # Run the models
-            for model_name, model_dict in models.items():
-                model = model_dict['model']
-                param_grid = model_dict['params']
-
-                # Create pipeline
-                pipeline = Pipeline(steps=[
-                    ('preprocessor', preprocessor),  # Add your ColumnTransformer here for preprocessing
-                    ('model', model)
-                ])
-                
-                # Setup GridSearchCV
-                grid_search = GridSearchCV(pipeline, param_grid, cv=5, scoring='r2', n_jobs=-1)
-
-                # Fit model
-                grid_search.fit(X_train, y_train)
-
-                # Get the best model
-                best_model = grid_search.best_estimator_
-                
-                # Evaluate on training set
-                y_train_pred = best_model.predict(X_train)
-                train_mae, train_rmse, train_r2 = evaluate_model(y_train, y_train_pred)
-
-                # Evaluate on test set
-                y_test_pred = best_model.predict(X_test)
-                test_mae, test_rmse, test_r2 = evaluate_model(y_test, y_test_pred)
-
-                # Print results
-                print(f"{model_name} Best Hyperparameters: {grid_search.best_params_}")
-                print(f"Training set performance:\n - MAE: {train_mae:.4f}\n - RMSE: {train_rmse:.4f}\n - R2: {train_r2:.4f}")
-                print(f"Test set performance:\n - MAE: {test_mae:.4f}\n - RMSE: {test_rmse:.4f}\n - R2: {test_r2:.4f}")
+            # what every stage depends on, for the artifact store keys
+            if self.store is not None:
+                from src.components.artifact_store import (code_version, library_versions,
+                                                           describe_estimator, split_fingerprint)
+                split_inputs = {
+                    'split': split_fingerprint(train_path, test_path),
+                    'preprocessor': describe_estimator(preprocessor),
+                    'code': code_version(__name__, 'src.components.model_search', 'src.components.columnar_cache'),
+                    'libraries': library_versions(),
+                }
+            else:
+                split_inputs = None
+
+            # Preprocessor fitted on the whole training split
+            fitted_preprocessor, preprocessor_key = self._stage(
+                'preprocessor', split_inputs, lambda: clone(preprocessor).fit(X_train)
+            )
+
+            # Search every model family over one shared worker pool (successive halving)
+            # (the families are compared round by round, so the search is one stage)
+            search = ModelSearch(self.data_transformation_config.search, self.search_backend)
+            search_inputs = split_inputs and {
+                **split_inputs,
+                'models': {name: {'model': describe_estimator(model_dict['model']), 'params': model_dict['params']}
+                           for name, model_dict in models.items()},
+                'search': vars(self.data_transformation_config.search),
+            }
+            result, search_key = self._stage(
+                'search', search_inputs, lambda: search.search(preprocessor, models, X_train, y_train)
+            )
+
+            for model_name, family in result.families.items():
+                print(f"{model_name} Best Hyperparameters: {family['params']}")
+                print(f"CV R2: {family['score']:.4f} (round {family['round']}, {family['rows']} rows per fold)")
                 print('=' * 50)
-                
+
             # Save the model
-            # Based on Best Hyperparameter
-            final_pipeline = Pipeline(steps=[
-                ('preprocessor', preprocessor),
-                ('model', XGBRegressor(learning_rate=0.3, n_estimators=100))  # Best hyperparameters
-            ])
-            
+            # Based on the winner of the search
+            best_model = clone(models[result.best_family]['model']).set_params(**result.best_params)
+            final_inputs = split_inputs and {
+                'preprocessor': preprocessor_key, 'search': search_key, 'model': describe_estimator(best_model),
+            }
+            final_pipeline, final_key = self._stage(
+                'final_pipeline', final_inputs,
+                lambda: self._fit_pipeline(fitted_preprocessor, best_model, X_train, y_train)
+            )
+
+            # Evaluate on training set
+            y_train_pred = final_pipeline.predict(X_train)
+            train_mae, train_rmse, train_r2 = evaluate_model(y_train, y_train_pred)
+
+            # Evaluate on test set
+            y_test_pred = final_pipeline.predict(X_test)
+            test_mae, test_rmse, test_r2 = evaluate_model(y_test, y_test_pred)
+
+            # Print results
+            print(f"Selected {result.best_family} {result.best_params} (CV R2: {result.best_score:.4f})")
+            print(f"Training set performance:\n - MAE: {train_mae:.4f}\n - RMSE: {train_rmse:.4f}\n - R2: {train_r2:.4f}")
+            print(f"Test set performance:\n - MAE: {test_mae:.4f}\n - RMSE: {test_rmse:.4f}\n - R2: {test_r2:.4f}")
+            logging.info(f"Selected {result.best_family} with {result.best_params}")
             
-            save_object(
-                file_path=self.data_transformation_config.final_pipeline,
-                obj=final_pipeline.fit(X_train, y_train)
+            # Price interval, with the tree settings the search found for XGBoost
+            xgb_params = result.families.get("XGBRegressor", {}).get('params', {})
+            xgb_params = {key.split('__', 1)[-1]: value for key, value in xgb_params.items()}
+            interval_inputs = split_inputs and {
+                'final_pipeline': final_key, 'model': describe_estimator(self.get_interval_model(xgb_params)),
+            }
+            interval_pipeline, interval_key = self._stage(
+                'interval_pipeline', interval_inputs,
+                lambda: self.fit_interval_pipeline(final_pipeline, X_train, y_train, xgb_params)
             )
+            bounds = interval_pipeline.predict(X_test)
+            low = np.minimum(bounds[:, 0], y_test_pred)
+            high = np.maximum(bounds[:, -1], y_test_pred)
+            coverage = np.mean((y_test >= low) & (y_test <= high))
+            print(f"Price interval {self.data_transformation_config.quantiles}: "
+                  f"test coverage {coverage:.3f}, mean width {np.mean(high - low):.2f}")
+            logging.info(f"Price interval test coverage {coverage:.3f}")
+
+            if self.store is None:
+                save_object(
+                    file_path=self.data_transformation_config.final_pipeline,
+                    obj=final_pipeline
+                )
+                save_object(
+                    file_path=self.data_transformation_config.interval_pipeline,
+                    obj=interval_pipeline
+                )
+            else:
+                # copy the stored pipelines onto the paths the app reads, and record the run
+                self.store.publish('final_pipeline', final_key, self.data_transformation_config.final_pipeline)
+                self.store.publish('interval_pipeline', interval_key, self.data_transformation_config.interval_pipeline)
+                self.store.record_run({
+                    'best_family': result.best_family, 'cv_r2': result.best_score,
+                    'test_mae': float(test_mae), 'test_rmse': float(test_rmse), 'test_r2': float(test_r2),
+                    'interval_coverage': float(coverage),
+                })
+
+            return result
             
             
         except Exception as e:
@@ -0,0 +1,124 @@
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass, field
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import file_signature
+
+
+DATASET_PATH = os.path.join('data', 'diamonds.csv')
+
+# Grades ordered from the best to the worst
+CUT_ORDER = ['Ideal', 'Premium', 'Very Good', 'Good', 'Fair']
+COLOR_ORDER = ['D', 'E', 'F', 'G', 'H', 'I', 'J']
+CLARITY_ORDER = ['IF', 'VVS1', 'VVS2', 'VS1', 'VS2', 'SI1', 'SI2', 'I1']
+
+DATASET_DTYPES = {
+    'carat': 'float64',
+    'cut': pd.CategoricalDtype(CUT_ORDER, ordered=True),
+    'color': pd.CategoricalDtype(COLOR_ORDER, ordered=True),
+    'clarity': pd.CategoricalDtype(CLARITY_ORDER, ordered=True),
+    'depth': 'float64',
+    'table': 'float64',
+    'price': 'int64',
+    'x': 'float64',
+    'y': 'float64',
+    'z': 'float64',
+}
+
+DISPLAY_COLUMNS = ['Carat', 'Cut', 'Color', 'Clarity', 'Depth', 'Table', 'Price', 'x', 'y', 'z']
+
+
+@dataclass
+class DatasetEntry:
+    data: pd.DataFrame
+    signature: tuple
+    derived: dict = field(default_factory=dict) # aggregates / figures computed from this version
+    lock: threading.RLock = field(default_factory=threading.RLock, repr=False) # derived values may build on each other
+
+
+## Parses each dataset file once per process and keeps what is derived from it
+## until the file changes on disk
+class DatasetCache:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, file_path):
+        key = os.path.abspath(file_path)
+        signature = file_signature(key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature == signature:
+                return entry
+
+            data = pd.read_csv(key, dtype=DATASET_DTYPES)
+            logging.info(f"Loaded dataset {key} ({len(data)} rows)")
+            entry = DatasetEntry(data=data, signature=signature)
+            self._entries[key] = entry
+            return entry
+
+    # cached frame, shared between sessions: treat it as read-only
+    def load(self, file_path=DATASET_PATH):
+        try:
+            return self._entry(file_path).data
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # compute `builder(data)` once per version of the file
+    def derived(self, name, builder, file_path=DATASET_PATH):
+        try:
+            entry = self._entry(file_path)
+            with entry.lock:
+                if name not in entry.derived:
+                    entry.derived[name] = builder(entry.data)
+                return entry.derived[name]
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+dataset_cache = DatasetCache()
+
+
+def load_dataset(file_path=DATASET_PATH):
+    return dataset_cache.load(file_path)
+
+
+# Dataset with the column names shown in the app
+def display_dataset(file_path=DATASET_PATH):
+    return dataset_cache.derived(
+        'display', lambda data: data.set_axis(DISPLAY_COLUMNS, axis=1), file_path
+    )
+
+
+# Counts and average prices per grade, plus the binned price distribution
+def _build_aggregates(data):
+    price = data['price'].to_numpy()
+    counts, edges = np.histogram(price, bins='auto')
+
+    return {
+        'cut_counts': data['cut'].value_counts().reindex(CUT_ORDER),
+        'color_counts': data['color'].value_counts().reindex(COLOR_ORDER),
+        'clarity_counts': data['clarity'].value_counts().reindex(CLARITY_ORDER),
+        'mean_cut': data.groupby('cut', observed=False)['price'].mean().reindex(CUT_ORDER),
+        'mean_color': data.groupby('color', observed=False)['price'].mean().reindex(COLOR_ORDER),
+        'mean_clarity': data.groupby('clarity', observed=False)['price'].mean().reindex(CLARITY_ORDER),
+        'price_hist_counts': counts,
+        'price_hist_edges': edges,
+    }
+
+
+def dataset_aggregates(file_path=DATASET_PATH):
+    return dataset_cache.derived('aggregates', _build_aggregates, file_path)
@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+
+## Import-time profile of the serving entry points (python -X importtime)
+## python -m src.import_profile [--json report.json]
+## Exits with 1 when a module pulls in a library it must not load at import.
+
+# module -> libraries it must not import eagerly
+IMPORT_RULES = {
+    'src.pipeline.predict_pipeline': ['catboost', 'xgboost', 'plotly', 'sklearn', 'src.components.transform_training'],
+    'src.pipeline.compiled_model': ['pandas', 'catboost', 'xgboost', 'plotly', 'sklearn'],
+    'src.pipeline.serve': ['catboost', 'xgboost', 'plotly', 'sklearn', 'src.components.transform_training'],
+    'src.components.data_ingestion': ['catboost', 'xgboost', 'plotly', 'src.components.transform_training'],
+    'src.dataset': ['catboost', 'xgboost', 'plotly', 'sklearn'],
+    # streamlit itself imports plotly's base modules, plotly.express must stay lazy
+    'src.analysis': ['catboost', 'xgboost', 'plotly.express', 'sklearn'],
+}
+
+
+# Run `import module` in a clean interpreter and parse the -X importtime output (microseconds)
+def profile_import(module):
+    with tempfile.TemporaryDirectory() as cwd:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd(), os.environ.get('PYTHONPATH', '')]))
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True, env=env, cwd=cwd, # a scratch cwd also shows any file written at import
+        )
+        created = sorted(os.listdir(cwd))
+
+    if proc.returncode != 0:
+        raise ImportError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append({'module': name.strip(), 'self_us': int(self_us), 'cumulative_us': int(cumulative_us)})
+
+    total = next((item['cumulative_us'] for item in imports if item['module'] == module), 0)
+    return {'module': module, 'total_ms': total / 1000, 'imports': imports, 'created_files': created}
+
+
+def check_rules(profile, forbidden):
+    loaded = {item['module'] for item in profile['imports']}
+    violations = [lib for lib in forbidden if lib in loaded]
+    if profile['created_files']:
+        violations.append(f"writes {profile['created_files']} at import")
+    return violations
+
+
+def run_profile(rules=None, top=10):
+    rules = rules or IMPORT_RULES
+    report = {}
+    for module, forbidden in rules.items():
+        profile = profile_import(module)
+        heaviest = sorted(profile['imports'], key=lambda item: item['self_us'], reverse=True)[:top]
+        report[module] = {
+            'total_ms': profile['total_ms'],
+            'n_modules': len(profile['imports']),
+            'heaviest': [{'module': item['module'], 'self_ms': item['self_us'] / 1000} for item in heaviest],
+            'violations': check_rules(profile, forbidden),
+        }
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time profile of the serving modules")
+    parser.add_argument('--json', default=None, help="write the report to this file")
+    parser.add_argument('--top', type=int, default=10, help="heaviest modules listed per entry point")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_profile(top=args.top)
+
+    failed = False
+    for module, result in report.items():
+        status = 'OK' if not result['violations'] else f"FAIL {result['violations']}"
+        print(f"{module:<36} {result['total_ms']:8.1f} ms  {result['n_modules']:4d} modules  {status}")
+        failed = failed or bool(result['violations'])
+
+    if args.json:
+        with open(args.json, 'w') as file_obj:
+            json.dump(report, file_obj, indent=2)
+
+    sys.exit(1 if failed else 0)
@@ -1,16 +1,208 @@
 import logging
+import logging.handlers
 import os
-from datetime import datetime
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import threading
+from contextlib import contextmanager
 
 
-LOG_FILE = f"{datetime.now().strftime('%m_%d_%Y_%H_%M_%S')}.log"
-LOGS_PATH = os.path.join(os.getcwd(), "logs", LOG_FILE)
-os.makedirs(LOGS_PATH, exist_ok=True)
+## Non-blocking, structured logging for the whole project
+## Records go through a bounded queue to a background writer thread that appends
+## JSON lines to a rotating file, so `logging.info` in a hot path never waits on disk.
+## Every process (server, batch, shadow worker, search workers) writes its own file with its pid
+## in the name: a rollover in one process can't cut the lines of another.
+## Settings (environment variables):
+##   DIAMOND_LOG_DIR             directory of the log files (default ./logs)
+##   DIAMOND_LOG_FILE            file name, the pid goes before the extension (default diamond.log -> diamond.<pid>.log)
+##   DIAMOND_LOG_MAX_BYTES       rotate when the file grows past this size (default 10 MB)
+##   DIAMOND_LOG_ROTATE_SECONDS  rotate when the file is older than this (default 1 day)
+##   DIAMOND_LOG_BACKUPS         rotated files kept (default 5)
+##   DIAMOND_LOG_QUEUE_SIZE      records buffered before new ones are dropped (default 10000)
+##   DIAMOND_LOG_SAMPLE_RATE     share of hot-path events kept, 0..1 (default 1.0, i.e. all)
 
-LOG_FILE_PATH = os.path.join(LOGS_PATH, LOG_FILE)
+LOGS_PATH = os.environ.get("DIAMOND_LOG_DIR", os.path.join(os.getcwd(), "logs"))
+LOG_FILE = os.environ.get("DIAMOND_LOG_FILE", "diamond.log")
+
+
+# Log file of one process
+def process_log_path(pid=None):
+    stem, ext = os.path.splitext(LOG_FILE)
+    return os.path.join(LOGS_PATH, f"{stem}.{pid or os.getpid()}{ext}")
+
+
+LOG_FILE_PATH = process_log_path()
+
+MAX_BYTES = int(os.environ.get("DIAMOND_LOG_MAX_BYTES", 10 * 1024 * 1024))
+ROTATE_SECONDS = float(os.environ.get("DIAMOND_LOG_ROTATE_SECONDS", 24 * 3600))
+BACKUP_COUNT = int(os.environ.get("DIAMOND_LOG_BACKUPS", 5))
+QUEUE_SIZE = int(os.environ.get("DIAMOND_LOG_QUEUE_SIZE", 10000))
+SAMPLE_RATE = float(os.environ.get("DIAMOND_LOG_SAMPLE_RATE", 1.0))
+
+# attributes every LogRecord has, anything else was passed through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+# One JSON object per line, with the `extra=` fields (latency_ms, request_id, ...) at top level
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "pid": record.process,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "sampled":
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+# Rotates on size or age, creates the directory / file on the first record
+class RotatingJsonFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, rotate_seconds=ROTATE_SECONDS):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.rotate_seconds = rotate_seconds
+        self.opened_at = time.time()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        if os.path.exists(self.baseFilename):
+            self.opened_at = os.path.getmtime(self.baseFilename)
+        else:
+            self.opened_at = time.time()
+        return super()._open()
+
+    def shouldRollover(self, record):
+        if self.stream is not None and self.rotate_seconds and time.time() - self.opened_at >= self.rotate_seconds:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened_at = time.time()
+
+    # a forked child writes its own file, not the one of its parent
+    def reset_for_process(self, filename):
+        self.stream = None # the parent's stream, left to the parent
+        self.baseFilename = os.path.abspath(filename)
+
+
+# Keeps a `sampled=True` record with probability `rate`, every other record passes
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, "sampled", False) and self.rate < 1.0:
+            return random.random() < self.rate
+        return True
+
+
+# Hands records to the writer thread; starts it on the first record and never blocks
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, target, queue_size=QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = target
+        self.listener = None
+        self.dropped = 0
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self.listener is None:
+                self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+                self.listener.start()
+                atexit.register(self.stop)
+
+    # merge the args into msg (the writer thread formats), keep the `extra=` fields as they are
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1 # never wait on a full buffer
+
+    def emit(self, record):
+        if self.listener is None:
+            self._start()
+        super().emit(record)
+
+    # after a fork: the writer thread was not copied, start a new one (with a new queue) on the next record
+    def reset_for_process(self):
+        self.listener = None
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.dropped = 0
+        self._start_lock = threading.Lock()
+
+    # flush what is buffered and stop the writer thread
+    def stop(self):
+        with self._start_lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+        self.target.close()
+
+
+file_handler = RotatingJsonFileHandler(LOG_FILE_PATH)
+file_handler.setFormatter(JsonFormatter())
+
+queue_handler = AsyncQueueHandler(file_handler)
+queue_handler.addFilter(SamplingFilter())
 
 logging.basicConfig(
-    filename = LOG_FILE_PATH,
-    format = "[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s",
+    handlers = [queue_handler],
     level = logging.INFO
-)
\ No newline at end of file
+)
+
+
+def _after_fork():
+    file_handler.reset_for_process(process_log_path())
+    queue_handler.reset_for_process()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+# Change the share of hot-path events that are kept (0..1)
+def set_sample_rate(rate):
+    for log_filter in queue_handler.filters:
+        if isinstance(log_filter, SamplingFilter):
+            log_filter.rate = rate
+
+
+# Hot-path event with its latency, subject to the sampling rate
+def log_event(message, latency_ms=None, level=logging.INFO, stacklevel=2, **fields):
+    if latency_ms is not None:
+        fields["latency_ms"] = round(latency_ms, 3)
+    logging.log(level, message, extra={"sampled": True, **fields}, stacklevel=stacklevel)
+
+
+# Time a block and log it as a sampled event with latency_ms
+@contextmanager
+def log_latency(message, **fields):
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        log_event(message, latency_ms=(time.perf_counter() - start) * 1000, stacklevel=4, **fields)
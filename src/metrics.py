@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import time
+import atexit
+import bisect
+import threading
+import traceback
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.logger import LOGS_PATH, log_event
+
+
+## In-process runtime metrics, cheap enough to leave on in the serving path
+## Counters, gauges and latency histograms (fixed buckets) are kept in memory under one lock and exported
+## as Prometheus text (GET /metrics) or as JSON snapshots written periodically.
+## Settings (environment variables):
+##   DIAMOND_METRICS                   0 turns recording off (default 1)
+##   DIAMOND_METRICS_PORT              start a /metrics endpoint on this port from start_exporters()
+##   DIAMOND_METRICS_SNAPSHOT_SECONDS  write a JSON snapshot every N seconds (default 0, off)
+##   DIAMOND_METRICS_DIR               directory of the snapshots / profiles (default ./logs/metrics)
+##   DIAMOND_PROFILE_SLOW_MS           sample the stacks of requests running longer than this (default off)
+##   DIAMOND_PROFILE_INTERVAL_MS       time between two stack samples (default 5)
+
+ENABLED = os.environ.get("DIAMOND_METRICS", "1") != "0"
+METRICS_PORT = int(os.environ.get("DIAMOND_METRICS_PORT", 0))
+SNAPSHOT_SECONDS = float(os.environ.get("DIAMOND_METRICS_SNAPSHOT_SECONDS", 0))
+METRICS_DIR = os.environ.get("DIAMOND_METRICS_DIR", os.path.join(LOGS_PATH, "metrics"))
+PROFILE_SLOW_MS = float(os.environ.get("DIAMOND_PROFILE_SLOW_MS", 0))
+PROFILE_INTERVAL_MS = float(os.environ.get("DIAMOND_PROFILE_INTERVAL_MS", 5))
+
+# seconds, from a cache hit (~0.1 ms) to a cold model load
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "model_load_seconds": "Time to load a model artifact from disk",
+    "dataframe_build_seconds": "Time to build the model input frame from the form values",
+    "preprocess_seconds": "Time in the fitted ColumnTransformer",
+    "booster_predict_seconds": "Time in the model's predict on the preprocessed matrix",
+    "predict_seconds": "End-to-end time of a PredictPipeline call",
+    "http_request_seconds": "Time to answer an inference server request",
+    "prediction_cache_lookups_total": "Prediction cache lookups by result",
+    "predicted_rows_total": "Rows scored by the models",
+    "invalid_rows_total": "Rows rejected by validation",
+    "http_requests_total": "Inference server requests by path and status",
+    "slow_requests_profiled_total": "Slow requests whose stacks were sampled",
+    "shadow_rows_total": "Rows scored by the shadow candidate models",
+    "shadow_dropped_rows_total": "Rows not shadow-scored because the shadow queue was full",
+    "feature_psi": "Population stability index of a feature, last drift window against the training split",
+    "feature_ks": "Kolmogorov-Smirnov distance of a feature (on the reference bins), last drift window",
+    "drift_window_rows": "Rows in the last drift window",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+## Process-wide store of the counters and histograms
+class Metrics:
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self.started_at = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.counts[bucket] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def _copy(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+        return counters, gauges, histograms
+
+    # plain dict: counters and, per timer, count / sum / mean / estimated p50, p95, p99
+    def snapshot(self):
+        counters, gauges, histograms = self._copy()
+        timers = []
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            timers.append({
+                "name": name, "labels": dict(labels), "count": count, "sum": total,
+                "mean": total / count if count else 0.0,
+                **{f"p{q}": _quantile(counts, count, q / 100) for q in (50, 95, 99)},
+            })
+        return {
+            "timestamp": time.time(),
+            "uptime_seconds": time.time() - self.started_at,
+            "pid": os.getpid(),
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                       for (name, labels), value in sorted(gauges.items())],
+            "timers": timers,
+        }
+
+    # Prometheus text exposition format (version 0.0.4)
+    def render_prometheus(self):
+        counters, gauges, histograms = self._copy()
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP diamond_{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE diamond_{name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"diamond_{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"diamond_{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"diamond_{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"diamond_{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"diamond_{name}_count{_format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+# upper bound of the bucket holding the q-quantile (what Prometheus' histogram_quantile approximates)
+def _quantile(counts, count, q):
+    if not count:
+        return 0.0
+    rank = q * count
+    cumulative = 0
+    for bound, bucket_count in zip(BUCKETS + (float("inf"),), counts):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return bound
+    return float("inf")
+
+
+# Shared metrics for the whole process
+metrics = Metrics()
+
+
+## Opt-in sampling profiler for slow requests
+## A request registers its thread while it runs; a sampler thread takes the stack of every request
+## that has been running longer than `slow_ms`, so fast requests cost one dict insert / delete.
+## The samples of a slow request are written as collapsed stacks (flamegraph.pl / speedscope input).
+class SlowRequestProfiler:
+    def __init__(self, slow_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, output_dir=METRICS_DIR):
+        self.slow = slow_ms / 1000
+        self.interval = interval_ms / 1000
+        self.output_dir = os.path.join(output_dir, "profiles")
+        self._active = {} # thread id -> [name, start, Counter of stacks]
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.slow > 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                slow = {thread_id: request for thread_id, request in self._active.items() if now - request[1] >= self.slow}
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for thread_id, request in slow.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = ";".join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                                     for entry in traceback.extract_stack(frame))
+                    request[2][stack] += 1
+
+    def profile(self, name):
+        return _ProfiledRequest(self, name)
+
+    def _finish(self, thread_id, elapsed):
+        with self._lock:
+            name, _, samples = self._active.pop(thread_id)
+        if not samples:
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        file_path = os.path.join(self.output_dir, f"{name.strip('/').replace('/', '_') or 'request'}-{time.time():.6f}.txt")
+        with open(file_path, "w") as file_obj:
+            for stack, count in samples.most_common():
+                file_obj.write(f"{stack} {count}\n")
+
+        metrics.inc("slow_requests_profiled_total", request=name)
+        log_event("slow request profiled", elapsed * 1000, request=name, samples=sum(samples.values()), profile=file_path)
+        return file_path
+
+
+class _ProfiledRequest:
+    __slots__ = ("profiler", "name", "thread_id", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.profiler._start()
+            self.thread_id = threading.get_ident()
+            self.start = time.perf_counter()
+            with self.profiler._lock:
+                self.profiler._active[self.thread_id] = [self.name, self.start, Counter()]
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler.enabled:
+            self.profiler._finish(self.thread_id, time.perf_counter() - self.start)
+        return False
+
+
+profiler = SlowRequestProfiler()
+
+
+# JSON snapshot written to a temporary file and renamed, one file per process
+def write_snapshot(output_dir=METRICS_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    file_path = os.path.join(output_dir, f"metrics-{os.getpid()}.json")
+    with open(f"{file_path}.tmp", "w") as file_obj:
+        json.dump(metrics.snapshot(), file_obj, indent=2)
+    os.replace(f"{file_path}.tmp", file_path)
+    return file_path
+
+
+class _SnapshotWriter(threading.Thread):
+    def __init__(self, interval, output_dir):
+        super().__init__(name="metrics-snapshots", daemon=True)
+        self.interval = interval
+        self.output_dir = output_dir
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            write_snapshot(self.output_dir)
+
+    def stop(self):
+        self.stopped.set()
+        write_snapshot(self.output_dir) # the last interval is not lost on exit
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporters = {}
+_exporters_lock = threading.Lock()
+
+
+# Start the /metrics endpoint and / or the snapshot thread once per process (the Streamlit
+# script re-runs on every interaction); arguments default to the environment settings
+def start_exporters(port=None, snapshot_seconds=None, host="127.0.0.1", output_dir=METRICS_DIR):
+    port = METRICS_PORT if port is None else port
+    snapshot_seconds = SNAPSHOT_SECONDS if snapshot_seconds is None else snapshot_seconds
+
+    with _exporters_lock:
+        if port and "http" not in _exporters:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            _exporters["http"] = server
+        if snapshot_seconds and "snapshots" not in _exporters:
+            writer = _SnapshotWriter(snapshot_seconds, output_dir)
+            writer.start()
+            atexit.register(writer.stop)
+            _exporters["snapshots"] = writer
+
+    return dict(_exporters)
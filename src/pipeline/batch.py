@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging
+from src.pipeline.predict_pipeline import PredictPipeline, DEFAULT_CHUNK_SIZE
+
+
+QUARANTINE_SUFFIX = '.quarantine.csv'
+
+
+# Read an inventory file (.csv or .parquet)
+def read_stones(file_path):
+    if file_path.endswith('.parquet'):
+        return pd.read_parquet(file_path)
+    return pd.read_csv(file_path)
+
+
+# Write the scored inventory (.csv or .parquet)
+def write_predictions(data, file_path):
+    dir_path = os.path.dirname(file_path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+
+    if file_path.endswith('.parquet'):
+        data.to_parquet(file_path, index=False)
+    else:
+        data.to_csv(file_path, index=False, header=True)
+
+
+## Score a whole inventory file with the price or carat model
+## Stones that fail validation get no prediction and are listed in <output>.quarantine.csv
+def run_batch(input_path, output_path, target='price', chunk_size=DEFAULT_CHUNK_SIZE, derive_depth=True):
+    try:
+        data = read_stones(input_path)
+        logging.info(f"Read {len(data)} stones from {input_path}")
+
+        predict_pipeline = PredictPipeline()
+        predict = {
+            'price': predict_pipeline.predict_price_batch,
+            'carat': predict_pipeline.predict_carat_batch,
+        }[target]
+
+        start = time.perf_counter()
+        quarantine_path = output_path + QUARANTINE_SUFFIX
+        pred = predict(data, chunk_size=chunk_size, derive_depth=derive_depth, quarantine_path=quarantine_path)
+        elapsed = time.perf_counter() - start
+
+        data[f'predicted_{target}'] = pred
+        write_predictions(data, output_path)
+
+        rows_per_sec = len(data) / elapsed if elapsed > 0 else float('inf')
+        logging.info(f"Scored {len(data)} stones in {elapsed:.3f}s ({rows_per_sec:,.0f} rows/sec)")
+
+        return {
+            'rows': len(data),
+            'seconds': elapsed,
+            'rows_per_sec': rows_per_sec,
+            'invalid_rows': int(pd.isna(pred).sum()),
+            'output': output_path,
+            'quarantine': quarantine_path,
+        }
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch price/carat prediction for an inventory file")
+    parser.add_argument('input', help="CSV or Parquet file shaped like data/diamonds.csv")
+    parser.add_argument('output', help="CSV or Parquet file for the predictions")
+    parser.add_argument('--target', choices=['price', 'carat'], default='price')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--keep-depth', action='store_true',
+                        help="use the depth column as-is instead of deriving it from x, y, z")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_batch(args.input, args.output, args.target, args.chunk_size, not args.keep_depth)
+    print(f"{report['rows']} rows scored in {report['seconds']:.3f}s "
+          f"({report['rows_per_sec']:,.0f} rows/sec) -> {report['output']}")
+    if report['invalid_rows']:
+        print(f"{report['invalid_rows']} invalid rows -> {report['quarantine']}")
@@ -0,0 +1,260 @@
+import sys
+import json
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+
+from src.exception import CustomException
+from src.logger import logging
+from src.dataset import DATASET_PATH, load_dataset
+from src.pipeline.compiled_model import TableEncoder
+from src.pipeline.model_registry import model_registry
+
+
+## Exact k-nearest comparable stones, in the feature space the price model sees
+## (one-hot grades + standardized numerics, the tables of the fitted preprocessor of the price
+## pipeline; the index is rebuilt when the model registry reloads that pipeline).
+## Stones are pre-partitioned by their (cut, color, clarity) combination: inside a partition
+## the one-hot part is constant, so distances are numeric-only and computed with one matrix
+## product per block. Between partitions the one-hot distance is a fixed lower bound, partitions
+## are visited nearest-first and skipped once that bound exceeds the current k-th distance.
+
+GRADE_COLUMNS = ['cut', 'color', 'clarity']
+STONE_COLUMNS = ['carat', 'cut', 'color', 'clarity', 'depth', 'table', 'price', 'x', 'y', 'z']
+
+
+@dataclass
+class ComparablesConfig:
+    data_path: str = DATASET_PATH
+    model_path: str = None # price pipeline whose preprocessor defines the space (default: the registry's)
+    block_size: int = 65536 # stones scored per matrix product, bounds the distance matrix
+
+
+# Stones of one grade combination, in buffers that double when they fill up
+class _Partition:
+    def __init__(self, grade_vector, n_numeric, n_values):
+        self.grade_vector = grade_vector
+        self.size = 0
+        self.encoded = np.empty((0, n_numeric), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float64)
+        self.values = np.empty((0, n_values), dtype=np.float64) # raw numerics + price, returned as is
+
+    def append(self, encoded, values):
+        end = self.size + len(encoded)
+        if end > len(self.encoded):
+            capacity = max(end, 2 * len(self.encoded), 16)
+            for name in ('encoded', 'sq_norms', 'values'):
+                old = getattr(self, name)
+                new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+
+        self.encoded[self.size:end] = encoded
+        self.sq_norms[self.size:end] = (encoded.astype(np.float64) ** 2).sum(axis=1)
+        self.values[self.size:end] = values
+        self.size = end
+
+
+# Consistent view of a partition for one search (appends go past `size` or into new buffers)
+class _Snapshot:
+    def __init__(self, partition):
+        self.size = partition.size
+        self.grade_vector = partition.grade_vector
+        self.encoded = partition.encoded[:self.size]
+        self.sq_norms = partition.sq_norms[:self.size]
+        self.values = partition.values[:self.size]
+
+
+## Exact kNN index over the inventory, supports batched queries and incremental inserts
+class ComparablesIndex:
+    def __init__(self, encoder, block_size=65536, model_version=None):
+        self.encoder = encoder
+        self.model_version = model_version # registry version of the pipeline the encoder comes from
+        self.block_size = block_size
+        self.numeric_columns = list(encoder.num_columns)
+        self.value_columns = self.numeric_columns + ['price']
+        self.partitions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, config=None):
+        try:
+            config = config or ComparablesConfig()
+            model_path = config.model_path or model_registry.config.price_model_path
+            pipeline = model_registry.get(model_path)
+            encoder = TableEncoder.from_preprocessor(pipeline.named_steps['preprocessor'])
+            index = cls(encoder, config.block_size, model_registry.version(model_path))
+            index.add(load_dataset(config.data_path))
+            logging.info(f"Built comparables index: {len(index)} stones in {len(index.partitions)} partitions")
+            return index
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def __len__(self):
+        return sum(partition.size for partition in self.partitions.values())
+
+    def _encode(self, features):
+        matrix = self.encoder.transform(features)
+        offset = self.encoder.num_offset
+        return matrix[:, :offset], matrix[:, offset:offset + len(self.numeric_columns)]
+
+    @staticmethod
+    def _grade_keys(features):
+        columns = [np.atleast_1d(np.asarray(features[col]).astype(str)) for col in GRADE_COLUMNS]
+        return list(zip(*[col.tolist() for col in columns]))
+
+    # insert new stones (DataFrame or dict of columns, with their price)
+    def add(self, stones):
+        try:
+            grades, encoded = self._encode(stones)
+            values = np.column_stack([
+                np.atleast_1d(np.asarray(stones[col], dtype=np.float64)) for col in self.value_columns
+            ])
+            keys = self._grade_keys(stones)
+
+            groups = {}
+            for row, key in enumerate(keys):
+                groups.setdefault(key, []).append(row)
+
+            with self._lock:
+                for key, rows in groups.items():
+                    partition = self.partitions.get(key)
+                    if partition is None:
+                        partition = _Partition(grades[rows[0]].copy(), encoded.shape[1], values.shape[1])
+                        self.partitions[key] = partition
+                    partition.append(encoded[rows], values[rows])
+
+            return len(keys)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # k nearest stones of every query row, nearest first
+    # returns distances, partitions (index into `partitions`, -1 = none) and rows, all [n, k]
+    def _search(self, partitions, grades, encoded, keys, k):
+        n_queries = len(encoded)
+        best_dist = np.full((n_queries, k), np.inf)
+        best_part = np.full((n_queries, k), -1, dtype=np.int64)
+        best_row = np.full((n_queries, k), -1, dtype=np.int64)
+
+        groups = {}
+        for row, key in enumerate(keys):
+            groups.setdefault(key, []).append(row)
+
+        sizes = [partition.size for partition in partitions]
+        grade_vectors = np.array([partition.grade_vector for partition in partitions], dtype=np.float64)
+
+        for rows in groups.values():
+            rows = np.array(rows)
+            query = encoded[rows].astype(np.float64)
+            query_sq = (query ** 2).sum(axis=1)
+
+            # one-hot part of the distance, the same for the whole partition
+            grade_dist = ((grade_vectors - grades[rows[0]]) ** 2).sum(axis=1)
+            for p in np.argsort(grade_dist, kind='stable'):
+                if grade_dist[p] >= best_dist[rows, -1].max():
+                    break # no stone of this or any farther partition can get in
+
+                partition = partitions[p]
+                for start in range(0, sizes[p], self.block_size):
+                    end = min(start + self.block_size, sizes[p])
+                    block = partition.encoded[start:end].astype(np.float64)
+                    dist = query_sq[:, None] - 2 * query @ block.T + partition.sq_norms[start:end]
+                    dist = np.maximum(dist, 0) + grade_dist[p]
+
+                    take = min(k, end - start)
+                    cand = np.argpartition(dist, take - 1, axis=1)[:, :take]
+                    cand_dist = np.take_along_axis(dist, cand, axis=1)
+
+                    merged = np.concatenate([best_dist[rows], cand_dist], axis=1)
+                    order = np.argsort(merged, axis=1, kind='stable')[:, :k]
+                    best_dist[rows] = np.take_along_axis(merged, order, axis=1)
+                    merged_part = np.concatenate([best_part[rows], np.full_like(cand, p)], axis=1)
+                    best_part[rows] = np.take_along_axis(merged_part, order, axis=1)
+                    merged_row = np.concatenate([best_row[rows], cand + start], axis=1)
+                    best_row[rows] = np.take_along_axis(merged_row, order, axis=1)
+
+        return np.sqrt(best_dist), best_part, best_row
+
+    ## `features`: one stone or a batch (DataFrame or dict of columns, price not needed)
+    ## Returns one row per (query, rank) with the comparable stone, its real price and distance
+    def find_comparables(self, features, k=10):
+        try:
+            if k < 1:
+                raise ValueError(f"k must be at least 1, got {k}")
+            grades, encoded = self._encode(features)
+            keys = self._grade_keys(features)
+            with self._lock:
+                # stones inserted during the search are not seen by it
+                partitions = [(key, _Snapshot(partition)) for key, partition in self.partitions.items()]
+            distances, part, row = self._search([p for _, p in partitions], grades, encoded, keys, k)
+
+            found = part >= 0 # fewer than k stones in the index leaves -1
+            query, rank = np.nonzero(found)
+            part, row = part[found], row[found]
+
+            values = np.empty((len(part), len(self.value_columns)))
+            grade_values = np.empty((len(part), len(GRADE_COLUMNS)), dtype=object)
+            for p in np.unique(part):
+                mask = part == p
+                values[mask] = partitions[p][1].values[row[mask]]
+                grade_values[mask] = partitions[p][0]
+
+            result = pd.DataFrame({'query': query, 'rank': rank, 'distance': distances[found]})
+            for i, col in enumerate(GRADE_COLUMNS):
+                result[col] = grade_values[:, i]
+            for i, col in enumerate(self.value_columns):
+                result[col] = values[:, i]
+            result['price'] = result['price'].astype('int64')
+            return result[['query', 'rank', 'distance'] + STONE_COLUMNS]
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Index over data/diamonds.csv, built on the first call and again whenever the price pipeline
+# is retrained (stones added with `add` since the last build are not carried over)
+def comparables_index():
+    global _index
+    model_path = model_registry.config.price_model_path
+    with _index_lock:
+        model_registry.get(model_path) # reloads a changed pipeline
+        if _index is None or _index.model_version != model_registry.version(model_path):
+            if _index is not None:
+                logging.info(f"{model_path} changed, rebuilding the comparables index")
+            _index = ComparablesIndex.build()
+        return _index
+
+
+def find_comparables(features, k=10):
+    return comparables_index().find_comparables(features, k)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Most similar stones in the inventory")
+    parser.add_argument('--carat', type=float, required=True)
+    parser.add_argument('--cut', required=True)
+    parser.add_argument('--color', required=True)
+    parser.add_argument('--clarity', required=True)
+    parser.add_argument('--depth', type=float, required=True)
+    parser.add_argument('--table', type=float, required=True)
+    parser.add_argument('--x', type=float, required=True)
+    parser.add_argument('--y', type=float, required=True)
+    parser.add_argument('--z', type=float, required=True)
+    parser.add_argument('-k', type=int, default=10)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = vars(parse_args())
+    k = args.pop('k')
+    result = find_comparables({col: [value] for col, value in args.items()}, k)
+    print(json.dumps(result.drop(columns=['query']).to_dict(orient='records'), indent=2))
@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import numpy as np
+
+from src.exception import CustomException
+from src.utils import file_digest
+from src.pipeline.fast_encoder import preprocessor_tables
+
+
+## Dependency-free copy of a fitted price/carat pipeline
+## (ColumnTransformer[OneHotEncoder(drop='first'), StandardScaler] + XGBRegressor)
+## compiled into flat arrays and evaluated with NumPy only.
+## Only `export_pipeline` needs sklearn / xgboost, and imports them itself.
+## The file records the path and sha256 of the pickle it was compiled from; `load` refuses it once
+## that pickle has been retrained (local_run exports the models again after every training).
+
+COMPILED_PRICE_MODEL = os.path.join('data', 'final_model_pipeline_compiled.npz')
+COMPILED_CARAT_MODEL = os.path.join('data', 'final_model_pipeline_carat_compiled.npz')
+
+
+## The preprocessing part: one-hot tables and scaler vectors, evaluated on whole columns
+class TableEncoder:
+    def __init__(self, cat_columns, cat_tables, num_columns, num_offset, n_features, mean, scale):
+        self.cat_columns = cat_columns
+        self.cat_tables = cat_tables # per column: [(category, output column)], -1 = dropped first category
+        self.num_columns = num_columns
+        self.num_offset = num_offset
+        self.n_features = n_features
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+    # straight from a fitted ColumnTransformer (needs sklearn only for the object itself)
+    @classmethod
+    def from_preprocessor(cls, preprocessor):
+        tables = preprocessor_tables(preprocessor)
+        cat_tables = [list(zip(values, index)) for values, index in zip(tables['cat_values'], tables['cat_index'])]
+        return cls(tables['cat_columns'], cat_tables, tables['num_columns'], tables['num_offset'],
+                   tables['n_features'], tables['mean'], tables['scale'])
+
+    # one-hot + standardized feature matrix, same layout as the ColumnTransformer output
+    # `features` is anything indexable by column name (DataFrame, dict of lists / arrays)
+    def transform(self, features):
+        n_rows = len(np.atleast_1d(np.asarray(features[self.num_columns[0]])))
+        matrix = np.zeros((n_rows, self.n_features), dtype=np.float32)
+
+        for col, table in zip(self.cat_columns, self.cat_tables):
+            values = np.atleast_1d(np.asarray(features[col]).astype(str))
+            known = np.zeros(n_rows, dtype=bool)
+            for category, out_col in table:
+                mask = values == category
+                known |= mask
+                if out_col >= 0:
+                    matrix[mask, out_col] = 1.0
+            if not known.all():
+                raise ValueError(f"Found unknown categories {sorted(set(values[~known]))} in column '{col}'")
+
+        for i, col in enumerate(self.num_columns):
+            values = np.atleast_1d(np.asarray(features[col], dtype=np.float64))
+            matrix[:, self.num_offset + i] = (values - self.mean[i]) / self.scale[i]
+
+        return matrix
+
+
+class CompiledModel(TableEncoder):
+    def __init__(self, arrays):
+        cat_columns = [str(col) for col in arrays['cat_columns']]
+        cat_tables = []
+        offsets = arrays['cat_offsets']
+        for i in range(len(cat_columns)):
+            values = arrays['cat_values'][offsets[i]:offsets[i + 1]]
+            index = arrays['cat_index'][offsets[i]:offsets[i + 1]]
+            cat_tables.append(list(zip([str(v) for v in values], index.tolist())))
+        super().__init__(cat_columns, cat_tables, [str(col) for col in arrays['num_columns']],
+                         int(arrays['num_offset']), int(arrays['n_features']), arrays['mean'], arrays['scale'])
+
+        self.feature = arrays['feature'] # [n_trees, max_nodes], -1 on leaves
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.default_left = arrays['default_left']
+        self.value = arrays['value']
+        self.max_depth = int(arrays['max_depth'])
+        self.base_score = np.float32(arrays['base_score'])
+        self.n_trees = self.feature.shape[0]
+        self.model_path = str(arrays['model_path']) if 'model_path' in arrays else None
+        self.model_sha256 = str(arrays['model_sha256']) if 'model_sha256' in arrays else None
+
+    # check_model: refuse a file compiled from another version of the pickle (or of unknown origin)
+    @classmethod
+    def load(cls, file_path, check_model=True):
+        try:
+            with np.load(file_path, allow_pickle=False) as arrays:
+                model = cls({key: arrays[key] for key in arrays.files})
+
+            if check_model:
+                if model.model_sha256 is None:
+                    raise ValueError(f"{file_path} doesn't record the model it was compiled from, "
+                                     f"run python -m src.pipeline.compiled_model")
+                if os.path.exists(model.model_path) and file_digest(model.model_path) != model.model_sha256:
+                    raise ValueError(f"{file_path} was compiled from an older {model.model_path}, "
+                                     f"run python -m src.pipeline.compiled_model")
+            return model
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # walk every tree for every row at once, one level per step
+    def predict_matrix(self, matrix, chunk_size=4096):
+        pred = np.empty(len(matrix), dtype=np.float32)
+        trees = np.arange(self.n_trees)
+
+        for start in range(0, len(matrix), chunk_size):
+            X = matrix[start:start + chunk_size]
+            rows = np.arange(len(X))[:, None]
+            node = np.zeros((len(X), self.n_trees), dtype=np.int32)
+
+            for _ in range(self.max_depth):
+                feature = self.feature[trees, node]
+                is_leaf = feature < 0
+                if is_leaf.all():
+                    break
+                x = X[rows, np.where(is_leaf, 0, feature)]
+                go_left = np.where(np.isnan(x), self.default_left[trees, node], x < self.threshold[trees, node])
+                node = np.where(is_leaf, node, np.where(go_left, self.left[trees, node], self.right[trees, node]))
+
+            pred[start:start + len(X)] = self.value[trees, node].sum(axis=1, dtype=np.float32) + self.base_score
+
+        return pred
+
+    def predict(self, features):
+        try:
+            return self.predict_matrix(self.transform(features))
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+# Flatten one XGBoost tree (JSON dump) into node arrays
+def _flatten_tree(tree, feature_index):
+    nodes = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        nodes[node['nodeid']] = node
+        stack.extend(node.get('children', []))
+
+    n_nodes = max(nodes) + 1
+    feature = np.full(n_nodes, -1, dtype=np.int32)
+    threshold = np.zeros(n_nodes, dtype=np.float32)
+    left = np.zeros(n_nodes, dtype=np.int32)
+    right = np.zeros(n_nodes, dtype=np.int32)
+    default_left = np.zeros(n_nodes, dtype=bool)
+    value = np.zeros(n_nodes, dtype=np.float32)
+
+    for node_id, node in nodes.items():
+        if 'leaf' in node:
+            value[node_id] = node['leaf']
+        else:
+            feature[node_id] = feature_index(node['split'])
+            threshold[node_id] = node['split_condition']
+            left[node_id] = node['yes']
+            right[node_id] = node['no']
+            default_left[node_id] = node['missing'] == node['yes']
+
+    return feature, threshold, left, right, default_left, value
+
+
+def _tree_depth(tree):
+    children = tree.get('children', [])
+    return 1 + max((_tree_depth(child) for child in children), default=0)
+
+
+## Compile a fitted sklearn Pipeline into the arrays used by CompiledModel
+## model_path: the pickle of `pipeline`, recorded with its sha256
+def export_pipeline(pipeline, file_path, model_path=None):
+    try:
+        preprocessor = pipeline.named_steps['preprocessor']
+        estimator = pipeline.named_steps['model']
+        if not hasattr(estimator, 'get_booster'):
+            raise ValueError(f"Only XGBoost pipelines can be compiled, {model_path or 'this pipeline'} "
+                             f"holds a {type(estimator).__name__}")
+        booster = estimator.get_booster()
+
+        tables = preprocessor_tables(preprocessor)
+        cat_values = [value for values in tables['cat_values'] for value in values]
+        cat_index = [index for indices in tables['cat_index'] for index in indices]
+        cat_offsets = np.cumsum([0] + [len(values) for values in tables['cat_values']])
+
+        feature_names = booster.feature_names
+        def feature_index(split):
+            if feature_names is not None and split in feature_names:
+                return feature_names.index(split)
+            return int(split.lstrip('f'))
+
+        trees = [json.loads(dump) for dump in booster.get_dump(dump_format='json')]
+        flat = [_flatten_tree(tree, feature_index) for tree in trees]
+        max_nodes = max(len(arrays[0]) for arrays in flat)
+
+        def stack(i, fill, dtype):
+            out = np.full((len(flat), max_nodes), fill, dtype=dtype)
+            for t, arrays in enumerate(flat):
+                out[t, :len(arrays[i])] = arrays[i]
+            return out
+
+        config = json.loads(booster.save_config())
+        base_score = float(config['learner']['learner_model_param']['base_score'])
+        objective = config['learner']['objective']['name']
+        if objective not in ('reg:squarederror', 'reg:absoluteerror', 'reg:pseudohubererror'):
+            raise ValueError(f"Objective {objective} has a non-identity link, can't compile it")
+
+        arrays = {
+            'cat_columns': np.array(tables['cat_columns'], dtype=str),
+            'cat_values': np.array(cat_values, dtype=str),
+            'cat_index': np.array(cat_index, dtype=np.int32),
+            'cat_offsets': np.array(cat_offsets, dtype=np.int32),
+            'num_columns': np.array(tables['num_columns'], dtype=str),
+            'num_offset': np.array(tables['num_offset']),
+            'n_features': np.array(tables['n_features']),
+            'mean': np.asarray(tables['mean'], dtype=np.float64),
+            'scale': np.asarray(tables['scale'], dtype=np.float64),
+            'feature': stack(0, -1, np.int32),
+            'threshold': stack(1, 0, np.float32),
+            'left': stack(2, 0, np.int32),
+            'right': stack(3, 0, np.int32),
+            'default_left': stack(4, False, bool),
+            'value': stack(5, 0, np.float32),
+            'max_depth': np.array(max(_tree_depth(tree) for tree in trees)),
+            'base_score': np.array(base_score, dtype=np.float32),
+        }
+        if model_path is not None:
+            arrays['model_path'] = np.array(model_path)
+            arrays['model_sha256'] = np.array(file_digest(model_path))
+
+        dir_path = os.path.dirname(file_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        np.savez(file_path, **arrays)
+
+        return CompiledModel(arrays)
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+## Compile the saved pipelines and check them against the originals
+## (float32 sums over 100 trees: compare with a relative tolerance)
+def export_models(data_path=os.path.join('data', 'diamonds.csv'), rtol=1e-5, atol=1e-3):
+    try:
+        import pandas as pd
+        from src.logger import logging
+        from src.pipeline.model_registry import model_registry
+        from src.pipeline.predict_pipeline import PRICE_FEATURES, CARAT_FEATURES, prepare_batch
+
+        data = pd.read_csv(data_path)
+        report = {}
+        for model_path, compiled_path, columns in [
+            (model_registry.config.price_model_path, COMPILED_PRICE_MODEL, PRICE_FEATURES),
+            (model_registry.config.carat_model_path, COMPILED_CARAT_MODEL, CARAT_FEATURES),
+        ]:
+            pipeline = model_registry.get(model_path)
+            compiled = export_pipeline(pipeline, compiled_path, model_path)
+
+            features = prepare_batch(data, columns)
+            expected = pipeline.predict(features)
+            error = np.abs(expected - compiled.predict(features))
+            if not np.all(error <= atol + rtol * np.abs(expected)):
+                raise ValueError(f"Compiled {model_path} differs from the original by up to {error.max()}")
+
+            logging.info(f"Compiled {model_path} into {compiled_path} (max abs error {error.max():.2e})")
+            report[compiled_path] = float(error.max())
+
+        return report
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    for compiled_path, max_error in export_models().items():
+        print(f"{compiled_path}: max abs error {max_error:.2e}")
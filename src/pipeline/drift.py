@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import bisect
+import argparse
+import threading
+import numpy as np
+
+from dataclasses import dataclass
+
+from src.exception import CustomException
+from src.logger import logging
+from src.metrics import metrics
+from src.validation import CATEGORY_DOMAINS
+
+
+## Feature drift of the prediction traffic against the training split
+## The reference profile is computed once from the training split written by DataIngestion:
+## `n_bins` quantile bins per numeric feature (their edges and the share of training rows in each,
+## 1/n_bins up to ties) and the share of every grade. The live side is a constant-memory sketch over
+## the same bins: one counter per bin / grade, so recording a stone is one bisect per numeric feature
+## and one dict lookup per grade. Every `interval_seconds` the counts of the window are compared with
+## the reference (PSI per feature, KS distance for the numeric ones on the bin edges), exported as the
+## feature_psi / feature_ks gauges and logged, then the window starts over.
+## Settings (environment variables):
+##   DIAMOND_DRIFT            0 turns the monitor off (default 1)
+##   DIAMOND_DRIFT_SECONDS    length of a window (default 300)
+##   DIAMOND_DRIFT_REFERENCE  reference profile (default data/drift_reference.json)
+
+ENABLED = os.environ.get("DIAMOND_DRIFT", "1") != "0"
+DRIFT_SECONDS = float(os.environ.get("DIAMOND_DRIFT_SECONDS", 300))
+REFERENCE_PATH = os.environ.get("DIAMOND_DRIFT_REFERENCE", os.path.join('data', 'drift_reference.json'))
+
+NUMERIC_FEATURES = ['carat', 'depth', 'table', 'price', 'x', 'y', 'z']
+EPSILON = 1e-4 # floor of the shares in the PSI, for empty bins
+
+
+@dataclass
+class DriftConfig:
+    enabled: bool = ENABLED
+    reference_path: str = REFERENCE_PATH
+    interval_seconds: float = DRIFT_SECONDS
+    n_bins: int = 20 # quantile bins per numeric feature in the reference
+    min_rows: int = 100 # a window with fewer rows is extended to the next interval
+    psi_alert: float = 0.2 # PSI from which a feature is logged as drifted
+
+
+## Reference profile of the training split, written as JSON (temporary file + rename)
+## train_path: split written by DataIngestion, by default the one of the artifact store
+## (the one local_run.py trained on; reused as is when the dataset hasn't changed)
+def build_reference(train_path=None, output_path=REFERENCE_PATH, n_bins=20):
+    try:
+        from src.components.columnar_cache import read_split
+
+        if train_path is None:
+            from src.components.data_ingestion import DataIngestion
+            from src.components.artifact_store import ArtifactStore
+
+            train_path, _ = DataIngestion(store=ArtifactStore()).initiate_data_ingestion()
+        data = read_split(train_path)
+        profile = {'source': train_path, 'rows': len(data), 'created_at': time.time(),
+                   'numeric': {}, 'categorical': {}}
+
+        for col in NUMERIC_FEATURES:
+            values = data[col].to_numpy(dtype=np.float64)
+            edges = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1]))
+            counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+            profile['numeric'][col] = {'edges': edges.tolist(), 'shares': (counts / len(values)).tolist()}
+
+        for col, grades in CATEGORY_DOMAINS.items():
+            counts = data[col].astype(str).value_counts()
+            profile['categorical'][col] = {'values': list(grades),
+                                           'shares': [float(counts.get(grade, 0)) / len(data) for grade in grades]}
+
+        dir_path = os.path.dirname(output_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        with open(f"{output_path}.tmp", "w") as file_obj:
+            json.dump(profile, file_obj)
+        os.replace(f"{output_path}.tmp", output_path)
+        logging.info(f"Drift reference of {len(data)} training rows written to {output_path}")
+        return profile
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def psi(expected, actual):
+    expected = np.maximum(np.asarray(expected, dtype=np.float64), EPSILON)
+    actual = np.maximum(np.asarray(actual, dtype=np.float64), EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+# largest gap between the two CDFs at the bin edges
+def ks_distance(expected, actual):
+    return float(np.max(np.abs(np.cumsum(actual) - np.cumsum(expected))))
+
+
+## Counts of one entry point (e.g. the price model) for the features it receives
+class FeatureSketch:
+    def __init__(self, profile, columns):
+        self.numeric = [(col, profile['numeric'][col]['edges'], np.zeros(len(profile['numeric'][col]['shares']), dtype=np.int64))
+                        for col in columns if col in profile['numeric']]
+        self.categorical = [(col, {value: i for i, value in enumerate(profile['categorical'][col]['values'])},
+                             np.zeros(len(profile['categorical'][col]['values']) + 1, dtype=np.int64)) # + unknown
+                            for col in columns if col in profile['categorical']]
+        self.rows = 0
+        self.window_start = time.time() # a window lasts until this sketch has min_rows
+
+    # one stone: a dict or a Series
+    def add(self, stone):
+        for col, edges, counts in self.numeric:
+            counts[bisect.bisect_right(edges, float(stone[col]))] += 1
+        for col, index, counts in self.categorical:
+            counts[index.get(str(stone[col]), -1)] += 1
+        self.rows += 1
+
+    # many stones: a DataFrame
+    def add_frame(self, frame):
+        for col, edges, counts in self.numeric:
+            bins = np.searchsorted(edges, frame[col].to_numpy(dtype=np.float64), side='right')
+            counts += np.bincount(bins, minlength=len(counts))
+        for col, index, counts in self.categorical:
+            codes = frame[col].astype(str).map(index).fillna(-1).to_numpy(dtype=np.int64)
+            counts += np.bincount(codes % len(counts), minlength=len(counts))
+        self.rows += len(frame)
+
+    def reset(self):
+        for _, _, counts in self.numeric + self.categorical:
+            counts[:] = 0
+        self.rows = 0
+        self.window_start = time.time()
+
+    # PSI (and KS) of every feature against the reference
+    def scores(self, profile):
+        scores = {}
+        for col, _, counts in self.numeric:
+            expected = profile['numeric'][col]['shares']
+            actual = counts / self.rows
+            scores[col] = {'psi': psi(expected, actual), 'ks': ks_distance(expected, actual)}
+        for col, _, counts in self.categorical:
+            expected = profile['categorical'][col]['shares'] + [0.0]
+            scores[col] = {'psi': psi(expected, counts / self.rows), 'unknown': int(counts[-1])}
+        return scores
+
+
+class DriftMonitor:
+    def __init__(self, config=None):
+        self.config = config or DriftConfig()
+        self.enabled = self.config.enabled
+        self.profile = None
+        self.last_report = {}
+        self._sketches = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def _load(self):
+        if not os.path.exists(self.config.reference_path):
+            logging.info(f"No drift reference at {self.config.reference_path}, drift monitor off")
+            self.enabled = False
+            return
+        with open(self.config.reference_path) as file_obj:
+            self.profile = json.load(file_obj)
+        self._thread = threading.Thread(target=self._run, name='drift-monitor', daemon=True)
+        self._thread.start()
+
+    def _sketch(self, entry, columns):
+        sketch = self._sketches.get(entry)
+        if sketch is None:
+            if self.profile is None:
+                self._load()
+                if not self.enabled:
+                    return None
+            sketch = self._sketches[entry] = FeatureSketch(self.profile, columns)
+        return sketch
+
+    ## Record the stones sent to an entry point: one stone (dict / Series) or a DataFrame
+    def observe(self, entry, columns, stones):
+        with self._lock:
+            sketch = self._sketch(entry, columns)
+            if sketch is None:
+                return
+            if hasattr(stones, 'columns'):
+                sketch.add_frame(stones)
+            else:
+                sketch.add(stones)
+
+    # close the window: score it, export the scores, start a new one
+    def emit(self):
+        with self._lock:
+            ready = {entry: sketch for entry, sketch in self._sketches.items() if sketch.rows >= self.config.min_rows}
+            report = {entry: {'rows': sketch.rows, 'features': sketch.scores(self.profile),
+                              'window_start': sketch.window_start}
+                      for entry, sketch in ready.items()}
+            for sketch in ready.values():
+                sketch.reset()
+        if not report:
+            return None
+
+        now = time.time()
+        for entry, window in report.items():
+            window['window_end'] = now
+            metrics.set('drift_window_rows', window['rows'], entry=entry)
+            for feature, score in window['features'].items():
+                metrics.set('feature_psi', score['psi'], entry=entry, feature=feature)
+                if 'ks' in score:
+                    metrics.set('feature_ks', score['ks'], entry=entry, feature=feature)
+
+            drifted = {feature: round(score['psi'], 3) for feature, score in window['features'].items()
+                       if score['psi'] >= self.config.psi_alert}
+            if drifted:
+                logging.warning(f"Feature drift on {entry} ({window['rows']} rows): PSI {drifted}")
+            else:
+                logging.info(f"No feature drift on {entry} ({window['rows']} rows)")
+
+        self.last_report = report
+        return report
+
+    def _run(self):
+        while not self._stopped.wait(self.config.interval_seconds):
+            try:
+                self.emit()
+            except Exception as e:
+                logging.info(f"Drift scoring failed: {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+
+drift_monitor = DriftMonitor()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the drift reference profile from the training split")
+    parser.add_argument('--train-path', default=None,
+                        help="training split written by DataIngestion (default: the split of the artifact store)")
+    parser.add_argument('--output', default=REFERENCE_PATH)
+    parser.add_argument('--bins', type=int, default=DriftConfig.n_bins)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    profile = build_reference(args.train_path, args.output, args.bins)
+    print(f"Drift reference of {profile['rows']} rows from {profile['source']} written to {args.output}")
@@ -0,0 +1,218 @@
+import os
+import sys
+import time
+import weakref
+import threading
+import numpy as np
+
+from src.exception import CustomException
+from src.logger import logging
+
+
+## Single-row replacement for the fitted ColumnTransformer[OneHotEncoder(drop='first'), StandardScaler]
+## The fitted preprocessor is exported into plain tables (category -> output column, mean / scale
+## per numeric column) and one stone (dict, Series or tuple) is written straight into a preallocated
+## float32 row, without pandas. The arithmetic is the scaler's own float64 (x - mean) / scale, so the
+## row is bit-for-bit the sklearn output as XGBoost sees it (cast to float32).
+
+
+# Tables of a fitted ColumnTransformer, in its output column order (also used by compiled_model)
+def preprocessor_tables(preprocessor):
+    if getattr(preprocessor, 'remainder', 'drop') != 'drop':
+        raise ValueError("Can't export a ColumnTransformer that passes the remaining columns through")
+
+    tables = {'cat_columns': [], 'cat_values': [], 'cat_index': [], 'num_columns': [],
+              'num_offset': 0, 'mean': None, 'scale': None, 'n_features': 0}
+    n_features = 0
+
+    for name, transformer, columns in preprocessor.transformers_:
+        if transformer == 'drop' or len(columns) == 0:
+            continue
+        kind = type(transformer).__name__
+        if kind == 'OneHotEncoder':
+            if transformer.handle_unknown != 'error' or getattr(transformer, 'infrequent_categories_', None):
+                raise ValueError(f"Can't export the '{name}' step: only handle_unknown='error' is supported")
+            drop_idx = transformer.drop_idx_ if transformer.drop_idx_ is not None else [None] * len(columns)
+            for col, categories, dropped in zip(columns, transformer.categories_, drop_idx):
+                index = []
+                for i in range(len(categories)):
+                    if dropped is not None and i == dropped:
+                        index.append(-1)
+                    else:
+                        index.append(n_features)
+                        n_features += 1
+                tables['cat_columns'].append(str(col))
+                tables['cat_values'].append([str(category) for category in categories])
+                tables['cat_index'].append(index)
+        elif kind == 'StandardScaler':
+            tables['num_columns'] = [str(col) for col in columns]
+            tables['num_offset'] = n_features
+            tables['mean'] = transformer.mean_ if transformer.with_mean else np.zeros(len(columns))
+            tables['scale'] = transformer.scale_ if transformer.with_std else np.ones(len(columns))
+            n_features += len(columns)
+        else:
+            raise ValueError(f"Can't export the '{name}' step ({kind})")
+
+    tables['n_features'] = n_features
+    return tables
+
+
+class FastEncoder:
+    def __init__(self, tables, columns=None):
+        self.n_features = tables['n_features']
+        self.columns = list(columns) if columns is not None else tables['cat_columns'] + tables['num_columns']
+        self.categorical = [
+            (col, dict(zip(values, index)))
+            for col, values, index in zip(tables['cat_columns'], tables['cat_values'], tables['cat_index'])
+        ]
+        self.numeric = [
+            (col, tables['num_offset'] + i, float(mean), float(scale))
+            for i, (col, mean, scale) in enumerate(zip(tables['num_columns'], tables['mean'], tables['scale']))
+        ]
+        self._local = threading.local()
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor):
+        return cls(preprocessor_tables(preprocessor), getattr(preprocessor, 'feature_names_in_', None))
+
+    # the calling thread's row, reused from one stone to the next
+    def buffer(self):
+        out = getattr(self._local, 'out', None)
+        if out is None:
+            out = self._local.out = np.zeros((1, self.n_features), dtype=np.float32)
+        return out
+
+    ## (1, n_features) float32 matrix of one stone; `stone` is a dict / Series, or a tuple in `columns` order
+    ## The returned row is the thread's buffer unless `out` is given: use it before encoding the next stone
+    def encode(self, stone, out=None):
+        if isinstance(stone, tuple):
+            stone = dict(zip(self.columns, stone))
+        out = self.buffer() if out is None else out
+        out.fill(0.0)
+        row = out[0]
+
+        for col, table in self.categorical:
+            index = table.get(str(stone[col]))
+            if index is None:
+                raise ValueError(f"Found unknown categories ['{stone[col]}'] in column '{col}'")
+            if index >= 0:
+                row[index] = 1.0
+
+        for col, index, mean, scale in self.numeric:
+            row[index] = (float(stone[col]) - mean) / scale
+
+        return out
+
+    # several stones into one matrix (one encode per row)
+    def encode_rows(self, stones):
+        out = np.zeros((len(stones), self.n_features), dtype=np.float32)
+        for i, stone in enumerate(stones):
+            self.encode(stone, out[i:i + 1])
+        return out
+
+    # stones covering every category and numbers around the fitted means
+    def probe_rows(self, n_rows=64, seed=0):
+        rng = np.random.RandomState(seed)
+        rows = []
+        for i in range(n_rows):
+            stone = {col: list(table)[i % len(table)] for col, table in self.categorical}
+            for col, _, mean, scale in self.numeric:
+                stone[col] = mean + scale * rng.normal(0, 2)
+            rows.append(stone)
+        return rows
+
+    # compare with the sklearn transform as XGBoost sees it (float32), 0 differing values = bit-for-bit
+    def check(self, preprocessor, stones):
+        import pandas as pd
+
+        frame = pd.DataFrame(list(stones), columns=self.columns)
+        expected = preprocessor.transform(frame)
+        if hasattr(expected, 'toarray'):
+            expected = expected.toarray()
+        expected = np.asarray(expected, dtype=np.float32)
+        actual = self.encode_rows(frame.to_dict('records'))
+
+        same = (expected.view(np.uint32) == actual.view(np.uint32)) | (np.isnan(expected) & np.isnan(actual))
+        return int((~same).sum())
+
+
+# Encoder of a fitted pipeline (preprocessor + model), None if its preprocessor can't be exported
+# or doesn't match the sklearn output on the probe stones
+def pipeline_encoder(pipeline):
+    steps = getattr(pipeline, 'named_steps', None)
+    if steps is None or list(steps) != ['preprocessor', 'model']:
+        return None
+    try:
+        encoder = FastEncoder.from_preprocessor(steps['preprocessor'])
+    except (ValueError, AttributeError) as e:
+        logging.info(f"No fast encoder for this pipeline: {e}")
+        return None
+
+    mismatches = encoder.check(steps['preprocessor'], encoder.probe_rows())
+    if mismatches:
+        logging.info(f"Fast encoder differs from the fitted preprocessor in {mismatches} values, not used")
+        return None
+    return encoder
+
+
+_encoders = weakref.WeakKeyDictionary() # fitted pipeline -> its encoder (None: not exportable)
+_encoders_lock = threading.Lock()
+
+
+# Encoder of a pipeline held by the model registry, built once per loaded pipeline object
+# (a reloaded artifact is a new object, so its encoder is rebuilt)
+def cached_encoder(pipeline):
+    with _encoders_lock:
+        if pipeline in _encoders:
+            return _encoders[pipeline]
+    encoder = pipeline_encoder(pipeline)
+    with _encoders_lock:
+        _encoders[pipeline] = encoder
+    return encoder
+
+
+## Check the encoders of the saved pipelines on a dataset, value by value, and time both paths
+def check_models(data_path=os.path.join('data', 'diamonds.csv'), n_timed=1000):
+    try:
+        import pandas as pd
+        from src.pipeline.model_registry import model_registry
+        from src.pipeline.predict_pipeline import PRICE_FEATURES, CARAT_FEATURES, prepare_batch
+
+        data = pd.read_csv(data_path)
+        report = {}
+        for model_path, columns in [
+            (model_registry.config.price_model_path, PRICE_FEATURES),
+            (model_registry.config.carat_model_path, CARAT_FEATURES),
+        ]:
+            pipeline = model_registry.get(model_path)
+            preprocessor = pipeline.named_steps['preprocessor']
+            encoder = pipeline_encoder(pipeline)
+            if encoder is None:
+                raise ValueError(f"{model_path} has no fast encoder")
+
+            features = prepare_batch(data, columns)
+            mismatches = encoder.check(preprocessor, features.to_dict('records'))
+
+            stones = features.head(n_timed).to_dict('records')
+            start = time.perf_counter()
+            for i in range(len(stones)):
+                preprocessor.transform(features.iloc[i:i + 1])
+            sklearn_us = (time.perf_counter() - start) / len(stones) * 1e6
+            start = time.perf_counter()
+            for stone in stones:
+                encoder.encode(stone)
+            encoder_us = (time.perf_counter() - start) / len(stones) * 1e6
+
+            report[model_path] = {'rows': len(features), 'mismatched_values': mismatches,
+                                  'sklearn_us_per_row': sklearn_us, 'encoder_us_per_row': encoder_us}
+
+        return report
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    for model_path, result in check_models().items():
+        print(f"{model_path}: {result['mismatched_values']} mismatched values over {result['rows']} rows, "
+              f"{result['sklearn_us_per_row']:.0f} us -> {result['encoder_us_per_row']:.1f} us per row")
@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import threading
+
+from dataclasses import dataclass, field
+
+from src.exception import CustomException
+from src.logger import logging
+from src.metrics import metrics
+from src.utils import load_object, file_signature, file_digest
+
+
+@dataclass
+class ModelRegistryConfig:
+    price_model_path: str = os.path.join('data', 'final_model_pipeline.pkl')
+    carat_model_path: str = os.path.join('data', 'final_model_pipeline_carat_xgb.pkl')
+    interval_model_path: str = os.path.join('data', 'final_model_pipeline_interval.pkl') # low / high price quantiles
+    check_interval: float = 1.0 # seconds between two stat() calls on the same artifact
+    use_hash: bool = False # confirm an mtime change with a sha256 of the file before reloading
+
+
+@dataclass
+class ModelEntry:
+    model: object
+    signature: tuple
+    digest: str = None
+    load_seconds: float = 0.0
+    loaded_at: float = 0.0
+    checked_at: float = 0.0
+    loads: int = 0
+    hits: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+
+## Process-wide store of the unpickled model pipelines
+## Every artifact is loaded once and shared between threads / Streamlit sessions
+class ModelRegistry:
+    def __init__(self, config=None):
+        self.config = config or ModelRegistryConfig()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _key(self, file_path):
+        return os.path.abspath(file_path)
+
+    def _load(self, key, entry=None):
+        start = time.perf_counter()
+        model = load_object(key)
+        load_seconds = time.perf_counter() - start
+        metrics.observe("model_load_seconds", load_seconds, model=os.path.splitext(os.path.basename(key))[0])
+
+        signature = file_signature(key)
+        digest = file_digest(key) if self.config.use_hash else None
+        now = time.monotonic()
+
+        if entry is None:
+            entry = ModelEntry(model=model, signature=signature)
+        entry.model = model
+        entry.signature = signature
+        entry.digest = digest
+        entry.load_seconds = load_seconds
+        entry.loaded_at = now
+        entry.checked_at = now
+        entry.loads += 1
+
+        logging.info(f"Loaded model artifact {key} in {load_seconds * 1000:.1f} ms")
+        return entry
+
+    def _is_stale(self, key, entry):
+        signature = file_signature(key)
+        if signature == entry.signature:
+            return False
+
+        if self.config.use_hash and entry.digest is not None and file_digest(key) == entry.digest:
+            # touched but not changed, keep the loaded model
+            entry.signature = signature
+            return False
+
+        return True
+
+    # get the loaded model, (re)loading it only when needed
+    def get(self, file_path):
+        try:
+            key = self._key(file_path)
+
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = ModelEntry(model=None, signature=None)
+                    self._entries[key] = entry
+
+            with entry.lock:
+                if entry.model is None:
+                    self._load(key, entry)
+                elif time.monotonic() - entry.checked_at >= self.config.check_interval:
+                    entry.checked_at = time.monotonic()
+                    if self._is_stale(key, entry):
+                        logging.info(f"Model artifact {key} changed on disk, reloading")
+                        self._load(key, entry)
+
+                entry.hits += 1
+                return entry.model
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # signature of the currently loaded artifact (used to invalidate derived caches)
+    def version(self, file_path):
+        entry = self._entries.get(self._key(file_path))
+        if entry is None or entry.model is None:
+            return None
+        return (entry.signature, entry.loads)
+
+    # load the artifacts up-front, e.g. before a server starts accepting traffic
+    def warm_up(self, paths=None):
+        if paths is None:
+            paths = [self.config.price_model_path, self.config.carat_model_path]
+
+        for file_path in paths:
+            self.get(file_path)
+
+        return self.stats()
+
+    # drop one artifact (or all of them) from memory
+    def evict(self, file_path=None):
+        with self._lock:
+            if file_path is None:
+                evicted = len(self._entries)
+                self._entries.clear()
+            else:
+                evicted = int(self._entries.pop(self._key(file_path), None) is not None)
+
+        logging.info(f"Evicted {evicted} model artifact(s) from the registry")
+        return evicted
+
+    # load-time metric and usage per artifact
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.items())
+
+        return {
+            key: {
+                "loaded": entry.model is not None,
+                "load_seconds": entry.load_seconds,
+                "loads": entry.loads,
+                "hits": entry.hits,
+                "mtime_ns": entry.signature[0] if entry.signature else None,
+                "size": entry.signature[1] if entry.signature else None,
+                "sha256": entry.digest,
+            }
+            for key, entry in entries
+        }
+
+
+# Shared registry for the whole process
+model_registry = ModelRegistry()
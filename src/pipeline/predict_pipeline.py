@@ -1,43 +1,325 @@
 import os
 import sys
+import time
+import numpy as np
 import pandas as pd
 
+from collections.abc import Mapping
+
 from src.exception import CustomException
-from src.logger import logging
-from src.utils import load_object
+from src.logger import logging, log_event
+from src.metrics import metrics
+from src.pipeline.model_registry import model_registry
+from src.pipeline.prediction_cache import prediction_cache, canonical_key
+from src.pipeline.fast_encoder import cached_encoder
+from src.pipeline.shadow import shadow_scorer
+from src.pipeline.drift import drift_monitor
+from src.validation import DataValidator, write_quarantine
+
+
+PRICE_FEATURES = ['carat', 'cut', 'color', 'clarity', 'depth', 'table', 'x', 'y', 'z']
+CARAT_FEATURES = ['cut', 'color', 'clarity', 'depth', 'table', 'price', 'x', 'y', 'z']
+DEFAULT_CHUNK_SIZE = 10000
+
+
+# Derived depth (%) computed over whole columns: 2*z/(x+y)*100
+def compute_depth(x, y, z):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.round(2 * z / (x + y), 3) * 100
+
+
+# Label of an artifact in the metrics: file name without extension
+def model_label(model_path):
+    return os.path.splitext(os.path.basename(model_path))[0]
+
+
+# Run a fitted pipeline with the preprocessing and the model timed separately
+def run_pipeline(pipeline, features, label):
+    steps = getattr(pipeline, 'named_steps', None)
+    if steps is None or list(steps) != ['preprocessor', 'model']:
+        with metrics.timer('booster_predict_seconds', model=label):
+            return pipeline.predict(features)
+
+    with metrics.timer('preprocess_seconds', model=label):
+        matrix = steps['preprocessor'].transform(features)
+    with metrics.timer('booster_predict_seconds', model=label):
+        return steps['model'].predict(matrix)
+
+
+# The one stone of `features` (a dict, or a one-row DataFrame as a Series), None for several rows
+def single_stone(features):
+    if isinstance(features, Mapping):
+        return features
+    if len(features) == 1:
+        return features.iloc[0]
+    return None
+
+
+# Model input matrix of one stone: the fast encoder when the pipeline has one, else the preprocessor
+def encode_stone(pipeline, stone, label):
+    encoder = cached_encoder(pipeline)
+    with metrics.timer('preprocess_seconds', model=label):
+        if encoder is not None:
+            return encoder.encode(stone)
+        return pipeline.named_steps['preprocessor'].transform(pd.DataFrame([stone]))
+
+
+# Build the model input frame for a batch of stones (shaped like data/diamonds.csv)
+def prepare_batch(data, feature_columns, derive_depth=True):
+    missing = [col for col in feature_columns if col not in data.columns and col != 'depth']
+    if missing:
+        raise ValueError(f"Input is missing the column(s): {missing}")
+
+    features = data.reindex(columns=feature_columns)
+    if derive_depth:
+        depth = compute_depth(data['x'].to_numpy(), data['y'].to_numpy(), data['z'].to_numpy())
+        if 'depth' in data.columns:
+            # keep the given depth where it can't be derived (zero dimensions)
+            depth = np.where(np.isfinite(depth), depth, data['depth'].to_numpy(dtype=np.float64))
+        features['depth'] = depth
+
+    return features
 
 
 class PredictPipeline:
-    def __init__(self):
-        pass
+    def __init__(self, registry=None, cache=None, use_cache=True, shadow=None, drift=None):
+        self.registry = registry or model_registry
+        self.cache = (cache or prediction_cache) if use_cache else None
+        self.validator = DataValidator()
+        self.shadow = shadow or shadow_scorer # candidate models scoring the same stones in the background
+        self.drift = drift or drift_monitor # feature sketches of the traffic, compared with the training split
+
+    # stones that fail validation never reach the model
+    def _check(self, features, feature_columns):
+        result = self.validator.validate(features, feature_columns)
+        if not result.valid.all():
+            metrics.inc('invalid_rows_total', len(result) - int(result.valid.sum()), source='single')
+            raise ValueError(f"Invalid stone: {', '.join(result.counts())}")
+
+    # one stone, encoded without pandas when the pipeline allows it
+    def _predict_stone(self, model, stone, label):
+        if cached_encoder(model) is None:
+            return run_pipeline(model, pd.DataFrame([stone]), label)[0]
+
+        matrix = encode_stone(model, stone, label)
+        with metrics.timer('booster_predict_seconds', model=label):
+            return model.named_steps['model'].predict(matrix)[0]
+
+    # single stones (a dict or a one-row DataFrame) go through the cache, anything else straight to the model
+    # (a stone is validated before its cache key is built, so a bad one fails with the validation error)
+    def _predict(self, model_path, features, feature_columns):
+        start = time.perf_counter()
+        label = model_label(model_path)
+        model = self.registry.get(model_path)
+        stone = single_stone(features)
+        if stone is None:
+            self._check(features, feature_columns)
+            if self.drift.enabled:
+                self.drift.observe(label, feature_columns, features)
+            pred = run_pipeline(model, features, label)
+            elapsed = time.perf_counter() - start
+            metrics.observe('predict_seconds', elapsed, model=label, kind='rows')
+            metrics.inc('predicted_rows_total', len(features), model=label)
+            log_event("predict", elapsed * 1000, model=model_path, rows=len(features))
+            if self.shadow.enabled:
+                self.shadow.submit(model_path, feature_columns, features, pred)
+            return pred
+
+        self._check(stone, feature_columns)
+        value = None
+        if self.cache is not None:
+            version = self.registry.version(model_path)
+            key = canonical_key(stone, feature_columns, self.cache.config.float_decimals)
+            value = self.cache.get(model_path, version, key)
+        cache_hit = value is not None
+        if not cache_hit:
+            value = self._predict_stone(model, stone, label)
+            if self.cache is not None:
+                self.cache.put(model_path, version, key, value)
+            metrics.inc('predicted_rows_total', model=label)
+        if self.drift.enabled:
+            self.drift.observe(label, feature_columns, stone)
+
+        elapsed = time.perf_counter() - start
+        if self.cache is not None:
+            metrics.inc('prediction_cache_lookups_total', model=label, result='hit' if cache_hit else 'miss')
+        metrics.observe('predict_seconds', elapsed, model=label, kind='single')
+        log_event("predict", elapsed * 1000, model=model_path, rows=1, cache_hit=cache_hit)
+        if self.shadow.enabled:
+            self.shadow.submit(model_path, feature_columns, [stone], [value])
+        return np.array([value], dtype=np.float32)
     
     # predict price
     def predict_price(self, features):
         try:
-            model_path = os.path.join('data', 'final_model_pipeline.pkl')
-            
-            model = load_object(model_path)
+            model_path = self.registry.config.price_model_path
             
-            pred = model.predict(features)
+            pred = self._predict(model_path, features, PRICE_FEATURES)
             
             return pred
         
         except Exception as e:
             raise CustomException(e, sys)
         
+    # quantile bounds of the price sharing one preprocessing pass with the point model
+    # (both pipelines come from the same training run, so their preprocessors are identical)
+    # `stone`: one stone, encoded with the fast encoder of the point pipeline
+    def _price_interval(self, features, stone=None):
+        point_pipeline = self.registry.get(self.registry.config.price_model_path)
+        interval_pipeline = self.registry.get(self.registry.config.interval_model_path)
+
+        point_label = model_label(self.registry.config.price_model_path)
+        interval_label = model_label(self.registry.config.interval_model_path)
+
+        if stone is not None:
+            matrix = encode_stone(point_pipeline, stone, point_label)
+        else:
+            with metrics.timer('preprocess_seconds', model=point_label):
+                matrix = point_pipeline.named_steps['preprocessor'].transform(features)
+        with metrics.timer('booster_predict_seconds', model=point_label):
+            point = point_pipeline.named_steps['model'].predict(matrix).astype(np.float32)
+        with metrics.timer('booster_predict_seconds', model=interval_label):
+            bounds = interval_pipeline.named_steps['model'].predict(matrix).reshape(len(point), -1)
+        metrics.inc('predicted_rows_total', len(point), model=interval_label)
+
+        # separately fitted quantiles can cross the point estimate, keep low <= point <= high
+        low = np.minimum(bounds[:, 0], point).astype(np.float32)
+        high = np.maximum(bounds[:, -1], point).astype(np.float32)
+        return low, point, high
+
+    # predict a price range: (low, point, high)
+    def predict_price_interval(self, features):
+        try:
+            start = time.perf_counter()
+            model_path = self.registry.config.interval_model_path
+            label = model_label(model_path)
+            stone = single_stone(features)
+            # same features as the point model: recorded under its entry in the drift monitor
+            price_label = model_label(self.registry.config.price_model_path)
+            if stone is None:
+                self._check(features, PRICE_FEATURES)
+                if self.drift.enabled:
+                    self.drift.observe(price_label, PRICE_FEATURES, features)
+                low, point, high = self._price_interval(features)
+                elapsed = time.perf_counter() - start
+                metrics.observe('predict_seconds', elapsed, model=label, kind='rows')
+                log_event("predict", elapsed * 1000, model=model_path, rows=len(features))
+                return low, point, high
+
+            # cached under the interval artifact, bound to the versions of both models
+            self._check(stone, PRICE_FEATURES)
+            value = None
+            if self.cache is not None:
+                self.registry.get(self.registry.config.price_model_path)
+                self.registry.get(model_path)
+                version = (self.registry.version(self.registry.config.price_model_path), self.registry.version(model_path))
+                key = canonical_key(stone, PRICE_FEATURES, self.cache.config.float_decimals)
+                value = self.cache.get(model_path, version, key)
+            cache_hit = value is not None
+            if not cache_hit:
+                value = tuple(float(bound[0]) for bound in self._price_interval(None, stone))
+                if self.cache is not None:
+                    self.cache.put(model_path, version, key, value)
+            if self.drift.enabled:
+                self.drift.observe(price_label, PRICE_FEATURES, stone)
+
+            elapsed = time.perf_counter() - start
+            if self.cache is not None:
+                metrics.inc('prediction_cache_lookups_total', model=label, result='hit' if cache_hit else 'miss')
+            metrics.observe('predict_seconds', elapsed, model=label, kind='single')
+            log_event("predict", elapsed * 1000, model=model_path, rows=1, cache_hit=cache_hit)
+            return tuple(np.array([bound], dtype=np.float32) for bound in value)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
     # predict carat
     def predict_carat(self, features):
         try:
-            model_path = os.path.join('data', 'final_model_pipeline_carat_xgb.pkl')
-            
-            model = load_object(model_path)
+            model_path = self.registry.config.carat_model_path
             
-            pred = model.predict(features)
+            pred = self._predict(model_path, features, CARAT_FEATURES)
             
             return pred
         
         except Exception as e:
             raise CustomException(e, sys)
+
+    # features of the stones that pass validation; the others are written to quarantine_path
+    # (the given depth is only checked against x, y, z when it is used as-is)
+    def _valid_features(self, data, feature_columns, derive_depth, quarantine_path):
+        features = prepare_batch(data, feature_columns, derive_depth)
+        result = self.validator.validate(features, feature_columns, check_depth=not derive_depth)
+        if quarantine_path is not None:
+            write_quarantine(data, result, quarantine_path)
+
+        rows = np.flatnonzero(result.valid)
+        if len(rows) < len(features):
+            metrics.inc('invalid_rows_total', len(features) - len(rows), source='batch')
+            logging.info(f"{len(features) - len(rows)} of {len(features)} stones failed validation: {result.counts()}")
+            features = features.iloc[rows]
+        return features, rows
+
+    # score a model over a whole batch, chunk by chunk (NaN for the stones that failed validation)
+    def _predict_batch(self, model_path, data, feature_columns, chunk_size, derive_depth, quarantine_path):
+        try:
+            started = time.perf_counter()
+            label = model_label(model_path)
+            model = self.registry.get(model_path)
+            features, rows = self._valid_features(data, feature_columns, derive_depth, quarantine_path)
+            chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+            if self.drift.enabled and len(rows):
+                self.drift.observe(label, feature_columns, features)
+
+            pred = np.full(len(data), np.nan, dtype=np.float32)
+            for start in range(0, len(features), chunk_size):
+                chunk = features.iloc[start:start + chunk_size]
+                pred[rows[start:start + len(chunk)]] = run_pipeline(model, chunk, label)
+
+            metrics.observe('predict_seconds', time.perf_counter() - started, model=label, kind='batch')
+            metrics.inc('predicted_rows_total', len(features), model=label)
+            if self.shadow.enabled and len(rows):
+                self.shadow.submit(model_path, feature_columns, features, pred[rows])
+            return pred
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # predict price for many stones at once
+    def predict_price_batch(self, data, chunk_size=DEFAULT_CHUNK_SIZE, derive_depth=True, quarantine_path=None):
+        return self._predict_batch(self.registry.config.price_model_path, data,
+                                   PRICE_FEATURES, chunk_size, derive_depth, quarantine_path)
+
+    # (low, point, high) price for many stones at once
+    def predict_price_interval_batch(self, data, chunk_size=DEFAULT_CHUNK_SIZE, derive_depth=True, quarantine_path=None):
+        try:
+            started = time.perf_counter()
+            features, rows = self._valid_features(data, PRICE_FEATURES, derive_depth, quarantine_path)
+            chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+            if self.drift.enabled and len(rows):
+                self.drift.observe(model_label(self.registry.config.price_model_path), PRICE_FEATURES, features)
+
+            low, point, high = (np.full(len(data), np.nan, dtype=np.float32) for _ in range(3))
+            for start in range(0, len(features), chunk_size):
+                chunk = features.iloc[start:start + chunk_size]
+                index = rows[start:start + len(chunk)]
+                low[index], point[index], high[index] = self._price_interval(chunk)
+
+            metrics.observe('predict_seconds', time.perf_counter() - started,
+                            model=model_label(self.registry.config.interval_model_path), kind='batch')
+            return low, point, high
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    # predict carat for many stones at once
+    def predict_carat_batch(self, data, chunk_size=DEFAULT_CHUNK_SIZE, derive_depth=True, quarantine_path=None):
+        return self._predict_batch(self.registry.config.carat_model_path, data,
+                                   CARAT_FEATURES, chunk_size, derive_depth, quarantine_path)
     
     
 ## Responsible for mapping the input data
@@ -57,23 +339,34 @@ class CustomDataPrice:
         self.z = z
     
     
-    def get_data_price(self):
+    # the stone as a dict, the input of the pandas-free prediction path
+    def get_stone_price(self):
         try:
-            dep_val = round(2 * self.z / (self.x + self.y), 3)*100
+            dep_val = float(compute_depth(self.x, self.y, self.z)) # inf / NaN for zero dimensions, rejected on predict
             
-            custom_data_input_dict = {
-                "carat": [self.carat],
-                "cut": [self.cut],
-                "color": [self.color],
-                "clarity": [self.clarity],
-                "depth": [dep_val],
-                "table": [self.table],
-                "x": [self.x],
-                "y": [self.y],
-                "z": [self.z],
+            return {
+                "carat": self.carat,
+                "cut": self.cut,
+                "color": self.color,
+                "clarity": self.clarity,
+                "depth": dep_val,
+                "table": self.table,
+                "x": self.x,
+                "y": self.y,
+                "z": self.z,
             }
 
-            return pd.DataFrame(custom_data_input_dict)
+        except Exception as e:
+            raise CustomException(e, sys)
+    
+    def get_data_price(self):
+        try:
+            start = time.perf_counter()
+            custom_data_input_dict = {col: [value] for col, value in self.get_stone_price().items()}
+
+            frame = pd.DataFrame(custom_data_input_dict)
+            metrics.observe('dataframe_build_seconds', time.perf_counter() - start, form='price')
+            return frame
 
         except Exception as e:
             raise CustomException(e, sys)
@@ -94,23 +387,34 @@ class CustomDataCarat:
         self.y = y
         self.z = z
         
-    def get_data_carat(self):
+    # the stone as a dict, the input of the pandas-free prediction path
+    def get_stone_carat(self):
         try:
-            dep_val = round(2 * self.z / (self.x + self.y), 3)*100
+            dep_val = float(compute_depth(self.x, self.y, self.z)) # inf / NaN for zero dimensions, rejected on predict
             
-            custom_data_input_dict = {
-                "cut": [self.cut],
-                "color": [self.color],
-                "clarity": [self.clarity],
-                "depth": [dep_val],
-                "table": [self.table],
-                "price": [self.price],
-                "x": [self.x],
-                "y": [self.y],
-                "z": [self.z],
+            return {
+                "cut": self.cut,
+                "color": self.color,
+                "clarity": self.clarity,
+                "depth": dep_val,
+                "table": self.table,
+                "price": self.price,
+                "x": self.x,
+                "y": self.y,
+                "z": self.z,
             }
 
-            return pd.DataFrame(custom_data_input_dict)
+        except Exception as e:
+            raise CustomException(e, sys)
+    
+    def get_data_carat(self):
+        try:
+            start = time.perf_counter()
+            custom_data_input_dict = {col: [value] for col, value in self.get_stone_carat().items()}
+
+            frame = pd.DataFrame(custom_data_input_dict)
+            metrics.observe('dataframe_build_seconds', time.perf_counter() - start, form='carat')
+            return frame
 
         except Exception as e:
             raise CustomException(e, sys)
\ No newline at end of file
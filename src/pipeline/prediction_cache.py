@@ -0,0 +1,99 @@
+import time
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class PredictionCacheConfig:
+    max_size: int = 50000 # entries kept per model (LRU beyond that)
+    ttl: float = 3600.0 # seconds an entry stays valid
+    float_decimals: int = None # round numeric inputs before keying (None = exact values)
+
+
+# Canonical key of one stone: categories as str, numbers as float (55 == 55.0 == np.float32(55))
+def canonical_key(row, columns, float_decimals=None):
+    key = []
+    for col in columns:
+        value = row[col]
+        if isinstance(value, (str, np.str_)):
+            key.append(str(value))
+        else:
+            value = float(value)
+            key.append(round(value, float_decimals) if float_decimals is not None else value)
+    return tuple(key)
+
+
+## Memoizes single-row predictions, keyed on the canonical input and bound to the model version
+class PredictionCache:
+    def __init__(self, config=None):
+        self.config = config or PredictionCacheConfig()
+        self._entries = {} # model path -> OrderedDict(key -> (value, expires_at))
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _model_entries(self, model_path, version):
+        if self._versions.get(model_path) != version:
+            # the artifact changed: whatever was cached for it is stale
+            if model_path in self._entries:
+                self.invalidations += len(self._entries[model_path])
+            self._entries[model_path] = OrderedDict()
+            self._versions[model_path] = version
+        return self._entries[model_path]
+
+    def get(self, model_path, version, key):
+        with self._lock:
+            entries = self._model_entries(model_path, version)
+            item = entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, model_path, version, key, value):
+        with self._lock:
+            entries = self._model_entries(model_path, version)
+            entries[key] = (value, time.monotonic() + self.config.ttl)
+            entries.move_to_end(key)
+            while len(entries) > self.config.max_size:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': {path: len(entries) for path, entries in self._entries.items()},
+            }
+
+
+# Shared cache for the whole process
+prediction_cache = PredictionCache()
@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass, field
+
+from src.exception import CustomException
+from src.logger import logging
+from src.dataset import CUT_ORDER, COLOR_ORDER, CLARITY_ORDER
+from src.pipeline.model_registry import model_registry
+from src.utils import file_digest
+from src.pipeline.predict_pipeline import PRICE_FEATURES, compute_depth
+
+
+## Precomputed price grid over the input space of the app, answered by multilinear interpolation
+## Axes: cut x color x clarity x carat x depth x table x x x ratio (= y / x, stones are nearly round
+## so the points go into x instead of a second dimension axis).
+## z is not an axis: the app derives depth = 2*z/(x+y)*100, so z = depth*(x+y)/200 on the grid.
+
+CATEGORY_AXES = [('cut', CUT_ORDER), ('color', COLOR_ORDER), ('clarity', CLARITY_ORDER)]
+NUMERIC_AXES = ['carat', 'depth', 'table', 'x', 'ratio']
+
+
+@dataclass
+class PriceGridConfig:
+    grid_path: str = os.path.join('data', 'price_grid.npy')
+    meta_path: str = os.path.join('data', 'price_grid.json')
+    # bounds of the inputs in app.py, and points per axis
+    bounds: dict = field(default_factory=lambda: {
+        'carat': (0.2, 5.01), 'depth': (43.0, 79.0), 'table': (43.0, 95.0), 'x': (0.1, 10.74), 'ratio': (0.975, 1.025),
+    })
+    points: dict = field(default_factory=lambda: {'carat': 32, 'depth': 6, 'table': 5, 'x': 24, 'ratio': 3})
+    error_bound: float = 250.0 # max p95 abs error ($) of a grade combination before it falls back to the model
+    z_tolerance: float = 0.05 # mm between the given z and the one implied by depth, x and y
+
+
+# Axis points placed on quantiles of the training data (denser where stones are), within the app bounds
+def grid_axes(data, config):
+    axes = {}
+    for col in NUMERIC_AXES:
+        low, high = config.bounds[col]
+        n_points = config.points[col]
+        values = axis_values(data, col)
+        values = values[(values >= low) & (values <= high)]
+        inner = np.quantile(values, np.linspace(0, 1, n_points)[1:-1]) if n_points > 2 else []
+        axes[col] = np.unique(np.concatenate([[low], inner, [high]]))
+    return axes
+
+
+# Column of an axis, the ratio is derived from x and y
+def axis_values(features, col):
+    if col == 'ratio':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.asarray(features['y'], dtype=np.float64) / np.asarray(features['x'], dtype=np.float64)
+    return np.asarray(features[col], dtype=np.float64)
+
+
+class PriceGrid:
+    def __init__(self, grid, meta):
+        self.grid = grid
+        self.meta = meta
+        self.axes = [np.asarray(meta['axes'][col], dtype=np.float64) for col in NUMERIC_AXES]
+        self.category_index = [{value: i for i, value in enumerate(values)} for _, values in CATEGORY_AXES]
+        # null: combination never seen in the test split, no error bound admits it
+        self.combo_error = np.array([np.inf if error is None else error for error in meta['combo_p95_error']],
+                                    dtype=np.float64).reshape(grid.shape[:3])
+        self.strides = np.array(
+            [int(np.prod(grid.shape[i + 1:])) for i in range(grid.ndim)], dtype=np.int64
+        )
+        self._flat = grid.reshape(-1)
+        # the 2^5 corners of a cell, as 0/1 offsets and as flat index offsets
+        self.corners = np.array(list(itertools.product((0, 1), repeat=len(self.axes))), dtype=bool)
+        self.corner_offsets = self.corners.astype(np.int64) @ self.strides[3:]
+
+    @classmethod
+    def load(cls, config=None):
+        try:
+            config = config or PriceGridConfig()
+            with open(config.meta_path) as file_obj:
+                meta = json.load(file_obj)
+            return cls(np.load(config.grid_path, mmap_mode='r'), meta)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _category_codes(self, features):
+        codes = np.empty((len(features), len(CATEGORY_AXES)), dtype=np.int64)
+        for i, (col, _) in enumerate(CATEGORY_AXES):
+            index = self.category_index[i]
+            codes[:, i] = [index.get(value, -1) for value in np.atleast_1d(np.asarray(features[col])).tolist()]
+        return codes
+
+    # interpolated price and a mask of the rows the grid can answer
+    # `features` is a DataFrame or a dict of columns
+    def lookup(self, features, error_bound=None, z_tolerance=0.05):
+        n_rows = len(np.atleast_1d(np.asarray(features['carat'])))
+        codes = self._category_codes(features)
+        values = np.column_stack([axis_values(features, col) for col in NUMERIC_AXES])
+
+        valid = (codes >= 0).all(axis=1)
+        for d, axis in enumerate(self.axes):
+            valid &= (values[:, d] >= axis[0]) & (values[:, d] <= axis[-1])
+
+        # z must agree with the depth the grid was built with
+        implied_z = values[:, 1] * (np.asarray(features['x'], dtype=np.float64) + np.asarray(features['y'], dtype=np.float64)) / 200
+        valid &= np.abs(np.asarray(features['z'], dtype=np.float64) - implied_z) <= z_tolerance
+
+        codes = np.where(codes >= 0, codes, 0)
+        if error_bound is not None:
+            valid &= self.combo_error[codes[:, 0], codes[:, 1], codes[:, 2]] <= error_bound
+
+        base = (codes * self.strides[:3]).sum(axis=1)
+        lower = np.empty((n_rows, len(self.axes)), dtype=np.int64)
+        weight = np.empty((n_rows, len(self.axes)), dtype=np.float64)
+        for d, axis in enumerate(self.axes):
+            x = np.clip(values[:, d], axis[0], axis[-1])
+            i = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, len(axis) - 2)
+            lower[:, d] = i
+            weight[:, d] = (x - axis[i]) / (axis[i + 1] - axis[i])
+        base += (lower * self.strides[3:]).sum(axis=1)
+
+        corner_weight = np.where(self.corners, weight[:, None, :], 1 - weight[:, None, :]).prod(axis=2)
+        price = (corner_weight * self._flat[base[:, None] + self.corner_offsets]).sum(axis=1)
+
+        return price.astype(np.float32), valid
+
+
+## predict_price answered from the grid, with the real model for what the grid can't answer
+class GridPricePredictor:
+    def __init__(self, config=None, registry=None):
+        self.config = config or PriceGridConfig()
+        self.registry = registry or model_registry
+        self.grid = PriceGrid.load(self.config)
+        self.hits = 0
+        self.fallbacks = 0
+
+        model_path = self.registry.config.price_model_path
+        if self.grid.meta.get('model_sha256') != file_digest(model_path):
+            logging.info(f"Price grid was built from another {model_path}, every quote falls back to the model")
+            self.grid = None
+
+    # `features`: a DataFrame or a dict of columns (or of scalars, one stone), as for lookup
+    def predict_price(self, features):
+        try:
+            if not isinstance(features, pd.DataFrame):
+                features = pd.DataFrame({col: np.atleast_1d(values) for col, values in features.items()})
+
+            if self.grid is None:
+                pred = self.registry.get(self.registry.config.price_model_path).predict(features)
+                self.fallbacks += len(features)
+                return pred
+
+            pred, valid = self.grid.lookup(features, self.config.error_bound, self.config.z_tolerance)
+            if not valid.all():
+                model = self.registry.get(self.registry.config.price_model_path)
+                pred[~valid] = model.predict(features[~valid])
+
+            self.hits += int(valid.sum())
+            self.fallbacks += int((~valid).sum())
+            return pred
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+# Evaluate the model on every grid point (one grade combination at a time)
+def build_grid(model, axes):
+    shape = [len(values) for _, values in CATEGORY_AXES] + [len(axes[col]) for col in NUMERIC_AXES]
+    grid = np.empty(shape, dtype=np.float32)
+
+    mesh = np.meshgrid(*[axes[col] for col in NUMERIC_AXES], indexing='ij')
+    points = {col: m.reshape(-1) for col, m in zip(NUMERIC_AXES, mesh)}
+    points['y'] = points.pop('ratio') * points['x']
+    points['z'] = points['depth'] * (points['x'] + points['y']) / 200
+    frame = pd.DataFrame(points)
+
+    for i, cut in enumerate(CUT_ORDER):
+        for j, color in enumerate(COLOR_ORDER):
+            for k, clarity in enumerate(CLARITY_ORDER):
+                frame['cut'], frame['color'], frame['clarity'] = cut, color, clarity
+                grid[i, j, k] = model.predict(frame[PRICE_FEATURES]).reshape(shape[3:])
+
+    return grid
+
+
+# Interpolation error against the model on the test split, overall and per grade combination
+def error_report(grid, model, test_df, z_tolerance):
+    test_df = test_df.copy()
+    test_df['depth'] = compute_depth(test_df['x'], test_df['y'], test_df['z'])
+    test_df = test_df[np.isfinite(test_df['depth'])]
+
+    expected = model.predict(test_df[PRICE_FEATURES])
+    pred, valid = grid.lookup(test_df, error_bound=None, z_tolerance=z_tolerance)
+    error = np.abs(pred - expected)
+
+    codes = grid._category_codes(test_df)
+    combo_p95 = np.full(grid.grid.shape[:3], np.inf)
+    for combo in {tuple(c) for c in codes[valid]}:
+        mask = valid & (codes == combo).all(axis=1)
+        combo_p95[combo] = float(np.percentile(error[mask], 95))
+
+    in_grid = error[valid]
+    report = {'rows': int(len(test_df)), 'in_grid': int(valid.sum())}
+    if not len(in_grid):
+        # no test stone falls inside the grid: there is no error to report
+        logging.warning("No test row is covered by the price grid, its error is unknown")
+        report.update(dict.fromkeys(['mae', 'p50_abs_error', 'p95_abs_error', 'p99_abs_error',
+                                     'max_abs_error', 'mean_rel_error']))
+        return report, combo_p95
+
+    report.update({
+        'mae': float(in_grid.mean()),
+        'p50_abs_error': float(np.percentile(in_grid, 50)),
+        'p95_abs_error': float(np.percentile(in_grid, 95)),
+        'p99_abs_error': float(np.percentile(in_grid, 99)),
+        'max_abs_error': float(in_grid.max()),
+        'mean_rel_error': float((in_grid / np.maximum(np.abs(expected[valid]), 1)).mean()),
+    })
+    return report, combo_p95
+
+
+## Offline stage: evaluate the trained price model on the grid and store it next to the model
+## split: (train_path, test_path) written by DataIngestion, by default the split of the artifact store
+## (the one local_run.py trained on; reused as is when the dataset hasn't changed)
+def export_price_grid(config=None, split=None):
+    try:
+        from src.components.columnar_cache import read_split
+
+        config = config or PriceGridConfig()
+        model_path = model_registry.config.price_model_path
+        model = model_registry.get(model_path)
+
+        if split is None:
+            from src.components.data_ingestion import DataIngestion
+            from src.components.artifact_store import ArtifactStore
+
+            split = DataIngestion(store=ArtifactStore()).initiate_data_ingestion()
+        train_path, test_path = split
+        train_df, test_df = read_split(train_path), read_split(test_path)
+
+        axes = grid_axes(train_df, config)
+        start = time.perf_counter()
+        grid = build_grid(model, axes)
+        logging.info(f"Evaluated the price model on {grid.size} grid points in {time.perf_counter() - start:.1f}s")
+
+        meta = {
+            'axes': {col: axes[col].tolist() for col in NUMERIC_AXES},
+            'shape': list(grid.shape),
+            'model_sha256': file_digest(model_path),
+            'combo_p95_error': np.zeros(grid.shape[:3]).ravel().tolist(),
+        }
+        report, combo_p95 = error_report(PriceGrid(grid, meta), model, test_df, config.z_tolerance)
+        # null (not Infinity, which isn't JSON): combination never seen in the test split
+        meta['combo_p95_error'] = [error if np.isfinite(error) else None for error in combo_p95.ravel().tolist()]
+        meta['report'] = report
+
+        os.makedirs(os.path.dirname(config.grid_path) or '.', exist_ok=True)
+        np.save(config.grid_path, grid)
+        with open(config.meta_path, 'w') as file_obj:
+            json.dump(meta, file_obj, indent=2, allow_nan=False)
+
+        logging.info(f"Saved price grid {grid.shape} into {config.grid_path}")
+        return report
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the price lookup grid and report its interpolation error")
+    parser.add_argument('--carat-points', type=int, default=PriceGridConfig().points['carat'])
+    parser.add_argument('--error-bound', type=float, default=PriceGridConfig.error_bound)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = PriceGridConfig(error_bound=args.error_bound)
+    config.points['carat'] = args.carat_points
+    print(json.dumps(export_price_grid(config), indent=2))
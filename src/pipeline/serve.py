@@ -0,0 +1,309 @@
+import sys
+import json
+import math
+import time
+import queue
+import argparse
+import threading
+import pandas as pd
+
+from dataclasses import dataclass
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.exception import CustomException
+from src.logger import logging
+from src.metrics import metrics, profiler, start_exporters, SNAPSHOT_SECONDS
+from src.pipeline.predict_pipeline import PredictPipeline, PRICE_FEATURES, CARAT_FEATURES, prepare_batch
+from src.validation import DataValidator, CATEGORY_DOMAINS
+
+
+@dataclass
+class ServerConfig:
+    host: str = '127.0.0.1'
+    port: int = 8000
+    max_batch_size: int = 256 # rows scored by a single model.predict call
+    max_wait_ms: float = 2.0 # how long the first request of a batch waits for company
+    request_timeout: float = 10.0
+    snapshot_seconds: float = SNAPSHOT_SECONDS # JSON metrics snapshot interval, 0 = off
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+# Fields of a JSON stone with a value of the wrong kind: the grades are strings, the measurements
+# numbers (or numeric strings); null is left to the validator, which reports it as missing
+def check_types(stone, columns):
+    wrong = {}
+    for col in columns:
+        value = stone.get(col)
+        if value is None:
+            continue
+        if col in CATEGORY_DOMAINS:
+            if not isinstance(value, str):
+                wrong[col] = 'a string'
+        elif isinstance(value, bool) or not _is_number(value):
+            wrong[col] = 'a number'
+    if wrong:
+        raise TypeError(f"Wrong type of field(s): {', '.join(f'{col} must be {kind}' for col, kind in wrong.items())}")
+
+
+# NaN / infinity are not JSON: they are answered as null
+def json_safe(value):
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+# A JSON stone that can't be scored raises ValueError / TypeError, answered with 400
+def check_stone(validator, features, feature_columns):
+    if not isinstance(features, dict):
+        raise TypeError("Expected one stone as a JSON object")
+    missing = [col for col in feature_columns if col not in features and col != 'depth']
+    if missing:
+        raise ValueError(f"Missing field(s): {missing}")
+    check_types(features, feature_columns)
+    result = validator.validate(prepare_batch(pd.DataFrame([features]), feature_columns),
+                                feature_columns, check_depth=False)
+    if not result.valid[0]:
+        raise ValueError(f"Invalid stone: {result.reasons()[0].replace('|', ', ')}")
+
+
+## Collects concurrent single-row requests into one model call
+class MicroBatcher:
+    def __init__(self, predict_batch, feature_columns, max_batch_size=256, max_wait_ms=2.0, name='batcher'):
+        self.predict_batch = predict_batch
+        self.feature_columns = feature_columns
+        self.validator = DataValidator() # invalid stones are answered with 400 before they are queued
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.batches = 0
+        self.rows = 0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        self._thread.join()
+
+    # queue one stone, the returned Future resolves to its prediction
+    def submit(self, features):
+        check_stone(self.validator, features, self.feature_columns)
+
+        future = Future()
+        self._queue.put((features, future))
+        return future
+
+    def _collect(self):
+        item = self._queue.get()
+        if item is None:
+            return []
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped.set()
+                break
+            batch.append(item)
+
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+
+            futures = [future for _, future in batch]
+            try:
+                with profiler.profile(self._thread.name):
+                    data = pd.DataFrame([features for features, _ in batch])
+                    pred = self.predict_batch(data, chunk_size=len(batch))
+                for future, value in zip(futures, pred):
+                    future.set_result(float(value))
+                self.batches += 1
+                self.rows += len(batch)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # listen backlog, the default of 5 resets bursts of clients
+
+    def __init__(self, config=None, predict_pipeline=None):
+        self.config = config or ServerConfig()
+        self.predict_pipeline = predict_pipeline or PredictPipeline()
+        self.validator = DataValidator() # stones of the requests that don't go through a batcher
+        self.batchers = {
+            '/predict/price': MicroBatcher(self.predict_pipeline.predict_price_batch, PRICE_FEATURES,
+                                           self.config.max_batch_size, self.config.max_wait_ms, 'price-batcher'),
+            '/predict/carat': MicroBatcher(self.predict_pipeline.predict_carat_batch, CARAT_FEATURES,
+                                           self.config.max_batch_size, self.config.max_wait_ms, 'carat-batcher'),
+        }
+        super().__init__((self.config.host, self.config.port), PredictionRequestHandler)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.predict_pipeline.registry.warm_up()
+        for batcher in self.batchers.values():
+            batcher.start()
+        logging.info(f"Prediction server listening on {self.config.host}:{self.server_address[1]}")
+        super().serve_forever(poll_interval)
+
+    def server_close(self):
+        super().server_close()
+        for batcher in self.batchers.values():
+            if batcher._thread.is_alive():
+                batcher.stop()
+        self.predict_pipeline.shadow.stop()
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, callers reuse their connection
+
+    KNOWN_PATHS = ('/health', '/metrics', '/shadow', '/drift', '/comparables', '/predict/price', '/predict/carat')
+
+    def _send(self, status, body, content_type):
+        path = self.path if self.path in self.KNOWN_PATHS else 'other' # bounded label values
+        metrics.inc('http_requests_total', path=path, status=status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(json_safe(payload), allow_nan=False).encode(), 'application/json')
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send(200, metrics.render_prometheus().encode(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif self.path == '/health':
+            stats = {path: {'batches': b.batches, 'rows': b.rows} for path, b in self.server.batchers.items()}
+            self._send_json(200, {'status': 'ok', 'batchers': stats})
+        elif self.path == '/shadow':
+            self._send_json(200, self.server.predict_pipeline.shadow.report())
+        elif self.path == '/drift':
+            self._send_json(200, self.server.predict_pipeline.drift.last_report)
+        else:
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+
+    # {"stone": {...}, "k": 10} -> the k most similar stones of the inventory with their prices
+    def _comparables(self):
+        from src.pipeline.comparables import find_comparables
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length))
+            stone = body.get('stone') if isinstance(body, dict) else None
+            if not isinstance(stone, dict):
+                raise TypeError("Expected {\"stone\": {...}, \"k\": 10}")
+            check_stone(self.server.validator, stone, PRICE_FEATURES)
+            k = body.get('k', 10)
+            if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+                raise ValueError(f"k must be a whole number of at least 1, got {k!r}")
+            # depth is derived from x, y, z when it is not given, as for the quotes
+            features = prepare_batch(pd.DataFrame([stone]), PRICE_FEATURES, derive_depth='depth' not in stone)
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            result = find_comparables(features, k)
+        except Exception as e:
+            # the details (file paths, line numbers) stay in the log
+            logging.info(f"Comparables search failed: {e}")
+            self._send_json(500, {'error': 'Comparables search failed'})
+            return
+
+        self._send_json(200, {'comparables': result.drop(columns=['query']).to_dict(orient='records')})
+
+    def do_POST(self):
+        path = self.path if self.path in self.KNOWN_PATHS else 'other'
+        with metrics.timer('http_request_seconds', path=path), profiler.profile(path):
+            self._post()
+
+    def _post(self):
+        if self.path == '/comparables':
+            self._comparables()
+            return
+
+        batcher = self.server.batchers.get(self.path)
+        if batcher is None:
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            features = json.loads(self.rfile.read(length))
+            future = batcher.submit(features)
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            value = future.result(timeout=self.server.config.request_timeout)
+        except Exception as e:
+            logging.info(f"Prediction failed on {self.path}: {e!r}")
+            self._send_json(500, {'error': 'Prediction failed'})
+            return
+
+        self._send_json(200, {self.path.rsplit('/', 1)[-1]: value})
+
+    def log_message(self, format, *args):
+        pass # access logs would be written for every quote
+
+
+def run_server(config=None):
+    try:
+        server = PredictionServer(config)
+        start_exporters(port=0, snapshot_seconds=server.config.snapshot_seconds) # /metrics is served by this server
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP inference server with micro-batching")
+    parser.add_argument('--host', default=ServerConfig.host)
+    parser.add_argument('--port', type=int, default=ServerConfig.port)
+    parser.add_argument('--max-batch-size', type=int, default=ServerConfig.max_batch_size)
+    parser.add_argument('--max-wait-ms', type=float, default=ServerConfig.max_wait_ms)
+    parser.add_argument('--snapshot-seconds', type=float, default=ServerConfig.snapshot_seconds,
+                        help="write a JSON metrics snapshot every N seconds (0 = off)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_server(ServerConfig(host=args.host, port=args.port,
+                            max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                            snapshot_seconds=args.snapshot_seconds))
@@ -0,0 +1,317 @@
+import os
+import sys
+import time
+import threading
+import multiprocessing
+import numpy as np
+
+from collections import deque
+from dataclasses import dataclass, field
+
+from src.exception import CustomException
+from src.logger import logging
+from src.metrics import metrics
+from src.validation import CATEGORY_DOMAINS
+
+
+## Shadow scoring: candidate models score the live traffic next to the production model
+## A request is answered by the production model as usual; its stones and the production values are
+## then appended to a bounded in-process queue (O(1), never waits; when the queue is full the rows are
+## dropped and counted). A feeder thread ships them in batches to a separate, niced worker process that
+## scores the candidates, so the GIL and the cores of the serving process are left alone. The worker
+## sleeps after every batch for as long as the CPU time it used, scaled so its share of one core stays
+## under `cpu_share`. The predictions come back into a bounded buffer of the most recent rows, from
+## which report() gives the pairwise disagreement (MAE ...) and its breakdown per grade.
+## Settings (environment variables):
+##   DIAMOND_SHADOW_PRICE  candidate price pipelines, comma-separated paths
+##   DIAMOND_SHADOW_CARAT  candidate carat pipelines
+##   DIAMOND_SHADOW_CPU    CPU share of one core for the shadow worker (default 0.1)
+
+GRADE_COLUMNS = list(CATEGORY_DOMAINS)
+
+
+def _paths(value):
+    return [path.strip() for path in value.split(',') if path.strip()]
+
+
+@dataclass
+class ShadowConfig:
+    candidates: dict = field(default_factory=dict) # production model path -> candidate model paths
+    cpu_share: float = 0.1 # of one core
+    max_pending: int = 10000 # rows waiting for the worker, newer rows are dropped beyond that
+    batch_size: int = 512 # rows per trip to the worker
+    flush_seconds: float = 0.5 # longest a row waits for a full batch
+    buffer_size: int = 50000 # most recent scored rows kept for the report
+
+    @classmethod
+    def from_env(cls):
+        from src.pipeline.model_registry import ModelRegistryConfig
+
+        registry_config = ModelRegistryConfig()
+        candidates = {}
+        for env, production in [('DIAMOND_SHADOW_PRICE', registry_config.price_model_path),
+                                ('DIAMOND_SHADOW_CARAT', registry_config.carat_model_path)]:
+            paths = _paths(os.environ.get(env, ''))
+            if paths:
+                candidates[production] = paths
+        return cls(candidates=candidates, cpu_share=float(os.environ.get('DIAMOND_SHADOW_CPU', 0.1)))
+
+
+def _label(model_path):
+    return os.path.splitext(os.path.basename(model_path))[0]
+
+
+# grade codes (index in the grade order, -1 unknown) of a frame, one column per grade
+def grade_codes(frame):
+    import pandas as pd
+
+    codes = np.full((len(frame), len(GRADE_COLUMNS)), -1, dtype=np.int8)
+    for i, col in enumerate(GRADE_COLUMNS):
+        if col in frame.columns:
+            codes[:, i] = pd.Categorical(frame[col].astype(str), categories=CATEGORY_DOMAINS[col]).codes
+    return codes
+
+
+## Worker process: scores the batches it receives with the candidate models
+def _shadow_worker(conn, candidates, cpu_share):
+    # one thread for the models, lowest scheduling priority
+    for env in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[env] = '1'
+    try:
+        os.nice(19)
+    except OSError:
+        pass
+
+    import pandas as pd
+    from src.pipeline.model_registry import ModelRegistry
+
+    registry = ModelRegistry() # reloads a candidate when its file changes
+    started = time.process_time()
+    errors = {} # candidate path -> failed batches
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+
+        cpu = time.process_time()
+        production, columns, parts, production_values = message
+        parts = [part if isinstance(part, pd.DataFrame) else pd.DataFrame(part, columns=columns) for part in parts]
+        data = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+
+        preds = np.empty((len(data), 1 + len(candidates[production])), dtype=np.float32)
+        preds[:, 0] = production_values
+        # a candidate that can't be loaded or scored gets NaN for the batch, the others go on
+        for i, model_path in enumerate(candidates[production]):
+            try:
+                model = registry.get(model_path)
+                estimator = getattr(model, 'named_steps', {}).get('model', model)
+                if getattr(estimator, 'n_jobs', 1) not in (None, 1):
+                    estimator.set_params(n_jobs=1)
+                preds[:, i + 1] = model.predict(data[columns])
+            except Exception as e:
+                preds[:, i + 1] = np.nan
+                errors[model_path] = errors.get(model_path, 0) + 1
+                logging.info(f"Shadow model {model_path} failed: {e}")
+
+        conn.send((production, preds, grade_codes(data), time.process_time() - started, dict(errors)))
+
+        # duty cycle: cpu / (cpu + sleep) = cpu_share
+        used = time.process_time() - cpu
+        time.sleep(used * (1 / cpu_share - 1))
+
+
+## Most recent rows of one production model: its values, the candidates', the grades
+class ShadowBuffer:
+    def __init__(self, labels, size):
+        self.labels = labels
+        self.preds = np.zeros((size, len(labels)), dtype=np.float32)
+        self.grades = np.zeros((size, len(GRADE_COLUMNS)), dtype=np.int8)
+        self.position = 0
+        self.filled = 0
+        self.total = 0
+
+    def add(self, preds, grades):
+        size = len(self.preds)
+        preds, grades = preds[-size:], grades[-size:]
+        index = (self.position + np.arange(len(preds))) % size
+        self.preds[index] = preds
+        self.grades[index] = grades
+        self.position = (self.position + len(preds)) % size
+        self.filled = min(size, self.filled + len(preds))
+        self.total += len(preds)
+
+    def report(self):
+        preds = self.preds[:self.filled].astype(np.float64)
+        grades = self.grades[:self.filled]
+        report = {'rows': self.filled, 'scored_total': self.total, 'pairs': {}, 'by_grade': {}}
+
+        # every pair of models
+        for i in range(len(self.labels)):
+            for j in range(i + 1, len(self.labels)):
+                diff = preds[:, j] - preds[:, i]
+                ok = np.isfinite(diff)
+                if not ok.any():
+                    continue
+                diff, base = diff[ok], np.abs(preds[ok, i])
+                report['pairs'][f'{self.labels[i]} vs {self.labels[j]}'] = {
+                    'rows': int(ok.sum()),
+                    'mae': float(np.abs(diff).mean()),
+                    'mean_diff': float(diff.mean()),
+                    'p95_abs_diff': float(np.percentile(np.abs(diff), 95)),
+                    'relative_mae': float(np.mean(np.abs(diff) / np.maximum(base, 1e-9))),
+                }
+
+        # production against each candidate, per grade
+        for j, label in enumerate(self.labels[1:], start=1):
+            abs_diff = np.abs(preds[:, j] - preds[:, 0])
+            breakdown = {}
+            for g, col in enumerate(GRADE_COLUMNS):
+                per_grade = {}
+                for code, grade in enumerate(CATEGORY_DOMAINS[col]):
+                    rows = (grades[:, g] == code) & np.isfinite(abs_diff)
+                    if rows.any():
+                        per_grade[grade] = {'rows': int(rows.sum()), 'mae': float(abs_diff[rows].mean())}
+                if per_grade:
+                    breakdown[col] = per_grade
+            report['by_grade'][label] = breakdown
+
+        return report
+
+
+class ShadowScorer:
+    def __init__(self, config=None):
+        self.config = config if config is not None else ShadowConfig.from_env()
+        self.enabled = bool(self.config.candidates)
+        self._pending = deque()
+        self._pending_rows = 0
+        self._lock = threading.Lock() # pending queue, taken on the request path
+        self._buffers_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._buffers = {
+            production: ShadowBuffer([_label(production)] + [_label(path) for path in paths], self.config.buffer_size)
+            for production, paths in self.config.candidates.items()
+        }
+        self.dropped = 0
+        self.candidate_errors = {} # candidate path -> batches it failed (load or predict)
+        self.worker_cpu_seconds = 0.0
+        self._started_at = None
+
+    ## Queue stones the production model has answered; never waits
+    ## stones: a list of dicts / Series, or a DataFrame; values: the production predictions
+    def submit(self, production, columns, stones, values):
+        if not self.enabled or production not in self._buffers:
+            return
+        n_rows = len(stones)
+        with self._lock:
+            if self._pending_rows + n_rows > self.config.max_pending:
+                self.dropped += n_rows
+                dropped = True
+            else:
+                self._pending.append((production, columns, stones, values))
+                self._pending_rows += n_rows
+                dropped = False
+            full = self._pending_rows >= self.config.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='shadow-feeder', daemon=True)
+                self._thread.start()
+        if dropped:
+            metrics.inc('shadow_dropped_rows_total', n_rows, model=_label(production))
+        elif full:
+            self._wake.set()
+
+    def _take(self):
+        with self._lock:
+            items = list(self._pending)
+            self._pending.clear()
+            self._pending_rows = 0
+        return items
+
+    # one message per production model: its frames and runs of single stones (as tuples), in order
+    def _messages(self, items):
+        import pandas as pd
+
+        grouped = {}
+        for production, columns, stones, values in items:
+            _, _, parts, all_values = grouped.setdefault(production, (production, columns, [], []))
+            if isinstance(stones, pd.DataFrame):
+                parts.append(stones)
+            else:
+                if not parts or isinstance(parts[-1], pd.DataFrame):
+                    parts.append([])
+                parts[-1].extend(tuple(stone[col] for col in columns) for stone in stones)
+            all_values.append(np.asarray(values, dtype=np.float32).reshape(-1))
+        return [(production, columns, parts, np.concatenate(values))
+                for production, columns, parts, values in grouped.values()]
+
+    # feeder thread: starts the worker, then ships batches one at a time (the worker's pace sets ours)
+    def _run(self):
+        context = multiprocessing.get_context('spawn')
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=_shadow_worker, name='shadow-worker', daemon=True,
+                                  args=(child_conn, self.config.candidates, self.config.cpu_share))
+        process.start()
+        child_conn.close()
+        self._started_at = time.monotonic()
+        logging.info(f"Shadow scoring started: {self.config.candidates}, CPU share {self.config.cpu_share}")
+
+        try:
+            while not self._stopped.is_set():
+                self._wake.wait(self.config.flush_seconds)
+                self._wake.clear()
+                items = self._take()
+                for message in self._messages(items):
+                    conn.send(message)
+                    production, preds, grades, cpu_seconds, errors = conn.recv()
+                    with self._buffers_lock:
+                        self._buffers[production].add(preds, grades)
+                    self.worker_cpu_seconds = cpu_seconds
+                    for model_path, count in errors.items():
+                        new_errors = count - self.candidate_errors.get(model_path, 0)
+                        if new_errors:
+                            metrics.inc('shadow_candidate_errors_total', new_errors, model=_label(model_path))
+                    self.candidate_errors = errors
+                    metrics.inc('shadow_rows_total', len(preds), model=_label(production))
+        except (EOFError, OSError) as e:
+            logging.info(f"Shadow worker stopped: {e}, shadow scoring disabled")
+            self.enabled = False
+        finally:
+            try:
+                conn.send(None)
+            except (OSError, ValueError):
+                pass
+            conn.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    ## Disagreement of the candidates with production (and between themselves) over the buffered rows
+    def report(self):
+        try:
+            elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+            with self._buffers_lock:
+                models = {_label(production): buffer.report() for production, buffer in self._buffers.items()}
+            return {
+                'enabled': self.enabled,
+                'dropped_rows': self.dropped,
+                'candidate_errors': {_label(path): count for path, count in self.candidate_errors.items()},
+                'worker_cpu_share': self.worker_cpu_seconds / elapsed if elapsed else 0.0,
+                'models': models,
+            }
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+shadow_scorer = ShadowScorer()
@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+
+from src.exception import CustomException
+from src.logger import logging
+from src.pipeline.model_registry import model_registry
+from src.pipeline.predict_pipeline import PRICE_FEATURES, CARAT_FEATURES, prepare_batch
+from src.validation import DataValidator, quarantine_frame
+
+
+@dataclass
+class StreamPipelineConfig:
+    chunk_size: int = 50000 # rows held in memory at once (caps the peak memory)
+    target: str = 'price'
+    derive_depth: bool = True
+    checkpoint_suffix: str = '.progress.json'
+    quarantine_suffix: str = '.quarantine.csv'
+
+
+# Read an inventory file lazily in fixed-size chunks (.csv or .parquet)
+def read_chunks(file_path, chunk_size, skip_rows=0):
+    if file_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        skipped = 0
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size):
+            if skipped + batch.num_rows <= skip_rows:
+                skipped += batch.num_rows
+                continue
+            chunk = batch.to_pandas()
+            if skipped < skip_rows:
+                chunk = chunk.iloc[skip_rows - skipped:]
+                skipped = skip_rows
+            yield chunk
+    else:
+        skiprows = range(1, skip_rows + 1) if skip_rows else None
+        yield from pd.read_csv(file_path, chunksize=chunk_size, skiprows=skiprows)
+
+
+# Validate every chunk and apply the fitted ColumnTransformer on its valid rows
+# (a chunk without any valid row gives an empty matrix, the transformer rejects 0 samples)
+def transform_chunks(chunks, preprocessor, feature_columns, derive_depth=True, validator=None):
+    validator = validator or DataValidator()
+    n_outputs = None
+    for chunk in chunks:
+        features = prepare_batch(chunk, feature_columns, derive_depth)
+        result = validator.validate(features, feature_columns, check_depth=not derive_depth)
+        valid = result.valid
+        if not valid.any():
+            if n_outputs is None:
+                n_outputs = len(preprocessor.get_feature_names_out())
+            yield chunk, np.empty((0, n_outputs), dtype=np.float64), result
+            continue
+        if not valid.all():
+            features = features[valid]
+        yield chunk, preprocessor.transform(features), result
+
+
+# Run the fitted model on every preprocessed chunk (NaN for the rows that failed validation)
+def predict_chunks(transformed_chunks, model, target):
+    for chunk, matrix, result in transformed_chunks:
+        chunk = chunk.copy()
+        pred = np.full(len(chunk), np.nan, dtype=np.float32)
+        if matrix.shape[0]:
+            pred[result.valid] = model.predict(matrix)
+        chunk[f'predicted_{target}'] = pred
+        yield chunk, result
+
+
+class StreamPipeline:
+    def __init__(self, config=None, registry=None):
+        self.config = config or StreamPipelineConfig()
+        self.registry = registry or model_registry
+
+    def _checkpoint_path(self, output_path):
+        return output_path + self.config.checkpoint_suffix
+
+    def _read_checkpoint(self, output_path, input_path):
+        checkpoint_path = self._checkpoint_path(output_path)
+        if not os.path.exists(checkpoint_path):
+            return None
+
+        with open(checkpoint_path) as file_obj:
+            checkpoint = json.load(file_obj)
+
+        if checkpoint.get('input') != os.path.abspath(input_path) or checkpoint.get('chunk_size') != self.config.chunk_size:
+            raise ValueError(f"Checkpoint {checkpoint_path} belongs to another run, remove it to start over")
+
+        return checkpoint
+
+    def _write_checkpoint(self, output_path, checkpoint):
+        checkpoint_path = self._checkpoint_path(output_path)
+        tmp_path = checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as file_obj:
+            json.dump(checkpoint, file_obj)
+        os.replace(tmp_path, checkpoint_path) # atomic, never a half-written checkpoint
+
+    ## Score the input file chunk by chunk, appending to output_path
+    ## (rows that fail validation to output_path + quarantine_suffix, with their reasons)
+    ## With resume=True a crashed run continues after the last finished chunk
+    def run(self, input_path, output_path, resume=True):
+        try:
+            target = self.config.target
+            model_path = {
+                'price': self.registry.config.price_model_path,
+                'carat': self.registry.config.carat_model_path,
+            }[target]
+            feature_columns = PRICE_FEATURES if target == 'price' else CARAT_FEATURES
+
+            pipeline = self.registry.get(model_path)
+            preprocessor = pipeline.named_steps['preprocessor']
+            model = pipeline.named_steps['model']
+
+            checkpoint = self._read_checkpoint(output_path, input_path) if resume else None
+            if checkpoint is None:
+                checkpoint = {
+                    'input': os.path.abspath(input_path),
+                    'chunk_size': self.config.chunk_size,
+                    'chunks': 0,
+                    'rows': 0,
+                    'bytes': 0,
+                    'invalid_rows': 0,
+                    'quarantine_bytes': 0,
+                    'done': False,
+                }
+            elif checkpoint['done']:
+                logging.info(f"{output_path} is already complete, nothing to resume")
+                return checkpoint
+            checkpoint.setdefault('invalid_rows', 0) # checkpoints written before validation
+            checkpoint.setdefault('quarantine_bytes', 0)
+
+            dir_path = os.path.dirname(output_path)
+            if dir_path:
+                os.makedirs(dir_path, exist_ok=True)
+
+            # drop whatever a crashed run wrote after its last finished chunk
+            mode = 'r+b' if checkpoint['bytes'] and os.path.exists(output_path) else 'wb'
+            quarantine_path = output_path + self.config.quarantine_suffix
+            quarantine_mode = 'r+b' if checkpoint['quarantine_bytes'] and os.path.exists(quarantine_path) else 'wb'
+            start = time.perf_counter()
+            rows_before = checkpoint['rows']
+
+            with open(output_path, mode) as file_obj, open(quarantine_path, quarantine_mode) as quarantine_obj:
+                file_obj.seek(checkpoint['bytes'])
+                file_obj.truncate()
+                quarantine_obj.seek(checkpoint['quarantine_bytes'])
+                quarantine_obj.truncate()
+
+                chunks = read_chunks(input_path, self.config.chunk_size, skip_rows=checkpoint['rows'])
+                transformed = transform_chunks(chunks, preprocessor, feature_columns, self.config.derive_depth)
+
+                for scored, result in predict_chunks(transformed, model, target):
+                    if not result.valid.all():
+                        rejected = quarantine_frame(scored.drop(columns=[f'predicted_{target}']), result, checkpoint['rows'])
+                        quarantine_obj.write(rejected.to_csv(index=False, header=quarantine_obj.tell() == 0).encode())
+                        quarantine_obj.flush()
+                        os.fsync(quarantine_obj.fileno())
+                        checkpoint['invalid_rows'] += len(rejected)
+
+                    file_obj.write(scored.to_csv(index=False, header=checkpoint['bytes'] == 0).encode())
+                    file_obj.flush()
+                    os.fsync(file_obj.fileno())
+
+                    checkpoint['chunks'] += 1
+                    checkpoint['rows'] += len(scored)
+                    checkpoint['bytes'] = file_obj.tell()
+                    checkpoint['quarantine_bytes'] = quarantine_obj.tell()
+                    self._write_checkpoint(output_path, checkpoint)
+
+            checkpoint['done'] = True
+            self._write_checkpoint(output_path, checkpoint)
+
+            elapsed = time.perf_counter() - start
+            rows = checkpoint['rows'] - rows_before
+            logging.info(f"Streamed {rows} rows in {checkpoint['chunks']} chunks "
+                         f"({rows / elapsed if elapsed > 0 else 0:,.0f} rows/sec) into {output_path}, "
+                         f"{checkpoint['invalid_rows']} invalid rows in {quarantine_path}")
+
+            return checkpoint
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bounded-memory scoring of inventory files larger than RAM")
+    parser.add_argument('input', help="CSV or Parquet file shaped like data/diamonds.csv")
+    parser.add_argument('output', help="CSV file the predictions are appended to")
+    parser.add_argument('--target', choices=['price', 'carat'], default='price')
+    parser.add_argument('--chunk-size', type=int, default=StreamPipelineConfig.chunk_size)
+    parser.add_argument('--keep-depth', action='store_true',
+                        help="use the depth column as-is instead of deriving it from x, y, z")
+    parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = StreamPipelineConfig(chunk_size=args.chunk_size, target=args.target, derive_depth=not args.keep_depth)
+    checkpoint = StreamPipeline(config).run(args.input, args.output, resume=not args.restart)
+    print(f"{checkpoint['rows']} rows in {checkpoint['chunks']} chunks -> {args.output}")
@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import hashlib
+import builtins
+import argparse
+import importlib
+import numpy as np
+
+
+## Pickle-free container for the fitted pipelines (.dpm)
+##   magic (8 bytes) | header length (uint64) | JSON header | payload
+## The header describes the object tree: estimators as class + attribute dict, numeric arrays
+## and XGBoost boosters (native UBJSON) as blocks of the payload, everything else as JSON.
+## Blocks are 64-byte aligned, so uncompressed arrays are read straight from a memory map
+## (processes loading the same file share its pages). The header holds the sha256 of the object tree
+## and the payload together. Only scikit-learn / XGBoost estimator classes and plain numpy / builtin
+## types are rebuilt: loading never runs code from the file.
+
+MAGIC = b'DPMODEL1'
+MODEL_SUFFIX = '.dpm'
+FORMAT = 2 # 2: the checksum covers the header too
+ALIGNMENT = 64
+ALLOWED_MODULES = ('sklearn.', 'xgboost.')
+COMPRESSIONS = ('none', 'zlib')
+BUILTIN_TYPES = (bool, int, float, complex, str, bytes, object) # e.g. an encoder's dtype=float
+
+
+def _class_path(obj):
+    return f"{type(obj).__module__}.{type(obj).__qualname__}"
+
+
+def _allowed_class(path, base_modules=ALLOWED_MODULES):
+    module, _, name = path.rpartition('.')
+    if not module.startswith(base_modules):
+        raise TypeError(f"{path} is not a scikit-learn / XGBoost class")
+    cls = getattr(importlib.import_module(module), name)
+    if not isinstance(cls, type):
+        raise TypeError(f"{path} is not a class")
+    return cls
+
+
+# A type stored as a hyperparameter: numpy scalar types and a few builtins, never a function
+def _allowed_type(path):
+    module, _, name = path.rpartition('.')
+    if module == 'numpy':
+        value = getattr(np, name, None)
+        if isinstance(value, type) and issubclass(value, np.generic):
+            return value
+    elif module == 'builtins':
+        value = getattr(builtins, name, None)
+        if isinstance(value, type) and value in BUILTIN_TYPES:
+            return value
+    raise TypeError(f"Unexpected type {path}")
+
+
+# sha256 of the object tree (canonical JSON) followed by the payload
+def _checksum(meta, payload):
+    sha = hashlib.sha256(json.dumps(meta, sort_keys=True).encode())
+    sha.update(payload)
+    return sha.hexdigest()
+
+
+class _Writer:
+    def __init__(self, compression='none', level=6):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, expected one of {COMPRESSIONS}")
+        self.compression = compression
+        self.level = level
+        self.blocks = []
+        self.size = 0
+
+    def _block(self, data):
+        stored = zlib.compress(data, self.level) if self.compression == 'zlib' else data
+        offset = -(-self.size // ALIGNMENT) * ALIGNMENT
+        self.blocks.append((offset, stored))
+        self.size = offset + len(stored)
+        return {'offset': offset, 'nbytes': len(data), 'stored_nbytes': len(stored)}
+
+    def encode(self, obj):
+        if obj is None or isinstance(obj, (bool, int, float, str)):
+            return obj
+        if isinstance(obj, (list, tuple)):
+            return {'__list__' if isinstance(obj, list) else '__tuple__': [self.encode(item) for item in obj]}
+        if isinstance(obj, dict):
+            return {'__dict__': [[self.encode(key), self.encode(value)] for key, value in obj.items()]}
+        if isinstance(obj, slice):
+            return {'__slice__': [obj.start, obj.stop, obj.step]}
+        if isinstance(obj, np.generic):
+            return {'__scalar__': obj.item(), 'dtype': obj.dtype.str}
+        if isinstance(obj, type) and obj.__module__ in ('numpy', 'builtins'):
+            path = f"{obj.__module__}.{obj.__name__}"
+            _allowed_type(path) # only what load_model accepts back
+            return {'__type__': path}
+        if isinstance(obj, np.ndarray):
+            if obj.dtype.hasobject:
+                return {'__objects__': [self.encode(item) for item in obj.ravel().tolist()], 'shape': obj.shape}
+            data = np.ascontiguousarray(obj)
+            return {'__array__': self._block(data.tobytes()), 'dtype': data.dtype.str, 'shape': data.shape}
+
+        module = type(obj).__module__
+        if module.startswith('pandas') and type(obj).__name__ == 'Index':
+            return {'__index__': self.encode(obj.to_numpy()), 'name': obj.name}
+        if _class_path(obj) == 'xgboost.core.Booster':
+            return {'__booster__': self._block(bytes(obj.save_raw(raw_format='ubj')))}
+        if module.startswith(ALLOWED_MODULES):
+            return {'__estimator__': _class_path(obj), 'state': self.encode(dict(vars(obj)))}
+
+        raise TypeError(f"Can't store {type(obj).__name__} in a {MODEL_SUFFIX} file")
+
+
+class _Reader:
+    def __init__(self, buffer, payload_offset, compression):
+        self.buffer = buffer
+        self.payload_offset = payload_offset
+        self.compression = compression
+
+    def _block(self, block):
+        start = self.payload_offset + block['offset']
+        data = memoryview(self.buffer)[start:start + block['stored_nbytes']]
+        if self.compression == 'zlib':
+            return zlib.decompress(data)
+        return data
+
+    def decode(self, obj):
+        if not isinstance(obj, dict):
+            return obj
+        if '__list__' in obj:
+            return [self.decode(item) for item in obj['__list__']]
+        if '__tuple__' in obj:
+            return tuple(self.decode(item) for item in obj['__tuple__'])
+        if '__dict__' in obj:
+            return {self.decode(key): self.decode(value) for key, value in obj['__dict__']}
+        if '__slice__' in obj:
+            return slice(*obj['__slice__'])
+        if '__scalar__' in obj:
+            return np.dtype(obj['dtype']).type(obj['__scalar__'])
+        if '__type__' in obj:
+            return _allowed_type(obj['__type__'])
+        if '__objects__' in obj:
+            values = [self.decode(item) for item in obj['__objects__']]
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            return array.reshape(obj['shape'])
+        if '__array__' in obj:
+            # zero-copy, read-only view of the memory map when the file is not compressed
+            return np.frombuffer(self._block(obj['__array__']), dtype=np.dtype(obj['dtype'])).reshape(obj['shape'])
+        if '__index__' in obj:
+            import pandas as pd
+            return pd.Index(self.decode(obj['__index__']), name=obj['name'])
+        if '__booster__' in obj:
+            from xgboost import Booster
+            booster = Booster()
+            booster.load_model(bytearray(self._block(obj['__booster__'])))
+            return booster
+        if '__estimator__' in obj:
+            cls = _allowed_class(obj['__estimator__'])
+            estimator = cls.__new__(cls) # fitted state is restored as is, no __init__ / fit
+            estimator.__dict__.update(self.decode(obj['state']))
+            return estimator
+
+        raise ValueError(f"Corrupted {MODEL_SUFFIX} header: unknown entry {sorted(obj)[:3]}")
+
+
+## Write a fitted pipeline; compression='zlib' gives smaller files but arrays are then copied on load
+def dump_model(obj, file_path, compression='none', level=6):
+    writer = _Writer(compression, level)
+    tree = writer.encode(obj)
+
+    payload = bytearray(writer.size)
+    for offset, stored in writer.blocks:
+        payload[offset:offset + len(stored)] = stored
+
+    meta = {
+        'format': FORMAT,
+        'compression': compression,
+        'payload_nbytes': len(payload),
+        'tree': tree,
+    }
+    header = json.dumps({**meta, 'sha256': _checksum(meta, payload)}).encode()
+    header_end = len(MAGIC) + 8 + len(header)
+    padding = -header_end % ALIGNMENT
+
+    dir_path = os.path.dirname(file_path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as file_obj:
+        file_obj.write(MAGIC)
+        file_obj.write(struct.pack('<Q', len(header) + padding))
+        file_obj.write(header)
+        file_obj.write(b' ' * padding) # JSON allows trailing whitespace
+        file_obj.write(payload)
+    os.replace(tmp_path, file_path)
+
+
+## Load a .dpm file, memory-mapped; verify=False skips the sha256 of the header and payload
+def load_model(file_path, verify=True):
+    with open(file_path, 'rb') as file_obj:
+        if file_obj.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{file_path} is not a {MODEL_SUFFIX} file")
+        (header_nbytes,) = struct.unpack('<Q', file_obj.read(8))
+        header = json.loads(file_obj.read(header_nbytes))
+        buffer = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if header.get('format') != FORMAT:
+        raise ValueError(f"{file_path} is in an older {MODEL_SUFFIX} format, convert the pickle again")
+    payload_offset = len(MAGIC) + 8 + header_nbytes
+    if len(buffer) - payload_offset != header['payload_nbytes']:
+        raise ValueError(f"{file_path} is truncated")
+    if verify:
+        meta = {key: value for key, value in header.items() if key != 'sha256'}
+        if _checksum(meta, memoryview(buffer)[payload_offset:]) != header.get('sha256'):
+            raise ValueError(f"{file_path} failed its checksum")
+
+    return _Reader(buffer, payload_offset, header['compression']).decode(header['tree'])
+
+
+# Convert a pickled pipeline and check that both give the same predictions
+def convert(pickle_path, output_path=None, compression='none', data_path=os.path.join('data', 'diamonds.csv')):
+    import time
+    import pandas as pd
+    from src.exception import CustomException
+    from src.utils import load_object
+
+    try:
+        output_path = output_path or os.path.splitext(pickle_path)[0] + MODEL_SUFFIX
+        pipeline = load_object(pickle_path)
+        dump_model(pipeline, output_path, compression)
+
+        start = time.perf_counter()
+        load_object(pickle_path)
+        pickle_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loaded = load_model(output_path)
+        model_seconds = time.perf_counter() - start
+
+        data = pd.read_csv(data_path).head(5000)
+        features = data[[col for col in pipeline.feature_names_in_]] if hasattr(pipeline, 'feature_names_in_') else data
+        if not np.array_equal(pipeline.predict(features), loaded.predict(features)):
+            raise ValueError(f"{output_path} predicts differently from {pickle_path}")
+
+        return {
+            'output': output_path,
+            'pickle_bytes': os.path.getsize(pickle_path),
+            'model_bytes': os.path.getsize(output_path),
+            'pickle_load_ms': pickle_seconds * 1000,
+            'model_load_ms': model_seconds * 1000,
+        }
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=f"Convert pickled pipelines to {MODEL_SUFFIX} files")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='none')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for path in args.paths:
+        print(json.dumps(convert(path, compression=args.compression), indent=2))
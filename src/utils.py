@@ -1,38 +1,66 @@
 import os
 import sys
+import hashlib
 import numpy as np
 import pickle
 
-from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
-
 from src.exception import CustomException
+from src.serialization import MAGIC, MODEL_SUFFIX, dump_model, load_model
 
 
 # Save the Preprocessing Transformer Object
+# written next to the target and renamed over it, readers never see a half-written artifact
+# (.dpm paths get the pickle-free model format of src/serialization.py)
 def save_object(file_path, obj):
     try:
         dir_path = os.path.dirname(file_path)
 
         os.makedirs(dir_path, exist_ok=True)
 
-        with open(file_path, "wb") as file_obj:
+        if file_path.endswith(MODEL_SUFFIX):
+            dump_model(obj, file_path)
+            return
+
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "wb") as file_obj:
             pickle.dump(obj, file_obj)
+        os.replace(tmp_path, file_path)
 
     except Exception as e:
         raise CustomException(e, sys)
     
 # Define the evaluation function
 def evaluate_model(true, predicted):
+    from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error # only needed when training
+
     mae = mean_absolute_error(true, predicted)
     rmse = np.sqrt(mean_squared_error(true, predicted))
     r2 = r2_score(true, predicted)
     return mae, rmse, r2
 
-# Load object
+# Load object (pickle, or a memory-mapped .dpm model file)
 def load_object(file_path):
     try:
         with open(file_path, "rb") as file_obj:
+            if file_obj.read(len(MAGIC)) == MAGIC:
+                return load_model(file_path)
+            file_obj.seek(0)
             return pickle.load(file_obj)
 
     except Exception as e:
-        raise CustomException(e, sys)
\ No newline at end of file
+        raise CustomException(e, sys)
+
+
+# Fingerprint of the artifact on disk (cheap, no read of the content)
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+# Content hash of a file (sha256)
+def file_digest(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
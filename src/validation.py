@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass, field
+
+from src.dataset import CUT_ORDER, COLOR_ORDER, CLARITY_ORDER
+
+
+## Schema and rule checks for stones, run over whole columns at once
+## Shared by DataIngestion (training data) and the prediction paths (single / batch / stream).
+## Every failed check sets one bit of a per-row reason code, rows with a code are quarantined
+## to a side file with their reasons instead of reaching the model.
+
+CATEGORY_DOMAINS = {'cut': CUT_ORDER, 'color': COLOR_ORDER, 'clarity': CLARITY_ORDER}
+NUMERIC_COLUMNS = ['carat', 'depth', 'table', 'price', 'x', 'y', 'z']
+DIMENSION_COLUMNS = ['x', 'y', 'z']
+
+# one bit per reason, in this order
+REASONS = (
+    [f'missing:{col}' for col in list(CATEGORY_DOMAINS) + NUMERIC_COLUMNS]
+    + [f'unknown:{col}' for col in CATEGORY_DOMAINS]
+    + [f'range:{col}' for col in NUMERIC_COLUMNS]
+    + ['zero_dimension', 'depth_mismatch']
+)
+REASON_BITS = {reason: np.uint32(1 << i) for i, reason in enumerate(REASONS)}
+
+
+@dataclass
+class ValidationConfig:
+    # plausible values of a stone (mm for x, y, z); the dataset's y = 58.9 and z = 31.8 are typos
+    ranges: dict = field(default_factory=lambda: {
+        'carat': (0.1, 6.0), 'depth': (40.0, 80.0), 'table': (40.0, 100.0), 'price': (1.0, 1e6),
+        'x': (0.0, 20.0), 'y': (0.0, 20.0), 'z': (0.0, 20.0),
+    })
+    depth_tolerance: float = 1.0 # percentage points between depth and 2*z/(x+y)*100
+
+
+class ValidationResult:
+    def __init__(self, codes):
+        self.codes = codes
+
+    @property
+    def valid(self):
+        return self.codes == 0
+
+    def __len__(self):
+        return len(self.codes)
+
+    # failed rows per reason
+    def counts(self):
+        return {reason: int(np.count_nonzero(self.codes & bit)) for reason, bit in REASON_BITS.items()
+                if np.any(self.codes & bit)}
+
+    # 'range:y|depth_mismatch' per row ('' for valid rows), built once per distinct code
+    def reasons(self):
+        unique, inverse = np.unique(self.codes, return_inverse=True)
+        labels = np.array(['|'.join(reason for reason, bit in REASON_BITS.items() if code & bit) for code in unique],
+                          dtype=object)
+        return labels[inverse.reshape(-1)]
+
+
+def _numeric(values):
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+
+
+class DataValidator:
+    def __init__(self, config=None):
+        self.config = config or ValidationConfig()
+
+    ## Check the `columns` of data (all the known ones it has by default)
+    ## data: DataFrame, or a dict of columns / of the values of one stone
+    ## check_depth=False when the depth is derived from x, y, z afterwards anyway
+    def validate(self, data, columns=None, check_depth=True):
+        names = data.columns if isinstance(data, pd.DataFrame) else data.keys()
+        known = list(CATEGORY_DOMAINS) + NUMERIC_COLUMNS
+        columns = [col for col in known if col in names] if columns is None else list(columns)
+        missing = [col for col in columns if col not in names and not (col == 'depth' and not check_depth)]
+        if missing:
+            raise ValueError(f"Input is missing the column(s): {missing}")
+
+        n_rows = len(data) if isinstance(data, pd.DataFrame) else len(np.atleast_1d(data[columns[0]]))
+        codes = np.zeros(n_rows, dtype=np.uint32)
+        numeric = {}
+
+        for col in columns:
+            if col in CATEGORY_DOMAINS:
+                values = np.atleast_1d(np.asarray(data[col], dtype=object))
+                is_missing = pd.isna(values)
+                codes[is_missing] |= REASON_BITS[f'missing:{col}']
+                unknown = ~is_missing & ~np.isin(values.astype(str), CATEGORY_DOMAINS[col])
+                codes[unknown] |= REASON_BITS[f'unknown:{col}']
+
+            elif col in NUMERIC_COLUMNS and col in names:
+                values = np.atleast_1d(_numeric(data[col]))
+                numeric[col] = values
+                is_missing = np.isnan(values)
+                codes[is_missing] |= REASON_BITS[f'missing:{col}']
+                low, high = self.config.ranges[col]
+                codes[~is_missing & ((values < low) | (values > high))] |= REASON_BITS[f'range:{col}']
+
+        if all(col in numeric for col in DIMENSION_COLUMNS):
+            x, y, z = (numeric[col] for col in DIMENSION_COLUMNS)
+            codes[(x <= 0) | (y <= 0) | (z <= 0)] |= REASON_BITS['zero_dimension']
+
+            if check_depth and 'depth' in numeric:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    derived = np.round(2 * z / (x + y), 3) * 100
+                    mismatch = np.isfinite(derived) & (np.abs(numeric['depth'] - derived) > self.config.depth_tolerance)
+                codes[mismatch] |= REASON_BITS['depth_mismatch']
+
+        return ValidationResult(codes)
+
+    ## Valid rows (fresh 0..n index), and the others written to `quarantine_path` if given
+    def split(self, data, columns=None, check_depth=True, quarantine_path=None, append=False):
+        result = self.validate(data, columns, check_depth)
+        valid = result.valid
+        if quarantine_path is not None:
+            write_quarantine(data, result, quarantine_path, append)
+        if valid.all():
+            return data, result
+        return data[valid].reset_index(drop=True), result
+
+
+# Rejected rows with their reasons; `row` is the position in the input (+ row_offset for chunks)
+def quarantine_frame(data, result, row_offset=0):
+    invalid = ~result.valid
+    rejected = data[invalid].copy()
+    rejected.insert(0, 'row', np.flatnonzero(invalid) + row_offset)
+    rejected['reason'] = result.reasons()[invalid]
+    return rejected
+
+
+def write_quarantine(data, result, file_path, append=False):
+    rejected = quarantine_frame(data, result)
+    dir_path = os.path.dirname(file_path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+    header = not (append and os.path.exists(file_path) and os.path.getsize(file_path) > 0)
+    rejected.to_csv(file_path, mode='a' if append else 'w', index=False, header=header)
+    return len(rejected)